@@ -1,8 +1,11 @@
 import typing
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from datetime import datetime
 from .database import Database
+from .retention import RetentionJob
+from .serialization import COMPRESSION_MIN_SIZE, FastJSONResponse
 from .websocket_manager import ConnectionManager
 
 # --- Monkey Patch for typing.ForwardRef --- START ---
@@ -27,7 +30,8 @@ def datetime_serializer(obj):
 # --- JSON Serializer for Datetime --- END ---
 
 # --- FastAPI App Initialization --- START ---
-app = FastAPI()
+# Respostas REST usam o mesmo encoder rápido dos frames do WebSocket
+app = FastAPI(default_response_class=FastJSONResponse)
 # --- FastAPI App Initialization --- END ---
 
 # --- Database Connection --- START ---
@@ -38,6 +42,10 @@ db = Database()
 manager = ConnectionManager() # manager now uses db from this module
 # --- WebSocket Connection Manager --- END ---
 
+# --- Retention Job --- START ---
+retention = RetentionJob(db)
+# --- Retention Job --- END ---
+
 # --- CORS Middleware Configuration --- START ---
 app.add_middleware(
     CORSMiddleware,
@@ -48,13 +56,24 @@ app.add_middleware(
 )
 # --- CORS Middleware Configuration --- END ---
 
+# --- GZip Middleware Configuration --- START ---
+# Listas grandes (itens, habilidades, NPCs, histórico) são JSON muito repetitivo
+app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+# --- GZip Middleware Configuration --- END ---
+
 # --- Startup and Shutdown Events --- START ---
 @app.on_event("startup")
 async def startup_event():
     await db.connect()
+    # LISTEN/NOTIFY: eventos de outros workers chegam aos sockets deste processo
+    await manager.bus.start()
+    # Poda periódica do histórico de dados
+    retention.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await retention.stop()
+    await manager.bus.stop()
     await db.close()
 # --- Startup and Shutdown Events --- END ---
 
@@ -0,0 +1,82 @@
+"""Benchmark do custo de CPU da serialização dos broadcasts.
+
+Compara o caminho antigo (json da stdlib com `default=datetime_serializer`)
+com o encoder de `serialization` nos frames mais frequentes: a lista de
+usuários (uma entrada por usuário, por classe de visibilidade) e o snapshot
+de entrada com o histórico de mensagens.
+
+    python -m backend.bench_serialization [--users 40] [--messages 100] [--rounds 2000]
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from .serialization import ENCODER, dumps, dumps_text
+
+def datetime_serializer(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+def make_users(count):
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": f"user-{i}", "nickname": f"Jogador {i}", "isMaster": i == 0,
+            "characterId": f"{i:03d}", "healthPoints": 10, "maxHealthPoints": 12,
+            "diceResults": [20, 3, 14], "campaignId": "default", "isNpc": False,
+            "masterCode": None, "createdAt": now - timedelta(days=i),
+        }
+        for i in range(count)
+    ]
+
+def make_messages(count):
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": f"msg-{i}", "seq": i, "userId": "user-1", "nickname": "Jogador 1",
+            "content": "Ataco o goblin com a espada longa " * 2, "timestamp": now - timedelta(seconds=i),
+            "isDiceRoll": i % 3 == 0, "diceType": "d20", "diceResult": 17, "campaignId": "default",
+        }
+        for i in range(count)
+    ]
+
+def users_frame_stdlib(users):
+    master = [json.dumps(u, default=datetime_serializer) for u in users]
+    player = [json.dumps({k: v for k, v in u.items() if k != "characterId"}, default=datetime_serializer) for u in users]
+    return ('{"type": "users", "data": [' + ', '.join(master) + ']}',
+            '{"type": "users", "data": [' + ', '.join(player) + ']}')
+
+def users_frame_fast(users):
+    master = [dumps(u) for u in users]
+    player = [dumps({k: v for k, v in u.items() if k != "characterId"}) for u in users]
+    return ((b'{"type":"users","data":[' + b','.join(master) + b']}').decode(),
+            (b'{"type":"users","data":[' + b','.join(player) + b']}').decode())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    users = make_users(args.users)
+    snapshot = {"type": "snapshot", "data": {"users": users, "messages": make_messages(args.messages)}}
+
+    cases = [
+        ("users broadcast", lambda: users_frame_stdlib(users), lambda: users_frame_fast(users)),
+        ("join snapshot", lambda: json.dumps(snapshot, default=datetime_serializer), lambda: dumps_text(snapshot)),
+    ]
+    print(f"encoder: {ENCODER}, {args.users} users, {args.messages} messages, {args.rounds} rounds")
+    for name, baseline, fast in cases:
+        baseline_time = timeit.timeit(baseline, number=args.rounds)
+        fast_time = timeit.timeit(fast, number=args.rounds)
+        print(
+            f"{name:16} stdlib {baseline_time / args.rounds * 1e6:8.1f} us"
+            f"  {ENCODER} {fast_time / args.rounds * 1e6:8.1f} us"
+            f"  ({baseline_time / fast_time:.1f}x)"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,16 @@
 import os
 import asyncpg
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from dotenv import load_dotenv
 from pathlib import Path
+from .user_directory import UserDirectory, RECENT_DICE_RESULTS
+from .migrations import SEARCH_CONFIG, run_migrations
+from .message_archive import archived_messages
+from .serialization import dumps_text, encode_cursor, loads
+
+# Mesa (campanha) usada quando nenhuma é informada
+DEFAULT_CAMPAIGN = "default"
 
 # Explicitly define the path to the .env file relative to this file's directory
 env_path = Path(__file__).resolve().parent / '.env'
@@ -11,243 +20,137 @@ load_dotenv(dotenv_path=env_path)
 DATABASE_URL = os.getenv("DATABASE_URL")
 print(f"--- Attempting to use DATABASE_URL: {DATABASE_URL} ---")
 
+# Conexão e callbacks pós-commit da unidade de trabalho em andamento (por task)
+_current_unit = ContextVar("rpgfast_unit_of_work", default=None)
+
+# Usuários com os últimos resultados de dados, em uma única consulta; usada só
+# para (re)carregar o diretório em memória, que mantém esses resultados depois
+USERS_QUERY = f'''
+    SELECT u.*,
+           ARRAY(
+               SELECT d.result FROM dice_results d
+               WHERE d.user_id = u.id
+               ORDER BY d.timestamp DESC
+               LIMIT {RECENT_DICE_RESULTS}
+           ) AS dice_results
+    FROM users u
+'''
+
+# Ficha completa do personagem como um único documento JSON
+CHARACTER_QUERY = '''
+    SELECT json_build_object(
+        'userId', u.id,
+        'characterId', u.character_id,
+        'attributes', (
+            SELECT json_build_object(
+                'strength', a.strength, 'dexterity', a.dexterity,
+                'constitution', a.constitution, 'intelligence', a.intelligence,
+                'wisdom', a.wisdom, 'charisma', a.charisma
+            )
+            FROM attributes a WHERE a.user_id = u.id LIMIT 1
+        ),
+        'skills', COALESCE((
+            SELECT json_agg(json_build_object(
+                'name', s.name, 'value', s.value, 'proficient', s.proficient
+            ) ORDER BY s.id)
+            FROM skills s WHERE s.user_id = u.id
+        ), '[]'::json),
+        'abilities', COALESCE((
+            SELECT json_agg(json_build_object(
+                'id', ab.id, 'name', ab.name, 'description', ab.description
+            ))
+            FROM abilities ab WHERE ab.user_id = u.id
+        ), '[]'::json),
+        'inventory', COALESCE((
+            SELECT json_agg(json_build_object(
+                'id', i.id, 'name', i.name, 'description', i.description, 'quantity', i.quantity
+            ))
+            FROM inventory i WHERE i.user_id = u.id
+        ), '[]'::json),
+        'currency', (
+            SELECT json_build_object('bronze', c.bronze, 'silver', c.silver, 'gold', c.gold)
+            FROM currency c WHERE c.user_id = u.id LIMIT 1
+        )
+    )
+    FROM users u
+'''
+
+# Colunas de messages enviadas ao frontend (o search_vector fica só no banco)
+MESSAGE_COLUMNS = 'id, seq, campaign_id, user_id, nickname, content, timestamp, is_dice_roll, dice_type, dice_result'
+
 class Database:
     def __init__(self):
         self.pool = None
+        self.users = UserDirectory()
+
+    @staticmethod
+    async def _init_connection(conn):
+        # Colunas json/jsonb (ex.: documentos montados com json_build_object) já chegam como dict/list
+        for type_name in ('json', 'jsonb'):
+            await conn.set_type_codec(type_name, encoder=dumps_text, decoder=loads, schema='pg_catalog')
 
     async def connect(self):
-        self.pool = await asyncpg.create_pool(DATABASE_URL)
-        await self.create_tables()
+        self.pool = await asyncpg.create_pool(DATABASE_URL, init=self._init_connection)
+        async with self.pool.acquire() as conn:
+            await run_migrations(conn)
+        await self.load_user_directory()
 
     async def close(self):
         if self.pool:
             await self.pool.close()
 
-    async def create_tables(self):
-        async with self.pool.acquire() as conn:
-            # Tabela de usuários
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id TEXT PRIMARY KEY,
-                    nickname TEXT NOT NULL,
-                    is_master BOOLEAN NOT NULL DEFAULT FALSE,
-                    character_id TEXT UNIQUE,
-                    master_code TEXT,
-                    health_points INTEGER NOT NULL DEFAULT 10,
-                    max_health_points INTEGER NOT NULL DEFAULT 10,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Tabela de mensagens
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS messages (
-                    id TEXT PRIMARY KEY,
-                    user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    nickname TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    is_dice_roll BOOLEAN DEFAULT FALSE,
-                    dice_type TEXT,
-                    dice_result INTEGER
-                )
-            ''')
-
-            # Tabela de resultados de dados
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS dice_results (
-                    id SERIAL PRIMARY KEY,
-                    user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    result INTEGER NOT NULL,
-                    timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Tabela de atributos
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS attributes (
-                    id SERIAL PRIMARY KEY,
-                    user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    strength INTEGER NOT NULL DEFAULT 10,
-                    dexterity INTEGER NOT NULL DEFAULT 10,
-                    constitution INTEGER NOT NULL DEFAULT 10,
-                    intelligence INTEGER NOT NULL DEFAULT 10,
-                    wisdom INTEGER NOT NULL DEFAULT 10,
-                    charisma INTEGER NOT NULL DEFAULT 10
-                )
-            ''')
-
-            # Tabela de perícias
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS skills (
-                    id SERIAL PRIMARY KEY,
-                    user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    name TEXT NOT NULL,
-                    value INTEGER NOT NULL DEFAULT 0,
-                    proficient BOOLEAN NOT NULL DEFAULT FALSE
-                )
-            ''')
-
-            # Tabela de habilidades
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS abilities (
-                    id TEXT PRIMARY KEY,
-                    user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    name TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    type TEXT,
-                    cost TEXT,
-                    range TEXT,
-                    duration TEXT,
-                    effect TEXT,
-                    is_public BOOLEAN NOT NULL DEFAULT FALSE,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Tabela de inventário
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS inventory (
-                    id TEXT PRIMARY KEY,
-                    user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    name TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    quantity INTEGER NOT NULL DEFAULT 1,
-                    type TEXT,
-                    rarity TEXT,
-                    value TEXT,
-                    weight TEXT,
-                    effect TEXT
-                )
-            ''')
-
-            # Tabela de moedas
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS currency (
-                    id SERIAL PRIMARY KEY,
-                    user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    bronze INTEGER NOT NULL DEFAULT 0,
-                    silver INTEGER NOT NULL DEFAULT 0,
-                    gold INTEGER NOT NULL DEFAULT 0
-                )
-            ''')
-
-            # Tabela de NPCs
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS npcs (
-                    id TEXT PRIMARY KEY,
-                    master_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    nickname TEXT NOT NULL,
-                    health_points INTEGER NOT NULL DEFAULT 10,
-                    max_health_points INTEGER NOT NULL DEFAULT 10,
-                    show_health_bar BOOLEAN NOT NULL DEFAULT TRUE,
-                    health_bar_color TEXT DEFAULT 'green',
-                    show_in_chat BOOLEAN NOT NULL DEFAULT FALSE,
-                    notes TEXT,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Tabela de atributos de NPCs
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS npc_attributes (
-                    id SERIAL PRIMARY KEY,
-                    npc_id TEXT NOT NULL REFERENCES npcs(id) ON DELETE CASCADE,
-                    strength INTEGER NOT NULL DEFAULT 10,
-                    dexterity INTEGER NOT NULL DEFAULT 10,
-                    constitution INTEGER NOT NULL DEFAULT 10,
-                    intelligence INTEGER NOT NULL DEFAULT 10,
-                    wisdom INTEGER NOT NULL DEFAULT 10,
-                    charisma INTEGER NOT NULL DEFAULT 10
-                )
-            ''')
-
-            # Tabela de perícias de NPCs
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS npc_skills (
-                    id SERIAL PRIMARY KEY,
-                    npc_id TEXT NOT NULL REFERENCES npcs(id) ON DELETE CASCADE,
-                    name TEXT NOT NULL,
-                    value INTEGER NOT NULL DEFAULT 0,
-                    proficient BOOLEAN NOT NULL DEFAULT FALSE
-                )
-            ''')
-
-            # Tabela de habilidades de NPCs
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS npc_abilities (
-                    id TEXT PRIMARY KEY,
-                    npc_id TEXT NOT NULL REFERENCES npcs(id) ON DELETE CASCADE,
-                    name TEXT NOT NULL,
-                    description TEXT NOT NULL
-                )
-            ''')
-
-            # Tabela de inventário de NPCs
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS npc_inventory (
-                    id TEXT PRIMARY KEY,
-                    npc_id TEXT NOT NULL REFERENCES npcs(id) ON DELETE CASCADE,
-                    name TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    quantity INTEGER NOT NULL DEFAULT 1
-                )
-            ''')
-
-            # Tabela de itens compartilhados
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS shared_items (
-                    id TEXT PRIMARY KEY,
-                    master_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    name TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    type TEXT,
-                    rarity TEXT,
-                    value TEXT,
-                    weight TEXT,
-                    effect TEXT,
-                    is_public BOOLEAN NOT NULL DEFAULT FALSE,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Tabela de habilidades compartilhadas
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS shared_abilities (
-                    id TEXT PRIMARY KEY,
-                    master_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    name TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    type TEXT,
-                    cost TEXT,
-                    range TEXT,
-                    duration TEXT,
-                    effect TEXT,
-                    is_public BOOLEAN NOT NULL DEFAULT FALSE,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Tabela de notas do mestre
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS master_notes (
-                    id TEXT PRIMARY KEY,
-                    master_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    title TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    category TEXT NOT NULL,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """Executa todas as chamadas ao Database feitas dentro do bloco em uma
+        única conexão do pool e em uma única transação.
+
+        As alterações no diretório de usuários só são aplicadas depois do
+        commit; se o bloco falhar, nada é gravado. Unidades aninhadas reutilizam
+        a transação externa. Não use asyncio.gather dentro do bloco: a conexão
+        atende uma consulta por vez.
+        """
+        if _current_unit.get() is not None:
+            yield
+            return
+
+        after_commit = []
+        async with self.pool.acquire() as conn:
+            token = _current_unit.set((conn, after_commit))
+            try:
+                async with conn.transaction():
+                    yield
+            finally:
+                _current_unit.reset(token)
+        for callback in after_commit:
+            callback()
+
+    @asynccontextmanager
+    async def _connection(self):
+        """Conexão da unidade de trabalho atual ou, fora dela, uma do pool."""
+        unit = _current_unit.get()
+        if unit is not None:
+            yield unit[0]
+            return
+        async with self.pool.acquire() as conn:
+            yield conn
+
+    @staticmethod
+    def _after_commit(callback):
+        """Adia `callback` para o fim da unidade de trabalho atual (ou executa já, fora dela)."""
+        unit = _current_unit.get()
+        if unit is not None:
+            unit[1].append(callback)
+        else:
+            callback()
 
     # Métodos para usuários
-    async def create_user(self, user_id, nickname, is_master, character_id=None, master_code=None):
-        async with self.pool.acquire() as conn:
+    async def create_user(self, user_id, nickname, is_master, character_id=None, master_code=None, campaign_id=DEFAULT_CAMPAIGN):
+        async with self._connection() as conn:
             # Use master_code only if the user is a master
             code_to_insert = master_code if is_master else None
-            await conn.execute(
-                'INSERT INTO users (id, nickname, is_master, character_id, master_code) VALUES ($1, $2, $3, $4, $5)',
-                user_id, nickname, is_master, character_id, code_to_insert
+            user = await conn.fetchrow(
+                'INSERT INTO users (id, nickname, is_master, character_id, master_code, campaign_id) VALUES ($1, $2, $3, $4, $5, $6) RETURNING *',
+                user_id, nickname, is_master, character_id, code_to_insert, campaign_id
             )
             
             # Criar atributos padrão
@@ -268,41 +171,53 @@ class Database:
                 "História", "Natureza", "Percepção", "Persuasão"
             ]
             
-            for skill in skills:
-                await conn.execute(
-                    'INSERT INTO skills (user_id, name) VALUES ($1, $2)',
-                    user_id, skill
-                )
+            await conn.executemany(
+                'INSERT INTO skills (user_id, name) VALUES ($1, $2)',
+                [(user_id, skill) for skill in skills]
+            )
 
-    async def get_users(self):
-        """Fetches all users and NPCs marked as 'showInChat=True'"""
-        async with self.pool.acquire() as conn:
-            # Fetch users
-            users_query = 'SELECT * FROM users'
-            users_records = await conn.fetch(users_query)
+            user_data = dict(user)
+            user_data['dice_results'] = []
+            user_data = self._format_user(user_data)
+            self._after_commit(lambda: self.users.put(user_data))
+
+    async def get_users(self, campaign_id=DEFAULT_CAMPAIGN):
+        """Fetches the campaign's users and NPCs marked as 'showInChat=True'"""
+        async with self._connection() as conn:
+            # Os últimos dados vêm do buffer em memória, sem ler dice_results
+            users_records = await conn.fetch('SELECT * FROM users WHERE campaign_id = $1', campaign_id)
+
+            # Usuários fora do diretório (criados em outro worker ou descartados
+            # por forget_campaign): os últimos dados vêm do banco e semeiam o buffer
+            missing = [user['id'] for user in users_records if user['id'] not in self.users]
+            loaded_dice = {}
+            if missing:
+                loaded = [
+                    self._format_user(user)
+                    for user in await conn.fetch(USERS_QUERY + ' WHERE u.id = ANY($1::TEXT[])', missing)
+                ]
+                loaded_dice = {user['id']: list(user['diceResults']) for user in loaded}
+                self._after_commit(lambda: [self.users.put(user) for user in loaded])
 
             # Fetch NPCs marked as visible
-            npcs_query = 'SELECT * FROM npcs WHERE show_in_chat = TRUE'
-            npcs_records = await conn.fetch(npcs_query)
+            npcs_query = 'SELECT * FROM npcs WHERE campaign_id = $1 AND show_in_chat = TRUE'
+            npcs_records = await conn.fetch(npcs_query, campaign_id)
 
             result = [] # Combined list
 
             # Process users
             for user in users_records:
-                # Obter resultados de dados
-                dice_results = await conn.fetch(
-                    # Limit dice results fetched per user for performance
-                    'SELECT result FROM dice_results WHERE user_id = $1 ORDER BY timestamp DESC LIMIT 3',
-                    user['id']
-                )
-
                 user_data = dict(user)
-                user_data['diceResults'] = [r['result'] for r in dice_results]
+                if user_data['id'] in loaded_dice:
+                    user_data['diceResults'] = loaded_dice[user_data['id']]
+                else:
+                    user_data['diceResults'] = self.users.recent_dice(user_data['id'])
                 user_data['isMaster'] = user_data.pop('is_master', False)
                 user_data['healthPoints'] = user_data.get('health_points', 10) # Use get to avoid popping non-existent keys sometimes
                 user_data['maxHealthPoints'] = user_data.get('max_health_points', 10)
                 user_data['characterId'] = user_data.pop('character_id', None)
                 user_data['createdAt'] = user_data.pop('created_at')
+                user_data['campaignId'] = user_data.pop('campaign_id')
                 user_data['isNpc'] = False # Explicitly mark as not NPC
 
                 result.append(user_data)
@@ -318,6 +233,7 @@ class Database:
                 npc_data['healthBarColor'] = npc_data.pop('health_bar_color', 'green')
                 npc_data['showInChat'] = npc_data.pop('show_in_chat', True) # Should be true here
                 npc_data['masterId'] = npc_data.pop('master_id', None) # Keep masterId if needed frontend
+                npc_data['campaignId'] = npc_data.pop('campaign_id')
                 npc_data['diceResults'] = [] # NPCs don't have dice history in this structure
                 # Add other fields if needed by CharacterCard, ensure consistency
 
@@ -325,193 +241,276 @@ class Database:
 
             return result
 
-    async def get_user(self, user_id):
-        async with self.pool.acquire() as conn:
-            user = await conn.fetchrow('SELECT * FROM users WHERE id = $1', user_id)
+    @staticmethod
+    def _format_user(user):
+        user_data = dict(user)
+        user_data['diceResults'] = list(user_data.pop('dice_results'))
+        user_data['isMaster'] = user_data.pop('is_master', False)
+        user_data['healthPoints'] = user_data.pop('health_points', 10)
+        user_data['maxHealthPoints'] = user_data.pop('max_health_points', 10)
+        user_data['characterId'] = user_data.pop('character_id', None)
+        user_data['createdAt'] = user_data.pop('created_at')
+        user_data['campaignId'] = user_data.pop('campaign_id')
+        return user_data
+
+    async def load_user_directory(self):
+        """Carrega todos os usuários no diretório em memória."""
+        async with self._connection() as conn:
+            users = await conn.fetch(USERS_QUERY)
+            self.users.load([self._format_user(user) for user in users])
+
+    async def fetch_user(self, user_id):
+        """Lê o usuário do banco e atualiza a entrada no diretório."""
+        async with self._connection() as conn:
+            user = await conn.fetchrow(USERS_QUERY + ' WHERE u.id = $1', user_id)
             
             if not user:
+                self._after_commit(lambda: self.users.remove(user_id))
                 return None
-                
-            # Obter resultados de dados
-            dice_results = await conn.fetch(
-                'SELECT result FROM dice_results WHERE user_id = $1 ORDER BY timestamp DESC LIMIT 3',
-                user_id
-            )
             
-            user_data = dict(user)
-            user_data['diceResults'] = [r['result'] for r in dice_results]
-            user_data['isMaster'] = user_data.pop('is_master', False)
-            user_data['healthPoints'] = user_data.pop('health_points', 10)
-            user_data['maxHealthPoints'] = user_data.pop('max_health_points', 10)
-            user_data['characterId'] = user_data.pop('character_id', None)
-            user_data['createdAt'] = user_data.pop('created_at')
-            
-            return user_data
+            user_data = self._format_user(user)
+            self._after_commit(lambda: self.users.put(user_data))
+            return dict(user_data, diceResults=list(user_data['diceResults']))
 
-    async def get_character_by_id(self, character_id):
-        async with self.pool.acquire() as conn:
-            user = await conn.fetchrow('SELECT * FROM users WHERE character_id = $1', character_id)
-            
+    async def refresh_campaign_users(self, campaign_id):
+        """Recarrega do banco as entradas do diretório de uma campanha
+        (usado quando outro worker alterou usuários)."""
+        async with self._connection() as conn:
+            users = await conn.fetch(USERS_QUERY + ' WHERE u.campaign_id = $1', campaign_id)
+            users = [self._format_user(user) for user in users]
+            self._after_commit(lambda: self.users.load_campaign(campaign_id, users))
+
+    async def get_user(self, user_id):
+        """Retorna o usuário a partir do diretório em memória, indo ao banco só em caso de ausência."""
+        user = self.users.get(user_id)
+        if user:
+            return user
+        return await self.fetch_user(user_id)
+
+    async def find_master(self, campaign_id):
+        """Mestre da campanha: do diretório em memória ou, se ele não estiver lá
+        (criado por outro worker, por exemplo), do banco."""
+        master = self.users.find_master(campaign_id)
+        if master:
+            return master
+        async with self._connection() as conn:
+            user = await conn.fetchrow(
+                USERS_QUERY + ' WHERE u.is_master AND u.campaign_id = $1 ORDER BY u.created_at LIMIT 1', campaign_id
+            )
             if not user:
                 return None
-                
-            # Obter o personagem
-            character = await self.get_character(user['id'])
+            user_data = self._format_user(user)
+            self._after_commit(lambda: self.users.put(user_data))
+            return dict(user_data, diceResults=list(user_data['diceResults']))
+
+    async def get_character_by_id(self, character_id, campaign_id=DEFAULT_CAMPAIGN):
+        async with self._connection() as conn:
+            character = await conn.fetchval(
+                CHARACTER_QUERY + ' WHERE u.campaign_id = $1 AND u.character_id = $2',
+                campaign_id, character_id
+            )
+            
+            if not character or character['attributes'] is None:
+                return None
             
             return character
 
     async def update_user_nickname(self, user_id, nickname):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
                 'UPDATE users SET nickname = $1 WHERE id = $2',
                 nickname, user_id
             )
+            self._after_commit(lambda: self.users.update(user_id, nickname=nickname))
 
     async def update_user_health(self, user_id, health_points):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
                 'UPDATE users SET health_points = $1 WHERE id = $2',
                 health_points, user_id
             )
+            self._after_commit(lambda: self.users.update(user_id, healthPoints=health_points))
 
     async def update_user_max_health(self, user_id, max_health_points):
         """Atualiza os pontos de vida máximos de um usuário."""
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
                 'UPDATE users SET max_health_points = $1 WHERE id = $2',
                 max_health_points, user_id
             )
+            self._after_commit(lambda: self.users.update(user_id, maxHealthPoints=max_health_points))
 
     # Métodos para mensagens
+    @staticmethod
+    def _format_message(message):
+        message_data = dict(message)
+        message_data['userId'] = message_data.pop('user_id')
+        message_data['isDiceRoll'] = message_data.pop('is_dice_roll')
+        message_data['diceType'] = message_data.pop('dice_type')
+        message_data['diceResult'] = message_data.pop('dice_result')
+        message_data['campaignId'] = message_data.pop('campaign_id')
+        return message_data
+
     async def create_message(self, message_id, user_id, nickname, content, is_dice_roll=False, dice_type=None, dice_result=None):
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                'INSERT INTO messages (id, user_id, nickname, content, is_dice_roll, dice_type, dice_result) VALUES ($1, $2, $3, $4, $5, $6, $7)',
+        """Insere a mensagem na campanha do autor e retorna a linha criada,
+        já no formato enviado ao frontend."""
+        async with self._connection() as conn:
+            message = await conn.fetchrow(
+                f'''
+                INSERT INTO messages (id, campaign_id, user_id, nickname, content, is_dice_roll, dice_type, dice_result)
+                SELECT $1, campaign_id, $2, $3, $4, $5, $6, $7 FROM users WHERE id = $2
+                RETURNING {MESSAGE_COLUMNS}
+                ''',
                 message_id, user_id, nickname, content, is_dice_roll, dice_type, dice_result
             )
-
-    async def get_messages(self, limit=100):
-        async with self.pool.acquire() as conn:
-            messages = await conn.fetch(
-                'SELECT * FROM messages ORDER BY timestamp ASC LIMIT $1',
-                limit
+            return self._format_message(message)
+
+    async def get_message(self, message_id):
+        async with self._connection() as conn:
+            message = await conn.fetchrow(f'SELECT {MESSAGE_COLUMNS} FROM messages WHERE id = $1', message_id)
+            return self._format_message(message) if message else None
+
+    async def get_messages(self, campaign_id=DEFAULT_CAMPAIGN, limit=100, before=None, after=None):
+        """Retorna uma janela do histórico em ordem cronológica (seq crescente).
+
+        Sem cursor, retorna as `limit` mensagens mais recentes. `before` pagina
+        para trás (mensagens com seq menor) e `after` busca as posteriores.
+        O histórico arquivado em disco só é lido quando um cursor passa das
+        partições no banco; a janela sem cursor (snapshot do join)
+        vem só do banco.
+        """
+        async with self._connection() as conn:
+            if after is not None:
+                messages = await conn.fetch(
+                    f'SELECT {MESSAGE_COLUMNS} FROM messages WHERE campaign_id = $1 AND seq > $2 ORDER BY seq ASC LIMIT $3',
+                    campaign_id, after, limit
+                )
+                archives = await conn.fetch(
+                    'SELECT path, min_seq, max_seq FROM message_archives WHERE $1 = ANY(campaign_ids) AND max_seq > $2',
+                    campaign_id, after
+                )
+                if archives:
+                    archived = await archived_messages(archives, campaign_id, limit, after=after)
+                    messages = (archived + list(messages))[:limit]
+            else:
+                messages = await conn.fetch(
+                    f'SELECT {MESSAGE_COLUMNS} FROM messages WHERE campaign_id = $1 AND ($2::BIGINT IS NULL OR seq < $2) ORDER BY seq DESC LIMIT $3',
+                    campaign_id, before, limit
+                )
+                messages = list(reversed(messages))
+                if before is not None and len(messages) < limit:
+                    cursor = messages[0]['seq'] if messages else before
+                    archives = await conn.fetch(
+                        'SELECT path, min_seq, max_seq FROM message_archives WHERE $1 = ANY(campaign_ids) AND ($2::BIGINT IS NULL OR min_seq < $2)',
+                        campaign_id, cursor
+                    )
+                    if archives:
+                        older = await archived_messages(archives, campaign_id, limit - len(messages), before=cursor)
+                        messages = older + messages
+            
+            return [self._format_message(message) for message in messages]
+
+    async def search_messages(self, campaign_id, query, user_id=None, is_dice_roll=None, limit=20, cursor=None):
+        """Busca textual no histórico (partições no banco), por relevância.
+
+        `cursor` é o par (rank, seq) do último resultado da página anterior:
+        a paginação é por chave (rank DESC, seq DESC), sem OFFSET. O índice GIN
+        só filtra as linhas que casam com a busca; a ordenação por ts_rank é
+        feita a cada consulta sobre esse conjunto.
+        """
+        cursor_rank, cursor_seq = cursor if cursor else (None, None)
+        async with self._connection() as conn:
+            rows = await conn.fetch(
+                f'''
+                SELECT {MESSAGE_COLUMNS}, rank,
+                       ts_headline('{SEARCH_CONFIG}', content, search_query, 'MaxFragments=2, MaxWords=20') AS headline
+                FROM (
+                    SELECT m.*, ts_rank(m.search_vector, q) AS rank, q AS search_query
+                    FROM messages m, websearch_to_tsquery('{SEARCH_CONFIG}', $2) q
+                    WHERE m.campaign_id = $1
+                      AND m.search_vector @@ q
+                      AND ($3::TEXT IS NULL OR m.user_id = $3)
+                      AND ($4::BOOLEAN IS NULL OR m.is_dice_roll = $4)
+                      AND ($5::REAL IS NULL OR (ts_rank(m.search_vector, q), m.seq) < ($5::REAL, $6::BIGINT))
+                    ORDER BY rank DESC, m.seq DESC
+                    LIMIT $7
+                ) page
+                ORDER BY rank DESC, seq DESC
+                ''',
+                campaign_id, query, user_id, is_dice_roll, cursor_rank, cursor_seq, limit
             )
-            
-            result = []
-            for message in messages:
-                message_data = dict(message)
-                message_data['userId'] = message_data.pop('user_id')
-                message_data['isDiceRoll'] = message_data.pop('is_dice_roll')
-                message_data['diceType'] = message_data.pop('dice_type')
-                message_data['diceResult'] = message_data.pop('dice_result')
-                result.append(message_data)
-                
-            return result
+
+            results = []
+            for row in rows:
+                message = self._format_message({k: v for k, v in row.items() if k not in ('rank', 'headline')})
+                message['rank'] = row['rank']
+                message['headline'] = row['headline']
+                results.append(message)
+            next_cursor = encode_cursor(rows[-1]['rank'], rows[-1]['seq']) if len(rows) == limit else None
+            return {"results": results, "nextCursor": next_cursor}
 
     # Métodos para resultados de dados
     async def add_dice_result(self, user_id, result):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
                 'INSERT INTO dice_results (user_id, result) VALUES ($1, $2)',
                 user_id, result
             )
+            self._after_commit(lambda: self.users.add_dice_result(user_id, result))
+
+    async def prune_dice_results(self, keep_per_user):
+        """Apaga os resultados de dados além dos `keep_per_user` mais recentes de
+        cada usuário. Retorna quantas linhas foram removidas."""
+        async with self._connection() as conn:
+            result = await conn.execute(
+                '''
+                DELETE FROM dice_results d
+                USING (
+                    SELECT id FROM (
+                        SELECT id, row_number() OVER (PARTITION BY user_id ORDER BY timestamp DESC, id DESC) AS position
+                        FROM dice_results
+                    ) ranked
+                    WHERE position > $1
+                ) old
+                WHERE d.id = old.id
+                ''',
+                max(keep_per_user, RECENT_DICE_RESULTS)
+            )
+            return int(result.split(' ')[1])
+
+    async def add_dice_results(self, results):
+        """Grava vários resultados [(user_id, result), ...] em um único INSERT."""
+        if not results:
+            return
+        user_ids = [user_id for user_id, _ in results]
+        values = [result for _, result in results]
+        async with self._connection() as conn:
+            await conn.execute(
+                'INSERT INTO dice_results (user_id, result) SELECT * FROM unnest($1::TEXT[], $2::INTEGER[])',
+                user_ids, values
+            )
+
+            def update_directory():
+                for user_id, result in results:
+                    self.users.add_dice_result(user_id, result)
+            self._after_commit(update_directory)
 
     # Métodos para personagens
     async def get_character(self, user_id):
-        async with self.pool.acquire() as conn:
-            # Obter atributos
-            attributes_row = await conn.fetchrow(
-                'SELECT * FROM attributes WHERE user_id = $1',
+        """Monta a ficha completa no Postgres e a retorna em uma única ida ao banco."""
+        async with self._connection() as conn:
+            character = await conn.fetchval(
+                CHARACTER_QUERY + ' WHERE u.id = $1',
                 user_id
             )
             
-            if not attributes_row:
+            if not character or character['attributes'] is None:
                 return None
-                
-            attributes = {
-                'strength': attributes_row['strength'],
-                'dexterity': attributes_row['dexterity'],
-                'constitution': attributes_row['constitution'],
-                'intelligence': attributes_row['intelligence'],
-                'wisdom': attributes_row['wisdom'],
-                'charisma': attributes_row['charisma']
-            }
-            
-            # Obter perícias
-            skills_rows = await conn.fetch(
-                'SELECT * FROM skills WHERE user_id = $1',
-                user_id
-            )
-            
-            skills = []
-            for skill in skills_rows:
-                skills.append({
-                    'name': skill['name'],
-                    'value': skill['value'],
-                    'proficient': skill['proficient']
-                })
-            
-            # Obter habilidades
-            abilities_rows = await conn.fetch(
-                'SELECT * FROM abilities WHERE user_id = $1',
-                user_id
-            )
-            
-            abilities = []
-            for ability in abilities_rows:
-                abilities.append({
-                    'id': ability['id'],
-                    'name': ability['name'],
-                    'description': ability['description']
-                })
-            
-            # Obter inventário
-            inventory_rows = await conn.fetch(
-                'SELECT * FROM inventory WHERE user_id = $1',
-                user_id
-            )
-            
-            inventory = []
-            for item in inventory_rows:
-                inventory.append({
-                    'id': item['id'],
-                    'name': item['name'],
-                    'description': item['description'],
-                    'quantity': item['quantity']
-                })
-            
-            # Obter moedas
-            currency_row = await conn.fetchrow(
-                'SELECT * FROM currency WHERE user_id = $1',
-                user_id
-            )
-            
-            currency = {
-                'bronze': currency_row['bronze'],
-                'silver': currency_row['silver'],
-                'gold': currency_row['gold']
-            }
-            
-            # Obter ID do personagem
-            user_row = await conn.fetchrow(
-                'SELECT character_id FROM users WHERE id = $1',
-                user_id
-            )
-            
-            character_id = user_row['character_id'] if user_row else None
             
-            return {
-                'userId': user_id,
-                'characterId': character_id,
-                'attributes': attributes,
-                'skills': skills,
-                'abilities': abilities,
-                'inventory': inventory,
-                'currency': currency
-            }
+            return character
 
     async def update_character_attributes(self, user_id, attributes):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
                 '''
                 UPDATE attributes 
@@ -524,44 +523,72 @@ class Database:
                 user_id
             )
 
-    async def update_character_skills(self, user_id, skills):
-        async with self.pool.acquire() as conn:
-            # Primeiro, excluir todas as perícias existentes
-            await conn.execute('DELETE FROM skills WHERE user_id = $1', user_id)
-            
-            # Depois, inserir as novas perícias
-            for skill in skills:
-                await conn.execute(
-                    'INSERT INTO skills (user_id, name, value, proficient) VALUES ($1, $2, $3, $4)',
-                    user_id, skill['name'], skill['value'], skill['proficient']
+    @staticmethod
+    async def _sync_rows(conn, table, owner_column, owner_id, key, columns, rows):
+        """Grava em `table` só a diferença entre `rows` e o que já está salvo
+        para o dono: remove as linhas que sumiram, insere as novas e atualiza
+        as alteradas, em lote. `key` identifica a linha dentro do dono ('id'
+        ou, nas perícias, 'name'). Deve rodar dentro de uma transação.
+        """
+        stored = {
+            row[key]: tuple(row[column] for column in columns)
+            for row in await conn.fetch(
+                f'SELECT {key}, {", ".join(columns)} FROM {table} WHERE {owner_column} = $1',
+                owner_id
+            )
+        }
+        wanted = {row[key]: tuple(row[column] for column in columns) for row in rows}
+
+        removed = [k for k in stored if k not in wanted]
+        added = [(owner_id, k, *values) for k, values in wanted.items() if k not in stored]
+        changed = [(owner_id, k, *values) for k, values in wanted.items() if k in stored and stored[k] != values]
+
+        if removed:
+            await conn.execute(
+                f'DELETE FROM {table} WHERE {owner_column} = $1 AND {key} = ANY($2::text[])',
+                owner_id, removed
+            )
+
+        if key == 'id':
+            # Chave primária: novas e alteradas em um único upsert em lote
+            placeholders = ", ".join(f"${index}" for index in range(1, len(columns) + 3))
+            excluded = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns)
+            if added or changed:
+                await conn.executemany(
+                    f'''
+                    INSERT INTO {table} ({owner_column}, id, {", ".join(columns)}) VALUES ({placeholders})
+                    ON CONFLICT (id) DO UPDATE SET {excluded}
+                    WHERE {table}.{owner_column} = EXCLUDED.{owner_column}
+                    ''',
+                    added + changed
+                )
+        else:
+            if added:
+                await conn.copy_records_to_table(table, records=added, columns=[owner_column, key, *columns])
+            if changed:
+                assignments = ", ".join(f"{column} = ${index}" for index, column in enumerate(columns, start=3))
+                await conn.executemany(
+                    f'UPDATE {table} SET {assignments} WHERE {owner_column} = $1 AND {key} = $2',
+                    changed
                 )
 
+    async def update_character_skills(self, user_id, skills):
+        async with self._connection() as conn:
+            async with conn.transaction():
+                await self._sync_rows(conn, 'skills', 'user_id', user_id, 'name', ('value', 'proficient'), skills)
+
     async def update_character_abilities(self, user_id, abilities):
-        async with self.pool.acquire() as conn:
-            # Primeiro, excluir todas as habilidades existentes
-            await conn.execute('DELETE FROM abilities WHERE user_id = $1', user_id)
-            
-            # Depois, inserir as novas habilidades
-            for ability in abilities:
-                await conn.execute(
-                    'INSERT INTO abilities (id, user_id, name, description) VALUES ($1, $2, $3, $4)',
-                    ability['id'], user_id, ability['name'], ability['description']
-                )
+        async with self._connection() as conn:
+            async with conn.transaction():
+                await self._sync_rows(conn, 'abilities', 'user_id', user_id, 'id', ('name', 'description'), abilities)
 
     async def update_character_inventory(self, user_id, inventory):
-        async with self.pool.acquire() as conn:
-            # Primeiro, excluir todos os itens existentes
-            await conn.execute('DELETE FROM inventory WHERE user_id = $1', user_id)
-            
-            # Depois, inserir os novos itens
-            for item in inventory:
-                await conn.execute(
-                    'INSERT INTO inventory (id, user_id, name, description, quantity) VALUES ($1, $2, $3, $4, $5)',
-                    item['id'], user_id, item['name'], item['description'], item['quantity']
-                )
+        async with self._connection() as conn:
+            async with conn.transaction():
+                await self._sync_rows(conn, 'inventory', 'user_id', user_id, 'id', ('name', 'description', 'quantity'), inventory)
 
     async def update_character_currency(self, user_id, currency):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
                 'UPDATE currency SET bronze = $1, silver = $2, gold = $3 WHERE user_id = $4',
                 currency['bronze'], currency['silver'], currency['gold'], user_id
@@ -569,13 +596,14 @@ class Database:
 
     # Métodos para NPCs
     async def create_npc(self, npc_id, master_id, npc_data):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
                 '''
                 INSERT INTO npcs (
                     id, master_id, nickname, health_points, max_health_points, 
-                    show_health_bar, health_bar_color, show_in_chat, notes
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                    show_health_bar, health_bar_color, show_in_chat, notes, campaign_id
+                )
+                SELECT $1, $2, $3, $4, $5, $6, $7, $8, $9, campaign_id FROM users WHERE id = $2
                 ''',
                 npc_id, master_id, npc_data['nickname'], npc_data['healthPoints'], npc_data['maxHealthPoints'],
                 npc_data.get('showHealthBar', True), npc_data.get('healthBarColor', 'green'), 
@@ -620,8 +648,43 @@ class Database:
                     )
 
     async def get_npcs(self, master_id):
-        async with self.pool.acquire() as conn:
-            npcs = await conn.fetch('SELECT * FROM npcs WHERE master_id = $1', master_id)
+        """Retorna os NPCs do mestre com atributos, perícias, habilidades e
+        inventário, tudo em uma única consulta."""
+        async with self._connection() as conn:
+            npcs = await conn.fetch(
+                '''
+                SELECT n.*,
+                    (
+                        SELECT json_build_object(
+                            'strength', a.strength, 'dexterity', a.dexterity,
+                            'constitution', a.constitution, 'intelligence', a.intelligence,
+                            'wisdom', a.wisdom, 'charisma', a.charisma
+                        )
+                        FROM npc_attributes a WHERE a.npc_id = n.id LIMIT 1
+                    ) AS npc_attributes,
+                    COALESCE((
+                        SELECT json_agg(json_build_object(
+                            'name', s.name, 'value', s.value, 'proficient', s.proficient
+                        ) ORDER BY s.id)
+                        FROM npc_skills s WHERE s.npc_id = n.id
+                    ), '[]'::json) AS npc_skills,
+                    COALESCE((
+                        SELECT json_agg(json_build_object(
+                            'id', ab.id, 'name', ab.name, 'description', ab.description
+                        ))
+                        FROM npc_abilities ab WHERE ab.npc_id = n.id
+                    ), '[]'::json) AS npc_abilities,
+                    COALESCE((
+                        SELECT json_agg(json_build_object(
+                            'id', i.id, 'name', i.name, 'description', i.description, 'quantity', i.quantity
+                        ))
+                        FROM npc_inventory i WHERE i.npc_id = n.id
+                    ), '[]'::json) AS npc_inventory
+                FROM npcs n
+                WHERE n.master_id = $1
+                ''',
+                master_id
+            )
             result = []
             
             for npc in npcs:
@@ -633,104 +696,62 @@ class Database:
                 npc_data['healthBarColor'] = npc_data.pop('health_bar_color')
                 npc_data['showInChat'] = npc_data.pop('show_in_chat')
                 npc_data['masterId'] = npc_data.pop('master_id')
+                npc_data['campaignId'] = npc_data.pop('campaign_id')
+                npc_data['createdAt'] = npc_data.pop('created_at')
                 npc_data['diceResults'] = []
                 
-                # Obter atributos
-                attrs = await conn.fetchrow('SELECT * FROM npc_attributes WHERE npc_id = $1', npc['id'])
-                if attrs:
-                    npc_data['attributes'] = {
-                        'strength': attrs['strength'],
-                        'dexterity': attrs['dexterity'],
-                        'constitution': attrs['constitution'],
-                        'intelligence': attrs['intelligence'],
-                        'wisdom': attrs['wisdom'],
-                        'charisma': attrs['charisma']
-                    }
-                
-                # Obter perícias
-                skills = await conn.fetch('SELECT * FROM npc_skills WHERE npc_id = $1', npc['id'])
-                npc_data['skills'] = [
-                    {'name': s['name'], 'value': s['value'], 'proficient': s['proficient']}
-                    for s in skills
-                ]
-                
-                # Obter habilidades
-                abilities = await conn.fetch('SELECT * FROM npc_abilities WHERE npc_id = $1', npc['id'])
-                npc_data['abilities'] = [
-                    {'id': a['id'], 'name': a['name'], 'description': a['description']}
-                    for a in abilities
-                ]
-                
-                # Obter inventário
-                inventory = await conn.fetch('SELECT * FROM npc_inventory WHERE npc_id = $1', npc['id'])
-                npc_data['inventory'] = [
-                    {'id': i['id'], 'name': i['name'], 'description': i['description'], 'quantity': i['quantity']}
-                    for i in inventory
-                ]
+                attributes = npc_data.pop('npc_attributes')
+                if attributes:
+                    npc_data['attributes'] = attributes
+                npc_data['skills'] = npc_data.pop('npc_skills')
+                npc_data['abilities'] = npc_data.pop('npc_abilities')
+                npc_data['inventory'] = npc_data.pop('npc_inventory')
                 
                 result.append(npc_data)
                 
             return result
 
     async def update_npc(self, npc_id, npc_data):
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                '''
-                UPDATE npcs 
-                SET nickname = $1, health_points = $2, max_health_points = $3,
-                    show_health_bar = $4, health_bar_color = $5, show_in_chat = $6, notes = $7
-                WHERE id = $8
-                ''',
-                npc_data['nickname'], npc_data['healthPoints'], npc_data['maxHealthPoints'],
-                npc_data.get('showHealthBar', True), npc_data.get('healthBarColor', 'green'),
-                npc_data.get('showInChat', False), npc_data.get('notes', ''),
-                npc_id
-            )
-            
-            # Atualizar atributos
-            if 'attributes' in npc_data:
-                attrs = npc_data['attributes']
+        async with self._connection() as conn:
+            async with conn.transaction():
                 await conn.execute(
                     '''
-                    UPDATE npc_attributes 
-                    SET strength = $1, dexterity = $2, constitution = $3,
-                        intelligence = $4, wisdom = $5, charisma = $6
-                    WHERE npc_id = $7
+                    UPDATE npcs 
+                    SET nickname = $1, health_points = $2, max_health_points = $3,
+                        show_health_bar = $4, health_bar_color = $5, show_in_chat = $6, notes = $7
+                    WHERE id = $8
                     ''',
-                    attrs.get('strength', 10), attrs.get('dexterity', 10), attrs.get('constitution', 10),
-                    attrs.get('intelligence', 10), attrs.get('wisdom', 10), attrs.get('charisma', 10),
+                    npc_data['nickname'], npc_data['healthPoints'], npc_data['maxHealthPoints'],
+                    npc_data.get('showHealthBar', True), npc_data.get('healthBarColor', 'green'),
+                    npc_data.get('showInChat', False), npc_data.get('notes', ''),
                     npc_id
                 )
             
-            # Atualizar perícias
-            if 'skills' in npc_data:
-                await conn.execute('DELETE FROM npc_skills WHERE npc_id = $1', npc_id)
-                for skill in npc_data['skills']:
-                    await conn.execute(
-                        'INSERT INTO npc_skills (npc_id, name, value, proficient) VALUES ($1, $2, $3, $4)',
-                        npc_id, skill['name'], skill['value'], skill['proficient']
-                    )
-            
-            # Atualizar habilidades
-            if 'abilities' in npc_data:
-                await conn.execute('DELETE FROM npc_abilities WHERE npc_id = $1', npc_id)
-                for ability in npc_data['abilities']:
+                # Atualizar atributos
+                if 'attributes' in npc_data:
+                    attrs = npc_data['attributes']
                     await conn.execute(
-                        'INSERT INTO npc_abilities (id, npc_id, name, description) VALUES ($1, $2, $3, $4)',
-                        ability['id'], npc_id, ability['name'], ability['description']
+                        '''
+                        UPDATE npc_attributes 
+                        SET strength = $1, dexterity = $2, constitution = $3,
+                            intelligence = $4, wisdom = $5, charisma = $6
+                        WHERE npc_id = $7
+                        ''',
+                        attrs.get('strength', 10), attrs.get('dexterity', 10), attrs.get('constitution', 10),
+                        attrs.get('intelligence', 10), attrs.get('wisdom', 10), attrs.get('charisma', 10),
+                        npc_id
                     )
             
-            # Atualizar inventário
-            if 'inventory' in npc_data:
-                await conn.execute('DELETE FROM npc_inventory WHERE npc_id = $1', npc_id)
-                for item in npc_data['inventory']:
-                    await conn.execute(
-                        'INSERT INTO npc_inventory (id, npc_id, name, description, quantity) VALUES ($1, $2, $3, $4, $5)',
-                        item['id'], npc_id, item['name'], item['description'], item['quantity']
-                    )
+                # Atualizar perícias, habilidades e inventário (só as diferenças)
+                if 'skills' in npc_data:
+                    await self._sync_rows(conn, 'npc_skills', 'npc_id', npc_id, 'name', ('value', 'proficient'), npc_data['skills'])
+                if 'abilities' in npc_data:
+                    await self._sync_rows(conn, 'npc_abilities', 'npc_id', npc_id, 'id', ('name', 'description'), npc_data['abilities'])
+                if 'inventory' in npc_data:
+                    await self._sync_rows(conn, 'npc_inventory', 'npc_id', npc_id, 'id', ('name', 'description', 'quantity'), npc_data['inventory'])
 
     async def delete_npc(self, npc_id):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             # O ON DELETE CASCADE nas foreign keys deve cuidar das tabelas relacionadas (npc_attributes, etc.)
             result = await conn.execute('DELETE FROM npcs WHERE id = $1', npc_id)
             # O execute retorna uma string como 'DELETE 1' ou 'DELETE 0'
@@ -739,13 +760,14 @@ class Database:
 
     # Métodos para itens compartilhados
     async def create_shared_item(self, item_id, master_id, item_data):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
                 '''
                 INSERT INTO shared_items (
                     id, master_id, name, description, type, rarity, 
-                    value, weight, effect, is_public
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                    value, weight, effect, is_public, campaign_id
+                )
+                SELECT $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, campaign_id FROM users WHERE id = $2
                 ''',
                 item_id, master_id, item_data['name'], item_data['description'],
                 item_data.get('type', ''), item_data.get('rarity', ''),
@@ -753,52 +775,62 @@ class Database:
                 item_data.get('effect', ''), item_data.get('isPublic', False)
             )
 
-    async def get_shared_items(self, master_id=None):
-        async with self.pool.acquire() as conn:
+    async def get_shared_items(self, master_id=None, campaign_id=DEFAULT_CAMPAIGN):
+        async with self._connection() as conn:
             if master_id:
                 items = await conn.fetch('SELECT * FROM shared_items WHERE master_id = $1', master_id)
             else:
-                items = await conn.fetch('SELECT * FROM shared_items')
+                items = await conn.fetch('SELECT * FROM shared_items WHERE campaign_id = $1', campaign_id)
                 
             result = []
             for item in items:
                 item_data = dict(item)
                 item_data['masterId'] = item_data.pop('master_id')
+                item_data['campaignId'] = item_data.pop('campaign_id')
                 item_data['isPublic'] = item_data.pop('is_public')
-                item_data['createdAt'] = item_data.pop('created_at').isoformat()
+                item_data['createdAt'] = item_data.pop('created_at')
                 result.append(item_data)
                 
             return result
 
-    async def update_shared_item(self, item_id, item_data):
-        async with self.pool.acquire() as conn:
-            await conn.execute(
+    async def update_shared_item(self, item_id, item_data, campaign_id=None):
+        """Atualiza o registro e retorna a campanha dele (None se não existir ou,
+        com `campaign_id`, se for de outra campanha)."""
+        async with self._connection() as conn:
+            return await conn.fetchval(
                 '''
                 UPDATE shared_items 
                 SET name = $1, description = $2, type = $3, rarity = $4,
                     value = $5, weight = $6, effect = $7, is_public = $8
-                WHERE id = $9
+                WHERE id = $9 AND ($10::TEXT IS NULL OR campaign_id = $10)
+                RETURNING campaign_id
                 ''',
                 item_data['name'], item_data['description'],
                 item_data.get('type', ''), item_data.get('rarity', ''),
                 item_data.get('value', ''), item_data.get('weight', ''),
                 item_data.get('effect', ''), item_data.get('isPublic', False),
-                item_id
+                item_id, campaign_id
             )
 
-    async def delete_shared_item(self, item_id):
-        async with self.pool.acquire() as conn:
-            await conn.execute('DELETE FROM shared_items WHERE id = $1', item_id)
+    async def delete_shared_item(self, item_id, campaign_id=None):
+        """Remove o registro e retorna a campanha dele (None se não existir ou,
+        com `campaign_id`, se for de outra campanha)."""
+        async with self._connection() as conn:
+            return await conn.fetchval(
+                'DELETE FROM shared_items WHERE id = $1 AND ($2::TEXT IS NULL OR campaign_id = $2) RETURNING campaign_id',
+                item_id, campaign_id
+            )
 
     # Métodos para habilidades compartilhadas
     async def create_shared_ability(self, ability_id, master_id, ability_data):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
                 '''
                 INSERT INTO shared_abilities (
                     id, master_id, name, description, type, cost, 
-                    range, duration, effect, is_public
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                    range, duration, effect, is_public, campaign_id
+                )
+                SELECT $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, campaign_id FROM users WHERE id = $2
                 ''',
                 ability_id, master_id, ability_data['name'], ability_data['description'],
                 ability_data.get('type', ''), ability_data.get('cost', ''),
@@ -806,85 +838,139 @@ class Database:
                 ability_data.get('effect', ''), ability_data.get('isPublic', False)
             )
 
-    async def get_shared_abilities(self, master_id=None):
-        async with self.pool.acquire() as conn:
+    async def get_shared_abilities(self, master_id=None, campaign_id=DEFAULT_CAMPAIGN):
+        async with self._connection() as conn:
             if master_id:
                 abilities = await conn.fetch('SELECT * FROM shared_abilities WHERE master_id = $1', master_id)
             else:
-                abilities = await conn.fetch('SELECT * FROM shared_abilities')
+                abilities = await conn.fetch('SELECT * FROM shared_abilities WHERE campaign_id = $1', campaign_id)
                 
             result = []
             for ability in abilities:
                 ability_data = dict(ability)
                 ability_data['masterId'] = ability_data.pop('master_id')
+                ability_data['campaignId'] = ability_data.pop('campaign_id')
                 ability_data['isPublic'] = ability_data.pop('is_public')
-                ability_data['createdAt'] = ability_data.pop('created_at').isoformat()
+                ability_data['createdAt'] = ability_data.pop('created_at')
                 result.append(ability_data)
                 
             return result
 
-    async def update_shared_ability(self, ability_id, ability_data):
-        async with self.pool.acquire() as conn:
-            await conn.execute(
+    async def update_shared_ability(self, ability_id, ability_data, campaign_id=None):
+        """Atualiza o registro e retorna a campanha dele (None se não existir ou,
+        com `campaign_id`, se for de outra campanha)."""
+        async with self._connection() as conn:
+            return await conn.fetchval(
                 '''
                 UPDATE shared_abilities 
                 SET name = $1, description = $2, type = $3, cost = $4,
                     range = $5, duration = $6, effect = $7, is_public = $8
-                WHERE id = $9
+                WHERE id = $9 AND ($10::TEXT IS NULL OR campaign_id = $10)
+                RETURNING campaign_id
                 ''',
                 ability_data['name'], ability_data['description'],
                 ability_data.get('type', ''), ability_data.get('cost', ''),
                 ability_data.get('range', ''), ability_data.get('duration', ''),
                 ability_data.get('effect', ''), ability_data.get('isPublic', False),
-                ability_id
+                ability_id, campaign_id
             )
 
-    async def delete_shared_ability(self, ability_id):
-        async with self.pool.acquire() as conn:
-            await conn.execute('DELETE FROM shared_abilities WHERE id = $1', ability_id)
+    async def delete_shared_ability(self, ability_id, campaign_id=None):
+        """Remove o registro e retorna a campanha dele (None se não existir ou,
+        com `campaign_id`, se for de outra campanha)."""
+        async with self._connection() as conn:
+            return await conn.fetchval(
+                'DELETE FROM shared_abilities WHERE id = $1 AND ($2::TEXT IS NULL OR campaign_id = $2) RETURNING campaign_id',
+                ability_id, campaign_id
+            )
 
     # Métodos para notas do mestre
     async def create_master_note(self, note_id, master_id, note_data):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
                 'INSERT INTO master_notes (id, master_id, title, content, category) VALUES ($1, $2, $3, $4, $5)',
                 note_id, master_id, note_data['title'], note_data['content'], note_data['category']
             )
 
     async def get_master_notes(self, master_id):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             notes = await conn.fetch('SELECT * FROM master_notes WHERE master_id = $1', master_id)
             
             result = []
             for note in notes:
                 note_data = dict(note)
                 note_data['masterId'] = note_data.pop('master_id')
-                note_data['createdAt'] = note_data.pop('created_at').isoformat()
+                note_data['createdAt'] = note_data.pop('created_at')
+                note_data['updatedAt'] = note_data.pop('updated_at')
                 result.append(note_data)
                 
             return result
 
+    async def list_master_notes(self, master_id, category=None, limit=50, cursor=None):
+        """Página da listagem das notas do mestre, sem o conteúdo, das mais novas
+        para as mais antigas.
+
+        `cursor` é o par (created_at, id) da última nota da página anterior;
+        a paginação é por chave (created_at DESC, id DESC), sem OFFSET.
+        """
+        cursor_created, cursor_id = cursor if cursor else (None, None)
+        async with self._connection() as conn:
+            rows = await conn.fetch(
+                '''
+                SELECT id, title, category, created_at, updated_at FROM master_notes
+                WHERE master_id = $1
+                  AND ($2::TEXT IS NULL OR category = $2)
+                  AND ($3::TIMESTAMPTZ IS NULL OR (created_at, id) < ($3::TIMESTAMPTZ, $4::TEXT))
+                ORDER BY created_at DESC, id DESC
+                LIMIT $5
+                ''',
+                master_id, category, cursor_created, cursor_id, limit
+            )
+
+            notes = [
+                {"id": row['id'], "title": row['title'], "category": row['category'],
+                 "createdAt": row['created_at'], "updatedAt": row['updated_at']}
+                for row in rows
+            ]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id']) if len(rows) == limit else None
+            return {"notes": notes, "nextCursor": next_cursor}
+
+    async def get_master_note(self, master_id, note_id):
+        """Nota completa (com o conteúdo) do mestre, ou None."""
+        async with self._connection() as conn:
+            note = await conn.fetchrow(
+                'SELECT * FROM master_notes WHERE id = $1 AND master_id = $2', note_id, master_id
+            )
+            if not note:
+                return None
+
+            note_data = dict(note)
+            note_data['masterId'] = note_data.pop('master_id')
+            note_data['createdAt'] = note_data.pop('created_at')
+            note_data['updatedAt'] = note_data.pop('updated_at')
+            return note_data
+
     async def update_master_note(self, note_id, note_data):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
-                'UPDATE master_notes SET title = $1, content = $2, category = $3 WHERE id = $4',
+                'UPDATE master_notes SET title = $1, content = $2, category = $3, updated_at = CURRENT_TIMESTAMP WHERE id = $4',
                 note_data['title'], note_data['content'], note_data['category'], note_id
             )
 
     async def delete_master_note(self, note_id):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute('DELETE FROM master_notes WHERE id = $1', note_id)
 
     # Métodos para adicionar itens/habilidades a personagens
     async def add_item_to_character(self, user_id, item_data):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
                 'INSERT INTO inventory (id, user_id, name, description, quantity) VALUES ($1, $2, $3, $4, $5)',
                 item_data['id'], user_id, item_data['name'], item_data['description'], item_data.get('quantity', 1)
             )
 
     async def add_ability_to_character(self, user_id, ability_data):
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             await conn.execute(
                 'INSERT INTO abilities (id, user_id, name, description) VALUES ($1, $2, $3, $4)',
                 ability_data['id'], user_id, ability_data['name'], ability_data['description']
@@ -893,7 +979,7 @@ class Database:
     # --- Método para deletar usuário --- START ---
     async def delete_user(self, user_id):
         """Deleta um usuário e todos os seus dados relacionados (personagem, etc.)"""
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             # O ON DELETE CASCADE nas foreign keys deve cuidar das tabelas relacionadas
             # como attributes, skills, abilities, inventory, currency, messages, dice_results.
             # Se não houver CASCADE, você precisaria deletar manualmente dessas tabelas primeiro.
@@ -903,5 +989,6 @@ class Database:
             )
             # O execute retorna uma string como 'DELETE 1' ou 'DELETE 0'
             deleted_count = int(result.split(' ')[1])
+            self._after_commit(lambda: self.users.remove(user_id))
             return deleted_count > 0 # Retorna True se deletou 1 linha, False caso contrário
     # --- Método para deletar usuário --- END ---
@@ -0,0 +1,286 @@
+import random
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# NumPy é opcional: gera as rolagens em massa de uma vez; sem ele, roll_many rola uma a uma
+try:
+    import numpy as np
+except ImportError: # pragma: no cover - depende do ambiente
+    np = None
+
+# Limites para que uma expressão não trave o worker
+MAX_DICE = 100
+MAX_SIDES = 1000
+MAX_TERMS = 20
+# Rerrolagens extras permitidas por dado explosivo
+MAX_EXPLOSIONS = 20
+# Rolagens por comando de rolagem em massa
+MAX_BATCH_ROLLS = 200
+# Totais vão para colunas INTEGER (dice_results.result, messages.dice_result)
+MIN_TOTAL = -2**31
+MAX_TOTAL = 2**31 - 1
+
+class DiceError(ValueError):
+    """Expressão de dados inválida ou fora dos limites."""
+
+# NdS seguido de no máximo um modificador (kh/kl/dh/dl) e/ou '!' (explosivo)
+_DICE_RE = re.compile(r'(\d*)d(\d+|%)(!)?(?:(kh|kl|dh|dl|k|d)(\d+))?(!)?')
+_TERM_RE = re.compile(r'([+-]?)([^+-]+)')
+
+@dataclass(frozen=True)
+class DiceTerm:
+    """Grupo de dados `count`d`sides` com keep/drop e explosão opcionais."""
+    count: int
+    sides: int
+    sign: int = 1
+    explode: bool = False
+    keep: Optional[Tuple[str, int]] = None # ('h' | 'l', quantidade mantida)
+
+    def notation(self):
+        text = f"{self.count}d{self.sides}"
+        if self.explode:
+            text += "!"
+        if self.keep:
+            text += f"k{self.keep[0]}{self.keep[1]}"
+        return text
+
+@dataclass(frozen=True)
+class ConstantTerm:
+    value: int
+    sign: int = 1
+
+    def notation(self):
+        return str(self.value)
+
+@dataclass(frozen=True)
+class DiceExpression:
+    """Expressão já compilada: uma soma de termos de dados e constantes."""
+    terms: tuple
+
+    @property
+    def notation(self):
+        text = ""
+        for term in self.terms:
+            text += ("-" if term.sign < 0 else "+" if text else "") + term.notation()
+        return text
+
+@dataclass
+class TermResult:
+    term: object
+    rolls: List[int] = field(default_factory=list)
+    kept: List[bool] = field(default_factory=list)
+    value: int = 0
+
+    def describe(self):
+        if isinstance(self.term, ConstantTerm):
+            return str(self.term.value)
+        dice = ", ".join(str(r) if k else f"~{r}~" for r, k in zip(self.rolls, self.kept))
+        return f"{self.term.notation()} [{dice}]"
+
+@dataclass
+class DiceRoll:
+    """Resultado de uma rolagem, com o detalhamento de cada termo."""
+    expression: DiceExpression
+    terms: List[TermResult]
+    total: int
+
+    @property
+    def breakdown(self):
+        text = ""
+        for result in self.terms:
+            sign = "-" if result.term.sign < 0 else "+" if text else ""
+            text += f" {sign} " if text else sign
+            text += result.describe()
+        return text.strip()
+
+    def as_dict(self):
+        return {
+            "expression": self.expression.notation,
+            "total": self.total,
+            "breakdown": self.breakdown,
+            "terms": [
+                {"notation": r.term.notation(), "sign": r.term.sign, "rolls": r.rolls, "kept": r.kept, "value": r.value}
+                for r in self.terms
+            ],
+        }
+
+def _parse_keep(count, kind, amount):
+    amount = int(amount)
+    if kind in ("k", "kh"):
+        keep = ("h", amount)
+    elif kind == "kl":
+        keep = ("l", amount)
+    elif kind in ("d", "dl"):
+        keep = ("h", count - amount) # descartar os menores = manter os maiores
+    else: # dh
+        keep = ("l", count - amount)
+    if not 0 <= keep[1] <= count:
+        raise DiceError(f"Cannot keep/drop {amount} of {count} dice")
+    return keep
+
+@lru_cache(maxsize=1024)
+def compile_expression(expression: str) -> DiceExpression:
+    """Compila uma expressão como `4d6kh3`, `2d20kl1+5` ou `8d6!`.
+
+    O resultado é imutável e fica em cache: a mesma notação rolada várias vezes
+    só é interpretada uma vez.
+    """
+    text = expression.replace(" ", "").lower()
+    if not text:
+        raise DiceError("Empty dice expression")
+
+    terms = []
+    position = 0
+    while position < len(text):
+        match = _TERM_RE.match(text, position)
+        if not match or (position and not match.group(1)):
+            raise DiceError(f"Invalid dice expression: {expression!r}")
+        sign = -1 if match.group(1) == "-" else 1
+        body = match.group(2)
+        position = match.end()
+
+        if body.isdigit():
+            if len(body) > len(str(MAX_TOTAL)):
+                raise DiceError(f"Constant {body[:12]}... is out of range")
+            terms.append(ConstantTerm(int(body), sign))
+            continue
+
+        dice = _DICE_RE.fullmatch(body)
+        if not dice:
+            raise DiceError(f"Invalid dice term: {body!r}")
+        count_text, sides_text, explode_before, kind, amount, explode_after = dice.groups()
+        count = int(count_text) if count_text else 1
+        sides = 100 if sides_text == "%" else int(sides_text)
+        if not 1 <= count <= MAX_DICE:
+            raise DiceError(f"Dice count must be between 1 and {MAX_DICE}")
+        if not 1 <= sides <= MAX_SIDES:
+            raise DiceError(f"Dice sides must be between 1 and {MAX_SIDES}")
+        explode = bool(explode_before or explode_after)
+        if explode and sides == 1:
+            raise DiceError("A d1 cannot explode")
+        keep = _parse_keep(count, kind, amount) if kind else None
+        terms.append(DiceTerm(count, sides, sign, explode, keep))
+
+    if len(terms) > MAX_TERMS:
+        raise DiceError(f"Dice expressions are limited to {MAX_TERMS} terms")
+    low, high = _total_bounds(terms)
+    if low < MIN_TOTAL or high > MAX_TOTAL:
+        raise DiceError(f"Dice expression total must stay between {MIN_TOTAL} and {MAX_TOTAL}")
+    return DiceExpression(tuple(terms))
+
+def _total_bounds(terms):
+    """Menor e maior total possíveis da soma dos termos."""
+    low = high = 0
+    for term in terms:
+        if isinstance(term, ConstantTerm):
+            term_low = term_high = term.value
+        else:
+            kept = term.keep[1] if term.keep else term.count
+            die_max = term.sides * (MAX_EXPLOSIONS + 1) if term.explode else term.sides
+            term_low, term_high = kept, kept * die_max
+        if term.sign < 0:
+            term_low, term_high = -term_high, -term_low
+        low += term_low
+        high += term_high
+    return low, high
+
+def _roll_term(term: DiceTerm, rng) -> TermResult:
+    rolls = []
+    for _ in range(term.count):
+        value = rng.randint(1, term.sides)
+        roll = value
+        explosions = 0
+        # Explosivo: cada valor máximo rola mais um dado, somado ao mesmo dado
+        while term.explode and value == term.sides and explosions < MAX_EXPLOSIONS:
+            value = rng.randint(1, term.sides)
+            roll += value
+            explosions += 1
+        rolls.append(roll)
+
+    kept = [True] * len(rolls)
+    if term.keep:
+        direction, amount = term.keep
+        order = sorted(range(len(rolls)), key=lambda i: rolls[i], reverse=(direction == "h"))
+        kept_indexes = set(order[:amount])
+        kept = [i in kept_indexes for i in range(len(rolls))]
+
+    value = sum(r for r, k in zip(rolls, kept) if k)
+    return TermResult(term, rolls, kept, value)
+
+def roll(expression, rng=random) -> DiceRoll:
+    """Rola a expressão (texto ou DiceExpression já compilada)."""
+    if isinstance(expression, str):
+        expression = compile_expression(expression)
+
+    results = []
+    total = 0
+    for term in expression.terms:
+        if isinstance(term, ConstantTerm):
+            result = TermResult(term, value=term.value)
+        else:
+            result = _roll_term(term, rng)
+        results.append(result)
+        total += term.sign * result.value
+    return DiceRoll(expression, results, total)
+
+def _roll_term_batch(term: DiceTerm, count: int, generator):
+    """Rola `count` vezes o mesmo termo, em arrays (count, term.count)."""
+    rolls = generator.integers(1, term.sides + 1, size=(count, term.count))
+    if term.explode:
+        live = rolls == term.sides
+        explosions = 0
+        while live.any() and explosions < MAX_EXPLOSIONS:
+            extra = generator.integers(1, term.sides + 1, size=int(live.sum()))
+            rolls[live] += extra
+            exploded = np.zeros_like(live)
+            exploded[live] = extra == term.sides
+            live = exploded
+            explosions += 1
+
+    kept = np.ones(rolls.shape, dtype=bool)
+    if term.keep:
+        direction, amount = term.keep
+        order = np.argsort(-rolls if direction == "h" else rolls, axis=1, kind="stable")
+        kept[:] = False
+        np.put_along_axis(kept, order[:, :amount], True, axis=1)
+
+    values = np.where(kept, rolls, 0).sum(axis=1)
+    return rolls.tolist(), kept.tolist(), values.tolist()
+
+def roll_many(expression, count: int, rng=None) -> List[DiceRoll]:
+    """Rola a mesma expressão `count` vezes (ex.: iniciativa de uma horda de NPCs).
+
+    Com NumPy, todos os dados de cada termo saem de uma única chamada ao
+    gerador; `rng` é um numpy.random.Generator (ou, sem NumPy, um random.Random).
+    """
+    if isinstance(expression, str):
+        expression = compile_expression(expression)
+    if not 1 <= count <= MAX_BATCH_ROLLS:
+        raise DiceError(f"Batch rolls must have between 1 and {MAX_BATCH_ROLLS} rolls")
+    if np is None:
+        return [roll(expression, rng or random) for _ in range(count)]
+
+    generator = rng or np.random.default_rng()
+    columns = []
+    for term in expression.terms:
+        if isinstance(term, ConstantTerm):
+            columns.append(None)
+        else:
+            columns.append(_roll_term_batch(term, count, generator))
+
+    rolls = []
+    for row in range(count):
+        results = []
+        total = 0
+        for term, column in zip(expression.terms, columns):
+            if column is None:
+                result = TermResult(term, value=term.value)
+            else:
+                term_rolls, term_kept, term_values = column
+                result = TermResult(term, term_rolls[row], term_kept[row], term_values[row])
+            results.append(result)
+            total += term.sign * result.value
+        rolls.append(DiceRoll(expression, results, total))
+    return rolls
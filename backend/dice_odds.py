@@ -0,0 +1,207 @@
+import asyncio
+from collections import OrderedDict
+from math import comb
+from typing import Dict
+
+from .dice import ConstantTerm, DiceError, compile_expression
+
+# NumPy faz as convoluções; sem ele o cálculo de probabilidades não está disponível
+try:
+    import numpy as np
+except ImportError: # pragma: no cover - depende do ambiente
+    np = None
+
+# Distribuições guardadas (por notação normalizada) no LRU
+ODDS_CACHE_SIZE = 256
+# Explosões são seguidas até a probabilidade do ramo ficar abaixo disso
+EXPLOSION_EPSILON = 1e-12
+# Acima deste tamanho de suporte a convolução é feita por FFT
+FFT_MIN_SIZE = 4096
+# Limites para que uma expressão não trave a thread de cálculo
+MAX_SUPPORT = 1_000_000
+MAX_KEEP_STEPS = 200_000
+PERCENTILES = (5, 25, 50, 75, 95)
+
+def _convolve(a, b):
+    size = len(a) + len(b) - 1
+    if size <= FFT_MIN_SIZE:
+        return np.convolve(a, b)
+    n = 1 << (size - 1).bit_length()
+    result = np.fft.irfft(np.fft.rfft(a, n) * np.fft.rfft(b, n), n)[:size]
+    return np.clip(result, 0, None)
+
+def _power(pmf, count):
+    """Distribuição da soma de `count` cópias independentes de `pmf`."""
+    result = np.ones(1)
+    base = pmf
+    while count:
+        if count & 1:
+            result = _convolve(result, base)
+        count >>= 1
+        if count:
+            base = _convolve(base, base)
+    return result
+
+def _die_pmf(sides, explode):
+    """Distribuição de um dado (índice 0 = valor 1), com explosões se pedido."""
+    if not explode:
+        return np.full(sides, 1 / sides)
+    # Cada valor máximo soma mais um dado; o ramo é cortado quando fica improvável
+    depth = 0
+    while (1 / sides) ** (depth + 1) >= EXPLOSION_EPSILON:
+        depth += 1
+    pmf = np.zeros(sides * (depth + 1))
+    weight = 1.0
+    for level in range(depth + 1):
+        start = level * sides
+        if level == depth:
+            pmf[start:start + sides] += weight / sides
+        else:
+            pmf[start:start + sides - 1] += weight / sides
+            weight /= sides
+    return pmf
+
+def _keep_pmf(die, count, direction, keep):
+    """Distribuição da soma dos `keep` maiores (ou menores) de `count` dados.
+
+    Percorre os valores do dado do maior para o menor (ou o contrário) decidindo
+    quantos dados caem em cada valor; o produto de binomiais dá exatamente a
+    probabilidade multinomial de cada resultado.
+    """
+    values = np.nonzero(die)[0] + 1
+    if len(values) * count * count > MAX_KEEP_STEPS:
+        raise DiceError("Expression is too complex to compute exactly")
+    if direction == "h":
+        values = values[::-1]
+
+    size = keep * int(values.max()) + 1
+    # states[m] = distribuição da soma mantida com m dados já atribuídos
+    states = [np.zeros(size) for _ in range(count + 1)]
+    states[0][0] = 1.0
+    for value in values:
+        probability = die[value - 1]
+        new_states = [np.zeros(size) for _ in range(count + 1)]
+        for assigned in range(count + 1):
+            current = states[assigned]
+            if not current.any():
+                continue
+            kept_before = min(assigned, keep)
+            for j in range(count - assigned + 1):
+                weight = comb(count - assigned, j) * probability ** j
+                if weight == 0:
+                    break
+                shift = value * min(j, keep - kept_before)
+                new_states[assigned + j][shift:] += current[:size - shift] * weight
+        states = new_states
+    return states[count]
+
+def _term_distribution(term):
+    """(menor valor, pmf) do termo já com o sinal aplicado."""
+    if isinstance(term, ConstantTerm):
+        offset, pmf = term.value, np.ones(1)
+    else:
+        die = _die_pmf(term.sides, term.explode)
+        if term.count * len(die) > MAX_SUPPORT:
+            raise DiceError("Expression is too complex to compute exactly")
+        if term.keep and term.keep[1] < term.count:
+            pmf = _keep_pmf(die, term.count, *term.keep)
+            offset = 0
+        else:
+            pmf = _power(die, term.count)
+            offset = term.count
+        nonzero = np.nonzero(pmf > 0)[0]
+        offset += int(nonzero[0])
+        pmf = pmf[nonzero[0]:nonzero[-1] + 1]
+
+    if term.sign < 0:
+        return -(offset + len(pmf) - 1), pmf[::-1]
+    return offset, pmf
+
+def compute_distribution(expression):
+    """Distribuição exata da expressão: (valores, probabilidades) como arrays."""
+    if np is None:
+        raise DiceError("Dice odds require NumPy")
+    if isinstance(expression, str):
+        expression = compile_expression(expression)
+
+    offset, pmf = 0, np.ones(1)
+    for term in expression.terms:
+        term_offset, term_pmf = _term_distribution(term)
+        if len(pmf) + len(term_pmf) > MAX_SUPPORT:
+            raise DiceError("Expression is too complex to compute exactly")
+        offset += term_offset
+        pmf = _convolve(pmf, term_pmf)
+    pmf = pmf / pmf.sum()
+    return np.arange(offset, offset + len(pmf)), pmf
+
+class DiceOdds:
+    """Distribuição calculada de uma expressão, com as estatísticas prontas."""
+
+    def __init__(self, notation, values, probabilities):
+        self.notation = notation
+        self.values = values
+        self.probabilities = probabilities
+        self.cdf = np.cumsum(probabilities)
+        mean = float(np.dot(values, probabilities))
+        self.summary = {
+            "expression": notation,
+            "min": int(values[0]),
+            "max": int(values[-1]),
+            "mean": mean,
+            "stddev": float(np.sqrt(np.dot((values - mean) ** 2, probabilities))),
+            "percentiles": {
+                str(p): int(values[min(np.searchsorted(self.cdf, p / 100 - 1e-12), len(values) - 1)])
+                for p in PERCENTILES
+            },
+            "distribution": [
+                [int(v), float(p)] for v, p in zip(values, probabilities) if p >= EXPLOSION_EPSILON
+            ],
+        }
+
+    def at_least(self, target: int) -> float:
+        """Probabilidade de o resultado ser maior ou igual a `target` (ex.: uma CD)."""
+        index = int(np.searchsorted(self.values, target))
+        if index <= 0:
+            return 1.0
+        return float(max(0.0, 1.0 - self.cdf[index - 1]))
+
+    def as_dict(self, target=None):
+        if target is None:
+            return self.summary
+        return dict(self.summary, target=target, atLeast=self.at_least(target))
+
+def build_odds(expression) -> DiceOdds:
+    """Distribuição e estatísticas da expressão; todo o trabalho pesado, para rodar fora do event loop."""
+    if isinstance(expression, str):
+        expression = compile_expression(expression)
+    values, probabilities = compute_distribution(expression)
+    return DiceOdds(expression.notation, values, probabilities)
+
+_cache: "OrderedDict[str, DiceOdds]" = OrderedDict()
+# Cálculos em andamento por notação: pedidos simultâneos da mesma expressão esperam o mesmo
+_pending: "Dict[str, asyncio.Future]" = {}
+
+def _store(notation, future):
+    del _pending[notation]
+    if future.cancelled() or future.exception() is not None:
+        return
+    _cache[notation] = future.result()
+    if len(_cache) > ODDS_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+async def get_odds(expression: str) -> DiceOdds:
+    """Distribuição da expressão, servida do LRU; em caso de ausência o cálculo
+    (distribuição e estatísticas) roda em uma thread para não bloquear o event loop."""
+    compiled = compile_expression(expression)
+    notation = compiled.notation
+    odds = _cache.get(notation)
+    if odds is not None:
+        _cache.move_to_end(notation)
+        return odds
+
+    future = _pending.get(notation)
+    if future is None:
+        future = _pending[notation] = asyncio.ensure_future(asyncio.to_thread(build_odds, compiled))
+        future.add_done_callback(lambda done: _store(notation, done))
+    # shield: um cliente que desiste não cancela o cálculo dos outros
+    return await asyncio.shield(future)
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import uuid
+from .serialization import dumps_text, loads
+
+logger = logging.getLogger(__name__)
+
+# Canal do Postgres compartilhado por todos os workers
+EVENT_CHANNEL = "rpgfast_events"
+# O payload de um NOTIFY é limitado a 8000 bytes pelo Postgres
+MAX_NOTIFY_PAYLOAD = 7900
+
+class EventBus:
+    """Barramento de eventos entre processos sobre LISTEN/NOTIFY do Postgres.
+
+    Cada worker publica as mutações com `publish` e recebe, pelo LISTEN, os
+    eventos de todos os workers (inclusive os seus), que são repassados em
+    ordem para `handler(event, payload, local)` para serem enviados aos
+    sockets locais. Enquanto o barramento não está ativo, os eventos são
+    entregues direto ao handler, como em um único processo.
+    """
+
+    def __init__(self, db, handler):
+        self.db = db
+        self.handler = handler
+        self.worker_id = str(uuid.uuid4())
+        self._conn = None
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._dispatcher = None
+
+    @property
+    def running(self):
+        return self._conn is not None
+
+    async def start(self):
+        """Reserva uma conexão do pool para o LISTEN e inicia o despachante."""
+        self._conn = await self.db.pool.acquire()
+        self._conn.add_termination_listener(self._on_connection_lost)
+        await self._conn.add_listener(EVENT_CHANNEL, self._on_notify)
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        logger.info(f"Event bus listening on '{EVENT_CHANNEL}' (worker {self.worker_id})")
+
+    async def stop(self):
+        conn, self._conn = self._conn, None
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        if conn is not None and not conn.is_closed():
+            await conn.remove_listener(EVENT_CHANNEL, self._on_notify)
+            await self.db.pool.release(conn)
+
+    async def publish(self, event: str, payload: dict):
+        if not self.running:
+            await self.handler(event, payload, True)
+            return
+
+        message = dumps_text({"event": event, "origin": self.worker_id, "payload": payload})
+        if len(message.encode()) > MAX_NOTIFY_PAYLOAD:
+            raise ValueError(f"Event '{event}' payload too large for NOTIFY")
+        async with self.db.pool.acquire() as conn:
+            await conn.execute('SELECT pg_notify($1, $2)', EVENT_CHANNEL, message)
+
+    def _on_notify(self, conn, pid, channel, message):
+        self._queue.put_nowait(message)
+
+    def _on_connection_lost(self, conn):
+        # Sem o LISTEN os eventos dos outros workers se perdem: volta a entregar
+        # localmente e tenta escutar de novo
+        lost, self._conn = self._conn, None
+        if lost is None:
+            return # Parado com stop(): nada a reconectar
+        logger.error("Event bus connection lost; reconnecting")
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        asyncio.get_event_loop().create_task(self._reconnect(lost))
+
+    async def _reconnect(self, lost=None):
+        if lost is not None:
+            # Devolve ao pool a conexão perdida; sem isso a vaga dela nunca é liberada
+            try:
+                await self.db.pool.release(lost)
+            except Exception as e:
+                logger.warning(f"Could not release lost event bus connection: {e!r}")
+                lost.terminate()
+        delay = 1
+        while not self.running:
+            try:
+                await self.start()
+            except Exception as e:
+                logger.warning(f"Event bus reconnect failed: {e!r}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def _dispatch_loop(self):
+        # Um único consumidor mantém a ordem dos eventos
+        while True:
+            message = await self._queue.get()
+            try:
+                data = loads(message)
+                await self.handler(data["event"], data["payload"], data["origin"] == self.worker_id)
+            except Exception as e:
+                logger.error(f"Error dispatching event bus message: {e}", exc_info=True)
@@ -17,14 +17,16 @@ import uuid
 import asyncio
 from datetime import datetime
 import random
-from .database import Database
 import uvicorn
 
-# Import the FastAPI app instance created in app_setup
-from .app_setup import app
+# Import the FastAPI app instance created in app_setup, along with the shared
+# database (and its in-memory user directory) and WebSocket manager
+from .app_setup import app, db, manager, MASTER_CODE
+from .database import DEFAULT_CAMPAIGN
+from .serialization import FastJSONResponse
 
 # Import routers
-from .routers import auth, characters, npcs, shared_items, shared_abilities, master_notes
+from .routers import auth, characters, messages, npcs, shared_items, shared_abilities, master_notes, dice
 
 # Import WebSocket endpoint handler
 from .websocket_handler import websocket_endpoint
@@ -34,6 +36,7 @@ class LoginRequest(BaseModel):
     nickname: str
     master_code: Optional[str] = None
     character_id: Optional[str] = None
+    campaign_id: str = DEFAULT_CAMPAIGN
 
 def datetime_serializer(obj):
     """JSON serializer for objects not serializable by default json code"""
@@ -50,59 +53,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Código mestre para DM
-MASTER_CODE = "master123"
-
-# Conexão com o banco de dados
-db = Database()
-
-# Gerenciador de conexões WebSocket
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-    
-    async def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-    
-    async def send_personal_message(self, message: str, user_id: str):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(message)
-    
-    async def broadcast(self, message: str):
-        for connection in self.active_connections.values():
-            await connection.send_text(message)
-    
-    async def broadcast_users(self):
-        users = await db.get_users()
-        await self.broadcast(json.dumps({"type": "users", "data": users}, default=datetime_serializer))
-    
-    async def broadcast_messages(self):
-        messages = await db.get_messages()
-        await self.broadcast(json.dumps({"type": "messages", "data": messages}, default=datetime_serializer))
-    
-    async def broadcast_shared_items(self):
-        items = await db.get_shared_items()
-        await self.broadcast(json.dumps({"type": "shared_items", "data": items}, default=datetime_serializer))
-    
-    async def broadcast_shared_abilities(self):
-        abilities = await db.get_shared_abilities()
-        await self.broadcast(json.dumps({"type": "shared_abilities", "data": abilities}, default=datetime_serializer))
-
-manager = ConnectionManager()
-
-@app.on_event("startup")
-async def startup_event():
-    await db.connect()
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    await db.close()
-
 # Rotas da API
 @app.post("/api/login")
 async def login(request_data: LoginRequest = Body(...)):
@@ -110,6 +60,7 @@ async def login(request_data: LoginRequest = Body(...)):
     nickname = request_data.nickname
     master_code = request_data.master_code
     character_id = request_data.character_id
+    campaign_id = request_data.campaign_id
 
     if not nickname:
         return {"success": False, "error": "Nickname is required"}
@@ -119,17 +70,19 @@ async def login(request_data: LoginRequest = Body(...)):
     
     if is_master:
     # Verificar se já existe um mestre
-        users = await db.get_users()
-        for user in users:
-            if user.get("isMaster", True):
-                return {"success": True, "user": user}
+        existing_master = await db.find_master(campaign_id)
+        if existing_master:
+            return {"success": True, "user": existing_master}
     
         # Criar novo usuário mestre
         user_id = str(uuid.uuid4())
-        await db.create_user(user_id, nickname, is_master)
-    
-        # Obter o usuário criado
-        user = await db.get_user(user_id)
+        # Usuário e linhas padrão da ficha em uma única transação
+        async with db.unit_of_work():
+            await db.create_user(user_id, nickname, is_master, campaign_id=campaign_id)
+            # Obter o usuário criado
+            user = await db.get_user(user_id)
+        # Outros workers atualizam o diretório pelo evento
+        await manager.broadcast_users(campaign_id)
     
         return {"user": user, "success": True}
     else:
@@ -138,12 +91,13 @@ async def login(request_data: LoginRequest = Body(...)):
             return {"success": False, "error": "Character ID must be 3 digits"}
 
         # Verificar se o personagem existe
-        existing_character = await db.get_character_by_id(character_id)
+        existing_character = await db.get_character_by_id(character_id, campaign_id)
 
         if existing_character:
             # Personagem existe, atualizar nickname se necessário
             user_id = existing_character["userId"]
             await db.update_user_nickname(user_id, nickname)
+            await manager.broadcast_users(campaign_id)
 
             # Obter o usuário atualizado
             user = await db.get_user(user_id)
@@ -153,12 +107,9 @@ async def login(request_data: LoginRequest = Body(...)):
             return {"success": False, "error":"Jogador não encontrado."}
 
 @app.get("/api/users")
-async def get_users():
-    return await db.get_users()
-
-@app.get("/api/messages")
-async def get_messages():
-    return await db.get_messages()
+async def get_users(campaign_id: str = DEFAULT_CAMPAIGN):
+    # Resposta já pronta: pula o jsonable_encoder do FastAPI
+    return FastJSONResponse(await db.get_users(campaign_id))
 
 @app.get("/api/character/{user_id}")
 async def get_character(user_id: str):
@@ -169,33 +120,35 @@ async def get_character(user_id: str):
 
 @app.put("/api/character/{user_id}")
 async def update_character(user_id: str, character: dict):
-    # Verificar se o personagem existe
-    existing_character = await db.get_character(user_id)
-    if not existing_character:
-        raise HTTPException(status_code=404, detail="Character not found")
-    
-    # Atualizar atributos
-    if "attributes" in character:
-        await db.update_character_attributes(user_id, character["attributes"])
-    
-    # Atualizar perícias
-    if "skills" in character:
-        await db.update_character_skills(user_id, character["skills"])
-    
-    # Atualizar habilidades
-    if "abilities" in character:
-        await db.update_character_abilities(user_id, character["abilities"])
-    
-    # Atualizar inventário
-    if "inventory" in character:
-        await db.update_character_inventory(user_id, character["inventory"])
-    
-    # Atualizar moedas
-    if "currency" in character:
-        await db.update_character_currency(user_id, character["currency"])
-    
-    # Retornar o personagem atualizado
-    return await db.get_character(user_id)
+    # Toda a atualização em uma única conexão e transação
+    async with db.unit_of_work():
+        # Verificar se o personagem existe
+        existing_character = await db.get_character(user_id)
+        if not existing_character:
+            raise HTTPException(status_code=404, detail="Character not found")
+
+        # Atualizar atributos
+        if "attributes" in character:
+            await db.update_character_attributes(user_id, character["attributes"])
+
+        # Atualizar perícias
+        if "skills" in character:
+            await db.update_character_skills(user_id, character["skills"])
+
+        # Atualizar habilidades
+        if "abilities" in character:
+            await db.update_character_abilities(user_id, character["abilities"])
+
+        # Atualizar inventário
+        if "inventory" in character:
+            await db.update_character_inventory(user_id, character["inventory"])
+
+        # Atualizar moedas
+        if "currency" in character:
+            await db.update_character_currency(user_id, character["currency"])
+
+        # Retornar o personagem atualizado
+        return await db.get_character(user_id)
 
 @app.put("/api/character/{user_id}/health")
 async def update_health(user_id: str, health_points: int):
@@ -207,8 +160,8 @@ async def update_health(user_id: str, health_points: int):
     # Atualizar pontos de vida
     await db.update_user_health(user_id, health_points)
     
-    # Atualizar lista de usuários para todos
-    await manager.broadcast_users()
+    # Atualizar lista de usuários para todos da mesa
+    await manager.broadcast_users(user["campaignId"])
     
     return {"success": True}
 
@@ -262,33 +215,35 @@ async def create_shared_item(master_id: str, item_data: dict):
     await db.create_shared_item(item_id, master_id, item_data)
     
     # Atualizar itens compartilhados para todos
-    await manager.broadcast_shared_items()
+    await manager.broadcast_shared_items(user["campaignId"])
     
     # Retornar o item criado
     item_data["id"] = item_id
     return item_data
 
 @app.get("/api/shared-items")
-async def get_shared_items(master_id: Optional[str] = None):
-    return await db.get_shared_items(master_id)
+async def get_shared_items(master_id: Optional[str] = None, campaign_id: str = DEFAULT_CAMPAIGN):
+    return await db.get_shared_items(master_id, campaign_id)
 
 @app.put("/api/shared-items/{item_id}")
 async def update_shared_item(item_id: str, item_data: dict):
     # Atualizar item compartilhado
-    await db.update_shared_item(item_id, item_data)
+    campaign_id = await db.update_shared_item(item_id, item_data)
     
     # Atualizar itens compartilhados para todos
-    await manager.broadcast_shared_items()
+    if campaign_id:
+        await manager.broadcast_shared_items(campaign_id)
     
     return {"success": True}
 
 @app.delete("/api/shared-items/{item_id}")
 async def delete_shared_item(item_id: str):
     # Excluir item compartilhado
-    await db.delete_shared_item(item_id)
+    campaign_id = await db.delete_shared_item(item_id)
     
     # Atualizar itens compartilhados para todos
-    await manager.broadcast_shared_items()
+    if campaign_id:
+        await manager.broadcast_shared_items(campaign_id)
     
     return {"success": True}
 
@@ -304,33 +259,35 @@ async def create_shared_ability(master_id: str, ability_data: dict):
     await db.create_shared_ability(ability_id, master_id, ability_data)
     
     # Atualizar habilidades compartilhadas para todos
-    await manager.broadcast_shared_abilities()
+    await manager.broadcast_shared_abilities(user["campaignId"])
     
     # Retornar a habilidade criada
     ability_data["id"] = ability_id
     return ability_data
 
 @app.get("/api/shared-abilities")
-async def get_shared_abilities(master_id: Optional[str] = None):
-    return await db.get_shared_abilities(master_id)
+async def get_shared_abilities(master_id: Optional[str] = None, campaign_id: str = DEFAULT_CAMPAIGN):
+    return await db.get_shared_abilities(master_id, campaign_id)
 
 @app.put("/api/shared-abilities/{ability_id}")
 async def update_shared_ability(ability_id: str, ability_data: dict):
     # Atualizar habilidade compartilhada
-    await db.update_shared_ability(ability_id, ability_data)
+    campaign_id = await db.update_shared_ability(ability_id, ability_data)
     
     # Atualizar habilidades compartilhadas para todos
-    await manager.broadcast_shared_abilities()
+    if campaign_id:
+        await manager.broadcast_shared_abilities(campaign_id)
     
     return {"success": True}
 
 @app.delete("/api/shared-abilities/{ability_id}")
 async def delete_shared_ability(ability_id: str):
     # Excluir habilidade compartilhada
-    await db.delete_shared_ability(ability_id)
+    campaign_id = await db.delete_shared_ability(ability_id)
     
     # Atualizar habilidades compartilhadas para todos
-    await manager.broadcast_shared_abilities()
+    if campaign_id:
+        await manager.broadcast_shared_abilities(campaign_id)
     
     return {"success": True}
 
@@ -391,10 +348,12 @@ async def add_ability_to_character(user_id: str, ability_data: dict):
 # The prefix ensures all routes from a router start with /api
 app.include_router(auth.router, prefix="/api")
 app.include_router(characters.router, prefix="/api")
+app.include_router(messages.router, prefix="/api")
 app.include_router(npcs.router, prefix="/api")
 app.include_router(shared_items.router, prefix="/api")
 app.include_router(shared_abilities.router, prefix="/api")
 app.include_router(master_notes.router, prefix="/api")
+app.include_router(dice.router, prefix="/api")
 
 # --- Define WebSocket Route --- 
 # This uses the handler function imported from websocket_handler.py
@@ -0,0 +1,198 @@
+import asyncio
+import gzip
+import logging
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Onde ficam os arquivos NDJSON (gzip) das partições arquivadas
+ARCHIVE_DIR = Path(os.getenv("MESSAGES_ARCHIVE_DIR", Path(__file__).resolve().parent / "archive"))
+# Meses completos mantidos no banco além do mês atual; os mais antigos são arquivados
+MESSAGES_HOT_MONTHS = int(os.getenv("MESSAGES_HOT_MONTHS", "3"))
+# Linhas lidas por vez ao exportar uma partição
+ARCHIVE_BATCH_SIZE = 1000
+# Arquivos já lidos (mensagens de uma campanha) mantidos em memória para a paginação
+ARCHIVE_CACHE_SIZE = int(os.getenv("MESSAGES_ARCHIVE_CACHE_SIZE", "16"))
+
+# --- Partições mensais de messages ---
+
+def month_start(moment: datetime) -> datetime:
+    return moment.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+def partition_name(month: datetime) -> str:
+    return f"messages_p{month:%Y%m}"
+
+def partition_month(name: str) -> datetime:
+    return datetime.strptime(name[len("messages_p"):], "%Y%m").replace(tzinfo=timezone.utc)
+
+async def create_month_partition(conn, month: datetime):
+    """Cria (se ainda não existir) a partição de messages do mês."""
+    # DDL não aceita parâmetros: os limites são gerados aqui, não vêm do usuário
+    await conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF messages "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+async def ensure_partitions(conn, now: datetime = None):
+    """Garante as partições do mês atual e do próximo."""
+    current = month_start(now or datetime.now(timezone.utc))
+    for offset in (0, 1):
+        await create_month_partition(conn, add_months(current, offset))
+
+async def _month_partitions(conn):
+    rows = await conn.fetch(
+        '''
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass AND c.relname LIKE 'messages\\_p%'
+        ORDER BY c.relname
+        '''
+    )
+    return [row['relname'] for row in rows]
+
+# --- Arquivamento ---
+
+def _write_lines(handle, rows):
+    for row in rows:
+        handle.write(dumps(row) + b"\n")
+
+async def _export_partition(conn, name: str, path: Path):
+    """Copia a partição para um arquivo NDJSON comprimido; retorna
+    (linhas, menor seq, maior seq, primeira data, última data, campanhas)."""
+    tmp_path = path.with_suffix(".tmp")
+    count, min_seq, max_seq, campaigns = 0, None, None, set()
+    min_timestamp, max_timestamp = None, None
+    handle = await asyncio.to_thread(gzip.open, tmp_path, "wb")
+    try:
+        async with conn.transaction():
+            cursor = await conn.cursor(f"SELECT * FROM {name} ORDER BY seq")
+            while True:
+                records = await cursor.fetch(ARCHIVE_BATCH_SIZE)
+                if not records:
+                    break
+                rows = [dict(record) for record in records]
+                for row in rows:
+                    row.pop('search_vector', None) # Derivado do conteúdo, não precisa ir para o arquivo
+                    campaigns.add(row['campaign_id'])
+                    if min_timestamp is None or row['timestamp'] < min_timestamp:
+                        min_timestamp = row['timestamp']
+                    if max_timestamp is None or row['timestamp'] > max_timestamp:
+                        max_timestamp = row['timestamp']
+                min_seq = rows[0]['seq'] if min_seq is None else min_seq
+                max_seq = rows[-1]['seq']
+                count += len(rows)
+                await asyncio.to_thread(_write_lines, handle, rows)
+    finally:
+        await asyncio.to_thread(handle.close)
+    os.replace(tmp_path, path)
+    return count, min_seq, max_seq, min_timestamp, max_timestamp, sorted(campaigns)
+
+async def archive_old_partitions(conn, now: datetime = None):
+    """Exporta para ARCHIVE_DIR as partições mais antigas que a janela quente,
+    registra cada uma em message_archives e as remove do banco."""
+    cutoff = add_months(month_start(now or datetime.now(timezone.utc)), -MESSAGES_HOT_MONTHS)
+    archived = []
+    for name in await _month_partitions(conn):
+        month = partition_month(name)
+        if month >= cutoff:
+            continue
+        ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+        path = ARCHIVE_DIR / f"{name}.ndjson.gz"
+        count, min_seq, max_seq, min_timestamp, max_timestamp, campaigns = await _export_partition(conn, name, path)
+        async with conn.transaction():
+            await conn.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+            if count:
+                await conn.execute(
+                    '''
+                    INSERT INTO message_archives (partition, range_start, range_end, path, min_seq, max_seq,
+                                                  min_timestamp, max_timestamp, message_count, campaign_ids)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                    ON CONFLICT (partition) DO UPDATE SET path = EXCLUDED.path, min_seq = EXCLUDED.min_seq,
+                        max_seq = EXCLUDED.max_seq, min_timestamp = EXCLUDED.min_timestamp, max_timestamp = EXCLUDED.max_timestamp,
+                        message_count = EXCLUDED.message_count, campaign_ids = EXCLUDED.campaign_ids
+                    ''',
+                    name, month, add_months(month, 1), str(path), min_seq, max_seq,
+                    min_timestamp, max_timestamp, count, campaigns
+                )
+            await conn.execute(f"DROP TABLE {name}")
+        if not count:
+            path.unlink(missing_ok=True)
+        logger.info(f"Archived partition {name} ({count} messages) to {path}")
+        archived.append(name)
+    return archived
+
+# --- Leitura do histórico arquivado ---
+
+# (caminho, mtime, campanha) -> (seqs, mensagens), em ordem de seq
+_archive_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_archive_cache_lock = threading.Lock() # Lido e preenchido a partir das threads do to_thread
+
+def _campaign_rows(path: str, campaign_id: str):
+    """Mensagens da campanha no arquivo, descomprimido e decodificado uma vez
+    e guardado no LRU; linhas de outras campanhas nem são decodificadas."""
+    key = (path, os.stat(path).st_mtime_ns, campaign_id)
+    with _archive_cache_lock:
+        cached = _archive_cache.get(key)
+        if cached is not None:
+            _archive_cache.move_to_end(key)
+            return cached
+
+    marker = b'"campaign_id":' + dumps(campaign_id)
+    rows = []
+    with gzip.open(path, "rb") as handle:
+        for line in handle:
+            if marker not in line:
+                continue
+            row = loads(line)
+            if row['campaign_id'] == campaign_id:
+                rows.append(row)
+    cached = ([row['seq'] for row in rows], rows)
+
+    with _archive_cache_lock:
+        _archive_cache[key] = cached
+        while len(_archive_cache) > ARCHIVE_CACHE_SIZE:
+            _archive_cache.popitem(last=False)
+    return cached
+
+def read_archive(path: str, campaign_id: str, before=None, after=None):
+    """Mensagens da campanha em um arquivo, em ordem de seq, dentro do intervalo pedido."""
+    seqs, rows = _campaign_rows(path, campaign_id)
+    start = bisect_right(seqs, after) if after is not None else 0
+    end = bisect_left(seqs, before) if before is not None else len(rows)
+    return rows[start:end]
+
+async def archived_messages(archives, campaign_id: str, limit: int, before=None, after=None):
+    """Janela do histórico arquivado, lendo só os arquivos necessários.
+
+    `archives` são linhas de message_archives (path, min_seq, max_seq) da
+    campanha. Com `after`, retorna as `limit` primeiras mensagens depois do
+    cursor; senão, as `limit` últimas antes de `before`. Sempre em seq crescente.
+    """
+    collected = []
+    if after is not None:
+        for archive in sorted(archives, key=lambda a: a['min_seq']):
+            if archive['max_seq'] <= after:
+                continue
+            collected += await asyncio.to_thread(read_archive, archive['path'], campaign_id, before, after)
+            if len(collected) >= limit:
+                break
+        return collected[:limit]
+
+    for archive in sorted(archives, key=lambda a: a['max_seq'], reverse=True):
+        if before is not None and archive['min_seq'] >= before:
+            continue
+        collected = await asyncio.to_thread(read_archive, archive['path'], campaign_id, before, None) + collected
+        if len(collected) >= limit:
+            break
+    return collected[-limit:] if limit else []
@@ -0,0 +1,435 @@
+import logging
+from datetime import datetime, timezone
+
+from .message_archive import add_months, create_month_partition, month_start
+
+logger = logging.getLogger(__name__)
+
+# Chave do advisory lock que serializa as migrações entre workers
+MIGRATION_LOCK_KEY = 720_451_001
+# Configuração de texto do Postgres usada na busca do chat
+SEARCH_CONFIG = 'portuguese'
+
+
+async def initial_schema(conn):
+    """Tabelas da aplicação, como eram criadas pelo antigo Database.create_tables.
+
+    Usa IF NOT EXISTS para que bancos criados antes das migrações sejam
+    apenas marcados como versão 1.
+    """
+    # Tabela de usuários
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            campaign_id TEXT NOT NULL DEFAULT 'default',
+            nickname TEXT NOT NULL,
+            is_master BOOLEAN NOT NULL DEFAULT FALSE,
+            character_id TEXT,
+            master_code TEXT,
+            health_points INTEGER NOT NULL DEFAULT 10,
+            max_health_points INTEGER NOT NULL DEFAULT 10,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela de mensagens
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id TEXT PRIMARY KEY,
+            seq BIGSERIAL,
+            campaign_id TEXT NOT NULL DEFAULT 'default',
+            user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            nickname TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            is_dice_roll BOOLEAN DEFAULT FALSE,
+            dice_type TEXT,
+            dice_result INTEGER
+        )
+    ''')
+
+    # Sequência estável das mensagens, usada como cursor do histórico
+    await conn.execute('ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq BIGSERIAL')
+    await conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS messages_seq_idx ON messages (seq)')
+
+    # Tabela de resultados de dados
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS dice_results (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            result INTEGER NOT NULL,
+            timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela de atributos
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS attributes (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            strength INTEGER NOT NULL DEFAULT 10,
+            dexterity INTEGER NOT NULL DEFAULT 10,
+            constitution INTEGER NOT NULL DEFAULT 10,
+            intelligence INTEGER NOT NULL DEFAULT 10,
+            wisdom INTEGER NOT NULL DEFAULT 10,
+            charisma INTEGER NOT NULL DEFAULT 10
+        )
+    ''')
+
+    # Tabela de perícias
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS skills (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            proficient BOOLEAN NOT NULL DEFAULT FALSE
+        )
+    ''')
+
+    # Tabela de habilidades
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS abilities (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL,
+            type TEXT,
+            cost TEXT,
+            range TEXT,
+            duration TEXT,
+            effect TEXT,
+            is_public BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela de inventário
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS inventory (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            type TEXT,
+            rarity TEXT,
+            value TEXT,
+            weight TEXT,
+            effect TEXT
+        )
+    ''')
+
+    # Tabela de moedas
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS currency (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            bronze INTEGER NOT NULL DEFAULT 0,
+            silver INTEGER NOT NULL DEFAULT 0,
+            gold INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # Tabela de NPCs
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS npcs (
+            id TEXT PRIMARY KEY,
+            campaign_id TEXT NOT NULL DEFAULT 'default',
+            master_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            nickname TEXT NOT NULL,
+            health_points INTEGER NOT NULL DEFAULT 10,
+            max_health_points INTEGER NOT NULL DEFAULT 10,
+            show_health_bar BOOLEAN NOT NULL DEFAULT TRUE,
+            health_bar_color TEXT DEFAULT 'green',
+            show_in_chat BOOLEAN NOT NULL DEFAULT FALSE,
+            notes TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela de atributos de NPCs
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS npc_attributes (
+            id SERIAL PRIMARY KEY,
+            npc_id TEXT NOT NULL REFERENCES npcs(id) ON DELETE CASCADE,
+            strength INTEGER NOT NULL DEFAULT 10,
+            dexterity INTEGER NOT NULL DEFAULT 10,
+            constitution INTEGER NOT NULL DEFAULT 10,
+            intelligence INTEGER NOT NULL DEFAULT 10,
+            wisdom INTEGER NOT NULL DEFAULT 10,
+            charisma INTEGER NOT NULL DEFAULT 10
+        )
+    ''')
+
+    # Tabela de perícias de NPCs
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS npc_skills (
+            id SERIAL PRIMARY KEY,
+            npc_id TEXT NOT NULL REFERENCES npcs(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            proficient BOOLEAN NOT NULL DEFAULT FALSE
+        )
+    ''')
+
+    # Tabela de habilidades de NPCs
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS npc_abilities (
+            id TEXT PRIMARY KEY,
+            npc_id TEXT NOT NULL REFERENCES npcs(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL
+        )
+    ''')
+
+    # Tabela de inventário de NPCs
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS npc_inventory (
+            id TEXT PRIMARY KEY,
+            npc_id TEXT NOT NULL REFERENCES npcs(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+
+    # Tabela de itens compartilhados
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS shared_items (
+            id TEXT PRIMARY KEY,
+            campaign_id TEXT NOT NULL DEFAULT 'default',
+            master_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL,
+            type TEXT,
+            rarity TEXT,
+            value TEXT,
+            weight TEXT,
+            effect TEXT,
+            is_public BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela de habilidades compartilhadas
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS shared_abilities (
+            id TEXT PRIMARY KEY,
+            campaign_id TEXT NOT NULL DEFAULT 'default',
+            master_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL,
+            type TEXT,
+            cost TEXT,
+            range TEXT,
+            duration TEXT,
+            effect TEXT,
+            is_public BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela de notas do mestre
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS master_notes (
+            id TEXT PRIMARY KEY,
+            master_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            category TEXT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Campanhas (mesas): bancos criados antes das mesas ficam na 'default'
+    for table in ('users', 'messages', 'npcs', 'shared_items', 'shared_abilities'):
+        await conn.execute(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS campaign_id TEXT NOT NULL DEFAULT 'default'"
+        )
+    # O ID de 3 dígitos do personagem é único por mesa, não no servidor inteiro
+    await conn.execute('ALTER TABLE users DROP CONSTRAINT IF EXISTS users_character_id_key')
+    await conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS users_campaign_character_idx ON users (campaign_id, character_id)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS messages_campaign_seq_idx ON messages (campaign_id, seq)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS npcs_campaign_idx ON npcs (campaign_id)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS shared_items_campaign_idx ON shared_items (campaign_id)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS shared_abilities_campaign_idx ON shared_abilities (campaign_id)')
+
+
+async def hot_path_indexes(conn):
+    """Índices das consultas frequentes e das foreign keys (buscas e ON DELETE CASCADE)."""
+    statements = [
+        # Últimos dados de cada usuário (USERS_QUERY)
+        'CREATE INDEX IF NOT EXISTS dice_results_user_timestamp_idx ON dice_results (user_id, timestamp DESC)',
+        'CREATE INDEX IF NOT EXISTS messages_user_idx ON messages (user_id)',
+        # Ficha do personagem (CHARACTER_QUERY); perícias são agregadas na ordem do id
+        'CREATE INDEX IF NOT EXISTS attributes_user_idx ON attributes (user_id)',
+        'CREATE INDEX IF NOT EXISTS skills_user_id_idx ON skills (user_id, id)',
+        'CREATE INDEX IF NOT EXISTS abilities_user_idx ON abilities (user_id)',
+        'CREATE INDEX IF NOT EXISTS inventory_user_idx ON inventory (user_id)',
+        'CREATE INDEX IF NOT EXISTS currency_user_idx ON currency (user_id)',
+        # NPCs do mestre e suas sub-coleções
+        'CREATE INDEX IF NOT EXISTS npcs_master_idx ON npcs (master_id)',
+        'CREATE INDEX IF NOT EXISTS npcs_campaign_chat_idx ON npcs (campaign_id) WHERE show_in_chat',
+        'CREATE INDEX IF NOT EXISTS npc_attributes_npc_idx ON npc_attributes (npc_id)',
+        'CREATE INDEX IF NOT EXISTS npc_skills_npc_id_idx ON npc_skills (npc_id, id)',
+        'CREATE INDEX IF NOT EXISTS npc_abilities_npc_idx ON npc_abilities (npc_id)',
+        'CREATE INDEX IF NOT EXISTS npc_inventory_npc_idx ON npc_inventory (npc_id)',
+        # Itens, habilidades e notas por mestre
+        'CREATE INDEX IF NOT EXISTS shared_items_master_idx ON shared_items (master_id)',
+        'CREATE INDEX IF NOT EXISTS shared_abilities_master_idx ON shared_abilities (master_id)',
+        'CREATE INDEX IF NOT EXISTS master_notes_master_idx ON master_notes (master_id, created_at)',
+    ]
+    for statement in statements:
+        await conn.execute(statement)
+
+
+async def partition_messages(conn):
+    """Recria messages particionada por mês (RANGE em timestamp), copiando as
+    mensagens existentes, e cria o catálogo das partições arquivadas.
+
+    Chaves únicas de uma tabela particionada precisam incluir a coluna de
+    partição: a PK passa a ser (id, timestamp). O seq continua vindo da mesma
+    sequência, então os cursores do histórico não mudam.
+    """
+    sequence = await conn.fetchval("SELECT pg_get_serial_sequence('messages', 'seq')")
+    await conn.execute(f'ALTER SEQUENCE {sequence} OWNED BY NONE')
+    for index in ('messages_seq_idx', 'messages_campaign_seq_idx', 'messages_user_idx'):
+        await conn.execute(f'DROP INDEX IF EXISTS {index}')
+    await conn.execute('ALTER TABLE messages RENAME TO messages_legacy')
+    await conn.execute('ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey')
+
+    await conn.execute(f'''
+        CREATE TABLE messages (
+            id TEXT NOT NULL,
+            seq BIGINT NOT NULL DEFAULT nextval('{sequence}'),
+            campaign_id TEXT NOT NULL DEFAULT 'default',
+            user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            nickname TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            is_dice_roll BOOLEAN DEFAULT FALSE,
+            dice_type TEXT,
+            dice_result INTEGER,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    ''')
+    await conn.execute(f'ALTER SEQUENCE {sequence} OWNED BY messages.seq')
+    # Rede de segurança para linhas fora das partições mensais criadas
+    await conn.execute('CREATE TABLE messages_default PARTITION OF messages DEFAULT')
+
+    # Uma partição por mês, da mensagem mais antiga até o próximo mês
+    oldest = await conn.fetchval('SELECT MIN(timestamp) FROM messages_legacy')
+    now = datetime.now(timezone.utc)
+    month = month_start(oldest or now)
+    last = add_months(month_start(now), 1)
+    while month <= last:
+        await create_month_partition(conn, month)
+        month = add_months(month, 1)
+
+    await conn.execute('''
+        INSERT INTO messages (id, seq, campaign_id, user_id, nickname, content, timestamp, is_dice_roll, dice_type, dice_result)
+        SELECT id, seq, campaign_id, user_id, nickname, content, COALESCE(timestamp, CURRENT_TIMESTAMP), is_dice_roll, dice_type, dice_result
+        FROM messages_legacy
+    ''')
+    await conn.execute('DROP TABLE messages_legacy')
+
+    await conn.execute('CREATE INDEX messages_campaign_seq_idx ON messages (campaign_id, seq)')
+    await conn.execute('CREATE INDEX messages_seq_idx ON messages (seq)')
+    await conn.execute('CREATE INDEX messages_user_idx ON messages (user_id)')
+
+    # Partições exportadas para NDJSON pelo arquivamento (message_archive)
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS message_archives (
+            partition TEXT PRIMARY KEY,
+            range_start TIMESTAMP WITH TIME ZONE NOT NULL,
+            range_end TIMESTAMP WITH TIME ZONE NOT NULL,
+            path TEXT NOT NULL,
+            min_seq BIGINT NOT NULL,
+            max_seq BIGINT NOT NULL,
+            message_count INTEGER NOT NULL,
+            campaign_ids TEXT[] NOT NULL,
+            archived_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    await conn.execute('CREATE INDEX IF NOT EXISTS message_archives_campaigns_idx ON message_archives USING GIN (campaign_ids)')
+
+
+async def message_search(conn):
+    """Busca textual no chat: tsvector gerado a partir do conteúdo (mantido pelo
+    próprio Postgres a cada INSERT) com índice GIN."""
+    await conn.execute(f'''
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', content)) STORED
+    ''')
+    await conn.execute('CREATE INDEX IF NOT EXISTS messages_search_idx ON messages USING GIN (search_vector)')
+
+
+async def master_notes_listing(conn):
+    """updated_at nas notas do mestre (base do ETag do conteúdo) e índice da
+    listagem paginada por categoria."""
+    await conn.execute('ALTER TABLE master_notes ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE')
+    await conn.execute('UPDATE master_notes SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL')
+    await conn.execute('ALTER TABLE master_notes ALTER COLUMN updated_at SET DEFAULT CURRENT_TIMESTAMP')
+    await conn.execute(
+        'CREATE INDEX IF NOT EXISTS master_notes_category_idx ON master_notes (master_id, category, created_at, id)'
+    )
+
+
+async def archive_time_range(conn):
+    """Primeira e última data de cada partição arquivada (nulas nas exportadas antes desta versão)."""
+    await conn.execute('ALTER TABLE message_archives ADD COLUMN IF NOT EXISTS min_timestamp TIMESTAMP WITH TIME ZONE')
+    await conn.execute('ALTER TABLE message_archives ADD COLUMN IF NOT EXISTS max_timestamp TIMESTAMP WITH TIME ZONE')
+
+
+# (versão, descrição, função). Novas migrações entram no fim, com a próxima versão;
+# as já publicadas não devem ser alteradas.
+MIGRATIONS = [
+    (1, "schema inicial", initial_schema),
+    (2, "índices das consultas frequentes", hot_path_indexes),
+    (3, "messages particionada por mês", partition_messages),
+    (4, "busca textual nas mensagens", message_search),
+    (5, "listagem das notas do mestre", master_notes_listing),
+    (6, "intervalo de datas das partições arquivadas", archive_time_range),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def _current_version(conn):
+    if await conn.fetchval("SELECT to_regclass('schema_migrations')") is None:
+        return 0
+    return await conn.fetchval('SELECT COALESCE(MAX(version), 0) FROM schema_migrations')
+
+
+async def run_migrations(conn):
+    """Aplica as migrações pendentes, cada uma em sua própria transação.
+
+    Com o schema atualizado, o boot faz só duas leituras e nenhum DDL.
+    """
+    if await _current_version(conn) >= LATEST_VERSION:
+        return
+
+    # Outro worker pode estar migrando ao mesmo tempo: espera por ele e relê a versão
+    await conn.execute('SELECT pg_advisory_lock($1)', MIGRATION_LOCK_KEY)
+    try:
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        current = await _current_version(conn)
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            logger.info(f"Applying migration {version}: {description}")
+            async with conn.transaction():
+                await migrate(conn)
+                await conn.execute(
+                    'INSERT INTO schema_migrations (version, description) VALUES ($1, $2)',
+                    version, description
+                )
+    finally:
+        await conn.execute('SELECT pg_advisory_unlock($1)', MIGRATION_LOCK_KEY)
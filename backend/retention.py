@@ -0,0 +1,52 @@
+import asyncio
+import logging
+import os
+
+from .message_archive import archive_old_partitions, ensure_partitions
+
+logger = logging.getLogger(__name__)
+
+# Resultados de dados mantidos por usuário (o roster só mostra os últimos, em memória)
+DICE_RESULTS_RETENTION = int(os.getenv("DICE_RESULTS_RETENTION", "50"))
+# Intervalo (segundos) entre execuções da limpeza
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600"))
+# Chave do advisory lock: só um worker executa a limpeza por vez
+RETENTION_LOCK_KEY = 720_451_002
+
+class RetentionJob:
+    """Task de fundo que poda periodicamente as tabelas que só crescem e
+    mantém as partições mensais de messages (criação e arquivamento)."""
+
+    def __init__(self, db):
+        self.db = db
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def run_once(self):
+        async with self.db.pool.acquire() as conn:
+            if not await conn.fetchval('SELECT pg_try_advisory_lock($1)', RETENTION_LOCK_KEY):
+                return # Outro worker já está limpando
+            try:
+                removed = await self.db.prune_dice_results(DICE_RESULTS_RETENTION)
+                if removed:
+                    logger.info(f"Retention: pruned {removed} dice results")
+                # Partições de messages: cria as próximas e arquiva as frias
+                await ensure_partitions(conn)
+                await archive_old_partitions(conn)
+            finally:
+                await conn.execute('SELECT pg_advisory_unlock($1)', RETENTION_LOCK_KEY)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Retention job failed: {e}", exc_info=True)
+            await asyncio.sleep(RETENTION_INTERVAL)
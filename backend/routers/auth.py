@@ -4,14 +4,15 @@ import uuid
 import logging # Import logging
 
 # Import necessary components from app_setup
-from ..app_setup import db, MASTER_CODE
+from ..app_setup import db, manager, MASTER_CODE
+from ..database import DEFAULT_CAMPAIGN
 
 router = APIRouter()
 logger = logging.getLogger(__name__) # Setup logger
 
 @router.post("/login", tags=["Authentication"])
-async def login(nickname: str, master_code: Optional[str] = None, character_id: Optional[str] = None):
-    logger.info(f"Login attempt: nickname={nickname}, master_code={'***' if master_code else None}, character_id={character_id}")
+async def login(nickname: str, master_code: Optional[str] = None, character_id: Optional[str] = None, campaign_id: str = DEFAULT_CAMPAIGN):
+    logger.info(f"Login attempt: nickname={nickname}, master_code={'***' if master_code else None}, character_id={character_id}, campaign_id={campaign_id}")
     if not nickname:
         logger.warning("Login failed: Nickname is required.")
         raise HTTPException(status_code=400, detail="Nickname is required")
@@ -20,22 +21,20 @@ async def login(nickname: str, master_code: Optional[str] = None, character_id:
 
     if is_master:
         logger.info("Master login attempt detected.")
-        users = await db.get_users()
-        existing_master = next((u for u in users if u.get("isMaster")), None)
+        existing_master = await db.find_master(campaign_id)
 
         if existing_master:
             logger.info(f"Existing master found: {existing_master['id']}. Allowing re-login.")
-            user = await db.get_user(existing_master['id'])
-            if not user:
-                 logger.error(f"Failed to fetch existing master user: {existing_master['id']}")
-                 raise HTTPException(status_code=404, detail="Failed to fetch existing master user")
-            logger.info(f"Returning success for existing master: {user['id']}")
-            return {"user": user, "success": True}
+            return {"user": existing_master, "success": True}
         else:
             logger.info("No existing master found. Creating a new one.")
             user_id = str(uuid.uuid4())
-            await db.create_user(user_id, nickname, is_master)
-            user = await db.get_user(user_id)
+            # The user and its default sheet rows are created in one transaction
+            async with db.unit_of_work():
+                await db.create_user(user_id, nickname, is_master, campaign_id=campaign_id)
+                user = await db.get_user(user_id)
+            # Other workers refresh their user directory from the event
+            await manager.broadcast_users(campaign_id)
             if not user:
                  logger.error(f"Failed to create or fetch new master user: {user_id}")
                  raise HTTPException(status_code=500, detail="Failed to create master user")
@@ -47,7 +46,7 @@ async def login(nickname: str, master_code: Optional[str] = None, character_id:
              logger.warning(f"Login failed: Invalid character_id: {character_id}")
              raise HTTPException(status_code=400, detail="Character ID must be 3 digits")
 
-        existing_character_user = await db.get_character_by_id(character_id)
+        existing_character_user = await db.get_character_by_id(character_id, campaign_id)
 
         if existing_character_user:
             user_id = existing_character_user["userId"]
@@ -56,6 +55,7 @@ async def login(nickname: str, master_code: Optional[str] = None, character_id:
             if current_user and current_user['nickname'] != nickname:
                  logger.info(f"Updating nickname for user {user_id} to {nickname}")
                  await db.update_user_nickname(user_id, nickname)
+                 await manager.broadcast_users(campaign_id)
             user = await db.get_user(user_id) # Re-fetch potentially updated user data
             if not user:
                 logger.error(f"Failed to fetch existing player user: {user_id}")
@@ -65,8 +65,10 @@ async def login(nickname: str, master_code: Optional[str] = None, character_id:
         else:
             logger.info(f"No existing character found for ID {character_id}. Creating new player character.")
             user_id = str(uuid.uuid4())
-            await db.create_user(user_id, nickname, False, character_id)
-            user = await db.get_user(user_id)
+            async with db.unit_of_work():
+                await db.create_user(user_id, nickname, False, character_id, campaign_id=campaign_id)
+                user = await db.get_user(user_id)
+            await manager.broadcast_users(campaign_id)
             if not user:
                 logger.error(f"Failed to create or fetch new player user: {user_id}")
                 raise HTTPException(status_code=500, detail="Failed to create new character user")
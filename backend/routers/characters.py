@@ -6,16 +6,18 @@ import uuid
 
 # Import necessary components from app_setup
 from ..app_setup import db, manager
+from ..database import DEFAULT_CAMPAIGN
+from ..serialization import FastJSONResponse
 
 router = APIRouter()
 
 # --- Função auxiliar para gerar ID único ---
-async def generate_unique_character_id():
-    """Gera um ID de personagem de 3 dígitos único."""
+async def generate_unique_character_id(campaign_id=DEFAULT_CAMPAIGN):
+    """Gera um ID de personagem de 3 dígitos único na campanha."""
     while True:
         # Gera um ID de 3 dígitos (000-999)
         char_id = "".join(random.choices(string.digits, k=3))
-        existing = await db.get_character_by_id(char_id)
+        existing = await db.get_character_by_id(char_id, campaign_id)
         if not existing:
             return char_id
 
@@ -32,50 +34,57 @@ async def master_create_character(master_id: str = Body(...), nickname: str = Bo
 
     # 3. Criar o novo usuário/personagem
     new_user_id = str(uuid.uuid4())
-    await db.create_user(new_user_id, nickname, is_master=False, character_id=character_id)
+    # O personagem entra na mesma campanha do mestre
+    campaign_id = master_user["campaignId"]
+    # Usuário e linhas padrão da ficha em uma única transação: uma falha no meio não deixa meio usuário
+    async with db.unit_of_work():
+        await db.create_user(new_user_id, nickname, is_master=False, character_id=character_id, campaign_id=campaign_id)
 
-    # 4. Buscar os dados do usuário recém-criado
-    new_user_data = await db.get_user(new_user_id)
-    if not new_user_data:
-        raise HTTPException(status_code=500, detail="Failed to retrieve newly created character.")
+        # 4. Buscar os dados do usuário recém-criado
+        new_user_data = await db.get_user(new_user_id)
+        if not new_user_data:
+            raise HTTPException(status_code=500, detail="Failed to retrieve newly created character.")
 
     # 5. Broadcast da lista de usuários atualizada (será filtrado no manager)
-    await manager.broadcast_users()
+    await manager.broadcast_users(campaign_id)
 
     # 6. Retornar os dados do novo personagem
     # Incluindo o character_id aqui, pois a resposta é para o mestre
     return {"user": new_user_data, "success": True}
 
 @router.delete("/master/characters/{character_id}", tags=["Master Actions", "Users & Characters"])
-async def master_delete_character(character_id: str):
+async def master_delete_character(character_id: str, campaign_id: str = DEFAULT_CAMPAIGN):
     """Endpoint para o mestre deletar um personagem jogador."""
     
-    # Encontrar o usuário pelo character_id
-    target_user_data = await db.get_character_by_id(character_id)
-    if not target_user_data:
-        raise HTTPException(status_code=404, detail=f"Character with ID {character_id} not found.")
-
-    # Obter o user_id do personagem a ser deletado
-    user_id_to_delete = target_user_data.get("userId")
-    if not user_id_to_delete:
-         raise HTTPException(status_code=500, detail=f"Could not determine user ID for character {character_id}.")
-
-    # Deletar o usuário (assumindo que a função delete_user existe no db)
-    deleted = await db.delete_user(user_id_to_delete)
-    if not deleted:
-        # Pode acontecer se o usuário foi deletado entre a verificação e a exclusão,
-        # ou se houve um erro na exclusão.
-        raise HTTPException(status_code=500, detail=f"Failed to delete user {user_id_to_delete}.")
+    # Busca e exclusão na mesma transação
+    async with db.unit_of_work():
+        # Encontrar o usuário pelo character_id
+        target_user_data = await db.get_character_by_id(character_id, campaign_id)
+        if not target_user_data:
+            raise HTTPException(status_code=404, detail=f"Character with ID {character_id} not found.")
+
+        # Obter o user_id do personagem a ser deletado
+        user_id_to_delete = target_user_data.get("userId")
+        if not user_id_to_delete:
+             raise HTTPException(status_code=500, detail=f"Could not determine user ID for character {character_id}.")
+
+        # Deletar o usuário (assumindo que a função delete_user existe no db)
+        deleted = await db.delete_user(user_id_to_delete)
+        if not deleted:
+            # Pode acontecer se o usuário foi deletado entre a verificação e a exclusão,
+            # ou se houve um erro na exclusão.
+            raise HTTPException(status_code=500, detail=f"Failed to delete user {user_id_to_delete}.")
 
     # Broadcast da lista de usuários atualizada
-    await manager.broadcast_users()
+    await manager.broadcast_users(campaign_id)
 
     # Retornar sucesso
     return {"success": True}
 
 @router.get("/users", tags=["Users & Characters"])
-async def get_users():
-    return await db.get_users()
+async def get_users(campaign_id: str = DEFAULT_CAMPAIGN):
+    # Return the response directly so FastAPI skips jsonable_encoder
+    return FastJSONResponse(await db.get_users(campaign_id))
 
 @router.get("/character/{user_id}", tags=["Users & Characters"])
 async def get_character(user_id: str):
@@ -86,24 +95,24 @@ async def get_character(user_id: str):
 
 @router.put("/character/{user_id}", tags=["Users & Characters"])
 async def update_character(user_id: str, character: dict):
-    existing_character = await db.get_character(user_id)
-    if not existing_character:
-        raise HTTPException(status_code=404, detail="Character not found")
-
-    # Use specific update functions from db for clarity/atomicity if available
-    # Otherwise, update selectively as before
-    if "attributes" in character:
-        await db.update_character_attributes(user_id, character["attributes"])
-    if "skills" in character:
-        await db.update_character_skills(user_id, character["skills"])
-    if "abilities" in character:
-        await db.update_character_abilities(user_id, character["abilities"])
-    if "inventory" in character:
-        await db.update_character_inventory(user_id, character["inventory"])
-    if "currency" in character:
-        await db.update_character_currency(user_id, character["currency"])
-
-    updated_character = await db.get_character(user_id)
+    # Verificação, escritas e releitura em uma única conexão e transação
+    async with db.unit_of_work():
+        existing_character = await db.get_character(user_id)
+        if not existing_character:
+            raise HTTPException(status_code=404, detail="Character not found")
+
+        if "attributes" in character:
+            await db.update_character_attributes(user_id, character["attributes"])
+        if "skills" in character:
+            await db.update_character_skills(user_id, character["skills"])
+        if "abilities" in character:
+            await db.update_character_abilities(user_id, character["abilities"])
+        if "inventory" in character:
+            await db.update_character_inventory(user_id, character["inventory"])
+        if "currency" in character:
+            await db.update_character_currency(user_id, character["currency"])
+
+        updated_character = await db.get_character(user_id)
     # Optional: Broadcast character update via websocket if needed
     return updated_character
 
@@ -114,7 +123,7 @@ async def update_health(user_id: str, health_points: int):
         raise HTTPException(status_code=404, detail="User not found")
 
     await db.update_user_health(user_id, health_points)
-    await manager.broadcast_users()  # Notify all clients about the change
+    await manager.broadcast_users(user["campaignId"])  # Notify the campaign about the change
     return {"success": True}
 
 @router.post("/character/{user_id}/items", tags=["Users & Characters"])
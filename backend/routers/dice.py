@@ -0,0 +1,17 @@
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from ..dice import DiceError
+from ..dice_odds import get_odds
+
+router = APIRouter()
+
+@router.get("/dice/odds", tags=["Dice"])
+async def get_dice_odds(expression: str, target: Optional[int] = None):
+    # Exact outcome distribution for the same notation the dice_roll command accepts;
+    # `target` (e.g. a DC) adds the chance of rolling at least that value
+    try:
+        odds = await get_odds(expression)
+    except DiceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return odds.as_dict(target)
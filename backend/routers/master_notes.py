@@ -1,8 +1,12 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from datetime import datetime
+from typing import Optional
+import hashlib
 import uuid
 
 # Import necessary components from app_setup
 from ..app_setup import db
+from ..serialization import FastJSONResponse, decode_cursor
 
 router = APIRouter()
 
@@ -29,6 +33,49 @@ async def get_master_notes(master_id: str):
 
     return await db.get_master_notes(master_id)
 
+@router.get("/master-notes/{master_id}/summaries", tags=["Master Notes"])
+async def list_master_notes(
+    master_id: str,
+    category: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+):
+    # Lightweight listing (id, title, category, timestamps) without the note
+    # bodies; `cursor` is the `nextCursor` of the previous page.
+    user = await db.get_user(master_id)
+    if not user or not user.get("isMaster"):
+        raise HTTPException(status_code=403, detail="Only masters can view notes")
+
+    parsed_cursor = None
+    if cursor:
+        try:
+            created_at, note_id = decode_cursor(cursor)
+            parsed_cursor = (datetime.fromisoformat(created_at), str(note_id))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return await db.list_master_notes(master_id, category, limit, parsed_cursor)
+
+def _note_etag(note):
+    # Every update bumps updated_at, so it identifies the note's current version
+    version = f"{note['id']}:{note['updatedAt'].isoformat()}"
+    return f'"{hashlib.sha1(version.encode()).hexdigest()}"'
+
+@router.get("/master-notes/{master_id}/notes/{note_id}", tags=["Master Notes"])
+async def get_master_note(master_id: str, note_id: str, if_none_match: Optional[str] = Header(None)):
+    # Full note body, fetched on demand; clients revalidate with If-None-Match
+    user = await db.get_user(master_id)
+    if not user or not user.get("isMaster"):
+        raise HTTPException(status_code=403, detail="Only masters can view notes")
+
+    note = await db.get_master_note(master_id, note_id)
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
+
+    headers = {"ETag": _note_etag(note), "Cache-Control": "private, no-cache"}
+    if if_none_match and {headers["ETag"], "*"} & {tag.strip() for tag in if_none_match.split(",")}:
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(note, headers=headers)
+
 @router.put("/master-notes/{note_id}", tags=["Master Notes"])
 async def update_master_note(note_id: str, note_data: dict):
     # Optional: Add validation to check if the requesting user is the master owner
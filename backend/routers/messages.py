@@ -0,0 +1,44 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+
+# Import necessary components from app_setup
+from ..app_setup import db
+from ..database import DEFAULT_CAMPAIGN
+from ..serialization import FastJSONResponse, decode_cursor
+
+router = APIRouter()
+
+@router.get("/messages", tags=["Messages"])
+async def get_messages(
+    campaign_id: str = DEFAULT_CAMPAIGN,
+    limit: int = Query(100, ge=1, le=500),
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+):
+    # Keyset pagination over messages.seq: no cursor returns the latest window,
+    # `before` loads older pages on scroll and `after` catches up on newer ones.
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both")
+    # Return the response directly so FastAPI skips jsonable_encoder
+    return FastJSONResponse(await db.get_messages(campaign_id, limit=limit, before=before, after=after))
+
+@router.get("/messages/search", tags=["Messages"])
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    campaign_id: str = DEFAULT_CAMPAIGN,
+    user_id: Optional[str] = None,
+    kind: Optional[str] = Query(None, regex="^(dice|text)$"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+):
+    # Full-text search ranked by relevance; `cursor` is the `nextCursor` of the
+    # previous page. `kind` keeps only dice rolls or only text messages.
+    parsed_cursor = None
+    if cursor:
+        try:
+            rank, seq = decode_cursor(cursor)
+            parsed_cursor = (float(rank), int(seq))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    is_dice_roll = None if kind is None else kind == "dice"
+    return FastJSONResponse(await db.search_messages(campaign_id, q, user_id, is_dice_roll, limit, parsed_cursor))
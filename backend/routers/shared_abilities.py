@@ -4,6 +4,7 @@ import uuid
 
 # Import necessary components from app_setup
 from ..app_setup import db, manager
+from ..database import DEFAULT_CAMPAIGN
 
 router = APIRouter()
 
@@ -18,28 +19,30 @@ async def create_shared_ability(master_id: str, ability_data: dict):
     await db.create_shared_ability(ability_id, master_id, ability_data)
 
     # Broadcast the update to all clients
-    await manager.broadcast_shared_abilities()
+    await manager.broadcast_shared_abilities(user["campaignId"])
 
     # Return the created ability data (consider returning the full item from db)
     ability_data["id"] = ability_id
     return ability_data
 
 @router.get("/shared-abilities", tags=["Shared Abilities"])
-async def get_shared_abilities(master_id: Optional[str] = None):
+async def get_shared_abilities(master_id: Optional[str] = None, campaign_id: str = DEFAULT_CAMPAIGN):
     # No specific authorization check here, abilities might be public
-    # Filter by master_id if provided
-    return await db.get_shared_abilities(master_id)
+    # Filter by master_id if provided, otherwise by campaign
+    return await db.get_shared_abilities(master_id, campaign_id)
 
 @router.put("/shared-abilities/{ability_id}", tags=["Shared Abilities"])
 async def update_shared_ability(ability_id: str, ability_data: dict):
     # Optional: Add validation to check if the requesting user is the master owner
-    await db.update_shared_ability(ability_id, ability_data)
-    await manager.broadcast_shared_abilities()
+    campaign_id = await db.update_shared_ability(ability_id, ability_data)
+    if campaign_id:
+        await manager.broadcast_shared_abilities(campaign_id)
     return {"success": True}
 
 @router.delete("/shared-abilities/{ability_id}", tags=["Shared Abilities"])
 async def delete_shared_ability(ability_id: str):
     # Optional: Add validation to check if the requesting user is the master owner
-    await db.delete_shared_ability(ability_id)
-    await manager.broadcast_shared_abilities()
+    campaign_id = await db.delete_shared_ability(ability_id)
+    if campaign_id:
+        await manager.broadcast_shared_abilities(campaign_id)
     return {"success": True} 
\ No newline at end of file
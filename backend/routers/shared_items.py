@@ -4,6 +4,7 @@ import uuid
 
 # Import necessary components from app_setup
 from ..app_setup import db, manager
+from ..database import DEFAULT_CAMPAIGN
 
 router = APIRouter()
 
@@ -18,28 +19,30 @@ async def create_shared_item(master_id: str, item_data: dict):
     await db.create_shared_item(item_id, master_id, item_data)
 
     # Broadcast the update to all clients
-    await manager.broadcast_shared_items()
+    await manager.broadcast_shared_items(user["campaignId"])
 
     # Return the created item data (consider returning the full item from db)
     item_data["id"] = item_id
     return item_data
 
 @router.get("/shared-items", tags=["Shared Items"])
-async def get_shared_items(master_id: Optional[str] = None):
+async def get_shared_items(master_id: Optional[str] = None, campaign_id: str = DEFAULT_CAMPAIGN):
     # No specific authorization check here, items might be public
-    # Filter by master_id if provided
-    return await db.get_shared_items(master_id)
+    # Filter by master_id if provided, otherwise by campaign
+    return await db.get_shared_items(master_id, campaign_id)
 
 @router.put("/shared-items/{item_id}", tags=["Shared Items"])
 async def update_shared_item(item_id: str, item_data: dict):
     # Optional: Add validation to check if the requesting user is the master owner
-    await db.update_shared_item(item_id, item_data)
-    await manager.broadcast_shared_items()
+    campaign_id = await db.update_shared_item(item_id, item_data)
+    if campaign_id:
+        await manager.broadcast_shared_items(campaign_id)
     return {"success": True}
 
 @router.delete("/shared-items/{item_id}", tags=["Shared Items"])
 async def delete_shared_item(item_id: str):
     # Optional: Add validation to check if the requesting user is the master owner
-    await db.delete_shared_item(item_id)
-    await manager.broadcast_shared_items()
+    campaign_id = await db.delete_shared_item(item_id)
+    if campaign_id:
+        await manager.broadcast_shared_items(campaign_id)
     return {"success": True} 
\ No newline at end of file
@@ -0,0 +1,138 @@
+import base64
+import gzip
+import json
+import os
+from datetime import date, datetime
+from typing import Any, Optional
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+# orjson serializa datetime nativamente e devolve bytes, sem passar por um
+# `default` em Python para cada campo; sem ele, cai no json da stdlib
+try:
+    import orjson
+except ImportError: # pragma: no cover - depende do ambiente
+    orjson = None
+
+# MessagePack é opcional: sem ele, o subprotocolo binário simplesmente não é oferecido
+try:
+    import msgpack
+except ImportError: # pragma: no cover - depende do ambiente
+    msgpack = None
+
+# Frames e respostas REST menores que isso não compensam ser comprimidos
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+def _default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+if orjson is not None:
+    ENCODER = "orjson"
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+else:
+    ENCODER = "json"
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+    loads = json.loads
+
+def dumps_text(obj: Any) -> str:
+    """Como `dumps`, mas como str (frames de texto do WebSocket, NOTIFY, codecs do asyncpg)."""
+    return dumps(obj).decode()
+
+def encode_cursor(*values) -> str:
+    """Cursor de paginação opaco: os valores em JSON, em base64 url-safe sem
+    padding, para ir numa query string sem precisar de escape."""
+    return base64.urlsafe_b64encode(dumps(list(values))).rstrip(b"=").decode()
+
+def decode_cursor(cursor: str) -> list:
+    """Valores de um cursor gerado por `encode_cursor`; ValueError se for inválido."""
+    try:
+        values = loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+# Resposta padrão da API. O FastAPI ainda passa o retorno das rotas pelo
+# jsonable_encoder antes de renderizar; rotas quentes devolvem a resposta
+# pronta (FastJSONResponse(dados)) para pular essa etapa.
+if orjson is not None:
+    FastJSONResponse = ORJSONResponse
+else:
+    class FastJSONResponse(JSONResponse):
+        """Sem orjson: renderizada pelo mesmo encoder dos frames do WebSocket."""
+
+        def render(self, content: Any) -> bytes:
+            return dumps(content)
+
+# --- Formatos de frame do WebSocket ---
+# Cada protocolo sabe codificar um payload completo (`encode`) e montar um
+# frame {"type": ..., "data": [...]} a partir de entradas já codificadas com
+# `dumps` (`encode_list`), para que entradas repetidas entre destinatários
+# sejam serializadas uma única vez.
+
+class JSONProtocol:
+    """Frames de texto em JSON (padrão, usado quando o cliente não negocia subprotocolo)."""
+    name = "json"
+
+    dumps = staticmethod(dumps)
+    encode = staticmethod(dumps_text)
+    loads = staticmethod(loads)
+
+    @staticmethod
+    def encode_list(frame_type: str, entries) -> str:
+        return (b'{"type":"' + frame_type.encode() + b'","data":[' + b','.join(entries) + b']}').decode()
+
+class MessagePackProtocol:
+    """Frames binários em MessagePack; datas seguem como string ISO 8601, como no JSON."""
+    name = "msgpack"
+
+    @staticmethod
+    def dumps(obj: Any) -> bytes:
+        return msgpack.packb(obj, default=_default)
+
+    encode = dumps
+
+    @staticmethod
+    def loads(data: bytes):
+        return msgpack.unpackb(data)
+
+    @staticmethod
+    def encode_list(frame_type: str, entries) -> bytes:
+        entries = list(entries)
+        packer = msgpack.Packer()
+        return (
+            packer.pack_map_header(2) + packer.pack("type") + packer.pack(frame_type)
+            + packer.pack("data") + packer.pack_array_header(len(entries)) + b''.join(entries)
+        )
+
+# Subprotocolos aceitos no handshake (Sec-WebSocket-Protocol), pelo nome
+PROTOCOLS = {JSONProtocol.name: JSONProtocol}
+if msgpack is not None:
+    PROTOCOLS[MessagePackProtocol.name] = MessagePackProtocol
+DEFAULT_PROTOCOL = JSONProtocol
+
+def negotiate_protocol(requested) -> Optional[str]:
+    """Primeiro subprotocolo pedido pelo cliente que o servidor suporta, ou None (JSON sem subprotocolo)."""
+    return next((name for name in requested if name in PROTOCOLS), None)
+
+def gzip_frame(data):
+    """Comprime um frame já codificado se ele passar de COMPRESSION_MIN_SIZE.
+
+    Frames comprimidos são sempre binários e começam com o magic do gzip
+    (1f 8b), que não colide com o início de um frame JSON ou MessagePack;
+    frames pequenos são devolvidos como estão.
+    """
+    raw = data.encode() if isinstance(data, str) else data
+    if len(raw) < COMPRESSION_MIN_SIZE:
+        return data
+    return gzip.compress(raw, compresslevel=6, mtime=0)
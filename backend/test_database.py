@@ -0,0 +1,61 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+from backend.database import USERS_QUERY, Database
+
+CREATED = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+
+def user_row(user_id, **fields):
+    row = {
+        "id": user_id, "nickname": user_id, "is_master": False, "character_id": "001",
+        "health_points": 10, "max_health_points": 10, "created_at": CREATED,
+        "campaign_id": "default", "master_code": None,
+    }
+    row.update(fields)
+    return row
+
+
+class FakeConnection:
+    """Responde às consultas de get_users com linhas fixas."""
+
+    def __init__(self, users, dice):
+        self.users = users
+        self.dice = dice
+        self.queries = []
+
+    async def fetch(self, query, *args):
+        self.queries.append(query)
+        if query.startswith(USERS_QUERY):
+            return [dict(user, dice_results=self.dice.get(user["id"], [])) for user in self.users if user["id"] in args[0]]
+        if "FROM users" in query:
+            return list(self.users)
+        return [] # NPCs
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+def test_get_users_loads_dice_for_users_missing_from_the_directory():
+    users = [user_row("known"), user_row("remote")]
+    conn = FakeConnection(users, {"remote": [20, 4]})
+    db = Database()
+    db.pool = FakePool(conn)
+    db.users.put(dict(Database._format_user(dict(users[0], dice_results=[7]))))
+
+    result = asyncio.run(db.get_users("default"))
+
+    dice = {user["id"]: user["diceResults"] for user in result}
+    assert dice == {"known": [7], "remote": [20, 4]}
+    # O buffer do usuário que faltava foi semeado: a próxima leitura não vai ao banco
+    assert db.users.recent_dice("remote") == [20, 4]
+    conn.queries.clear()
+    asyncio.run(db.get_users("default"))
+    assert not any(query.startswith(USERS_QUERY) for query in conn.queries)
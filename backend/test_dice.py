@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from backend import dice
+from backend.dice import DiceError, compile_expression, roll, roll_many
+
+
+@pytest.mark.parametrize("expression", [
+    "", "d", "2d", "abc", "2d6+", "2d6**3", "0d6", "2d0",
+    f"{dice.MAX_DICE + 1}d6", f"1d{dice.MAX_SIDES + 1}", "1d1!", "2d6kh3", "3d6dl4",
+    "+".join(["1"] * (dice.MAX_TERMS + 1)),
+    f"1d20+{dice.MAX_TOTAL}", f"1d20-{dice.MAX_TOTAL}-20", "1d20+3000000000", "1" * 5000,
+])
+def test_invalid_expressions_are_rejected(expression):
+    with pytest.raises(DiceError):
+        compile_expression(expression)
+
+
+def test_totals_up_to_the_integer_limits_compile():
+    assert compile_expression(f"1d20+{dice.MAX_TOTAL - 20}").notation == f"1d20+{dice.MAX_TOTAL - 20}"
+    compile_expression(f"1d20-{-dice.MIN_TOTAL - 1}")
+
+
+@pytest.mark.parametrize("expression, notation", [
+    ("4d6kh3", "4d6kh3"),
+    ("2D20KL1 + 5", "2d20kl1+5"),
+    ("d%", "1d100"),
+    ("4d6dl1", "4d6kh3"),
+    ("8d6!", "8d6!"),
+    ("1d8-2", "1d8-2"),
+])
+def test_notation_is_normalized(expression, notation):
+    assert compile_expression(expression).notation == notation
+
+
+@pytest.mark.parametrize("expression, low, high", [
+    ("1d20", 1, 20),
+    ("2d6+3", 5, 15),
+    ("4d6kh3", 3, 18),
+    ("2d20kl1-1", 0, 19),
+    ("3d4-1d4", -1, 11),
+])
+def test_roll_stays_within_bounds(expression, low, high):
+    rng = random.Random(1234)
+    for _ in range(500):
+        result = roll(expression, rng)
+        assert low <= result.total <= high
+
+
+def test_keep_marks_the_highest_dice():
+    result = roll("4d6kh3", random.Random(7))
+    term = result.terms[0]
+    assert sum(term.kept) == 3
+    assert term.value == sum(sorted(term.rolls, reverse=True)[:3])
+    assert result.as_dict()["total"] == result.total
+
+
+def test_exploding_dice_are_capped():
+    class AlwaysMax:
+        def randint(self, low, high):
+            return high
+
+    result = roll("1d6!", AlwaysMax())
+    assert result.total == 6 * (dice.MAX_EXPLOSIONS + 1)
+
+
+@pytest.mark.parametrize("expression, low, high", [
+    ("1d20+2", 3, 22),
+    ("4d6kh3", 3, 18),
+    ("2d20kl1", 1, 20),
+    ("3d6!", 3, 6 * 3 * (dice.MAX_EXPLOSIONS + 1)),
+])
+def test_roll_many_stays_within_bounds(expression, low, high):
+    results = roll_many(expression, 200)
+    assert len(results) == 200
+    for result in results:
+        assert low <= result.total <= high
+        assert result.total == sum(term.term.sign * term.value for term in result.terms)
+
+
+@pytest.mark.parametrize("count", [0, dice.MAX_BATCH_ROLLS + 1])
+def test_roll_many_rejects_batch_size(count):
+    with pytest.raises(DiceError):
+        roll_many("1d20", count)
@@ -0,0 +1,102 @@
+import asyncio
+import itertools
+from collections import Counter
+from fractions import Fraction
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from backend import dice_odds
+from backend.dice import DiceError, DiceTerm, compile_expression
+from backend.dice_odds import build_odds, compute_distribution, get_odds
+
+
+def brute_force(expression):
+    """Distribuição exata enumerando todas as combinações de dados."""
+    compiled = compile_expression(expression)
+    counts = Counter()
+    faces = []
+    for term in compiled.terms:
+        if isinstance(term, DiceTerm):
+            faces.append([tuple(r) for r in itertools.product(range(1, term.sides + 1), repeat=term.count)])
+        else:
+            faces.append([None])
+    for outcome in itertools.product(*faces):
+        total = 0
+        for term, rolls in zip(compiled.terms, outcome):
+            if rolls is None:
+                value = term.value
+            elif term.keep:
+                direction, amount = term.keep
+                value = sum(sorted(rolls, reverse=(direction == "h"))[:amount])
+            else:
+                value = sum(rolls)
+            total += term.sign * value
+        counts[total] += 1
+    size = sum(counts.values())
+    return {value: Fraction(count, size) for value, count in counts.items()}
+
+
+@pytest.mark.parametrize("expression", ["1d20", "2d6+3", "4d6kh3", "2d20kl1", "3d6dl1", "1d8-1d4", "3d4kl2+1d6-2"])
+def test_distribution_matches_brute_force(expression):
+    values, probabilities = compute_distribution(expression)
+    expected = brute_force(expression)
+    assert set(int(v) for v in values if probabilities[v - values[0]] > 0) == set(expected)
+    for value, probability in zip(values, probabilities):
+        assert probability == pytest.approx(float(expected.get(int(value), 0)), abs=1e-12)
+
+
+def test_exploding_die():
+    values, probabilities = compute_distribution("1d6!")
+    distribution = dict(zip(values.tolist(), probabilities.tolist()))
+    assert distribution[5] == pytest.approx(1 / 6)
+    assert distribution.get(6, 0) == 0
+    assert distribution[7] == pytest.approx(1 / 36)
+    assert probabilities.sum() == pytest.approx(1)
+
+
+def test_fft_convolution_matches_direct(monkeypatch):
+    direct = dict(zip(*(array.tolist() for array in compute_distribution("30d20"))))
+    monkeypatch.setattr(dice_odds, "FFT_MIN_SIZE", 0)
+    # A FFT pode zerar as pontas de probabilidade ínfima, então compara por valor
+    fft = dict(zip(*(array.tolist() for array in compute_distribution("30d20"))))
+    for value in direct.keys() | fft.keys():
+        assert fft.get(value, 0) == pytest.approx(direct.get(value, 0), abs=1e-12)
+
+
+def test_summary_and_at_least():
+    odds = build_odds("2d6")
+    summary = odds.as_dict()
+    assert (summary["min"], summary["max"]) == (2, 12)
+    assert summary["mean"] == pytest.approx(7)
+    assert summary["percentiles"]["50"] == 7
+    assert odds.at_least(2) == 1.0
+    assert odds.at_least(12) == pytest.approx(1 / 36)
+    assert odds.at_least(13) == 0.0
+    assert odds.as_dict(10)["atLeast"] == pytest.approx(6 / 36)
+
+
+def test_too_complex_expression_is_rejected():
+    with pytest.raises(DiceError):
+        compute_distribution("100d1000kh50")
+
+
+def test_concurrent_misses_compute_once(monkeypatch):
+    calls = []
+
+    def counting_build(expression):
+        calls.append(expression.notation)
+        return build_odds(expression)
+
+    monkeypatch.setattr(dice_odds, "build_odds", counting_build)
+    monkeypatch.setattr(dice_odds, "_cache", type(dice_odds._cache)())
+
+    async def scenario():
+        results = await asyncio.gather(*[get_odds("3d8+2") for _ in range(5)])
+        assert all(result is results[0] for result in results)
+        assert await get_odds("3d8 + 2") is results[0]
+
+    asyncio.run(scenario())
+    assert calls == ["3d8+2"]
+    assert not dice_odds._pending
@@ -0,0 +1,112 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from backend.event_bus import EVENT_CHANNEL, EventBus
+
+# Os testes de integração usam um Postgres local, se houver: TEST_DATABASE_URL=postgresql://...
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+        self.received = asyncio.Event()
+
+    async def __call__(self, event, payload, local):
+        self.events.append((event, payload, local))
+        self.received.set()
+
+
+class FakeConnection:
+    def __init__(self):
+        self.termination_listeners = []
+        self.listeners = {}
+        self.terminated = False
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    async def remove_listener(self, channel, callback):
+        self.listeners.pop(channel, None)
+
+    def is_closed(self):
+        return self.terminated
+
+    def terminate(self):
+        self.terminated = True
+
+
+class FakePool:
+    def __init__(self):
+        self.acquired = []
+        self.released = []
+
+    async def acquire(self):
+        conn = FakeConnection()
+        self.acquired.append(conn)
+        return conn
+
+    async def release(self, conn):
+        self.released.append(conn)
+
+
+def test_publish_without_listener_goes_straight_to_handler():
+    async def scenario():
+        handler = Recorder()
+        bus = EventBus(SimpleNamespace(pool=None), handler)
+        assert not bus.running
+        await bus.publish("users", {"campaignId": "default"})
+        assert handler.events == [("users", {"campaignId": "default"}, True)]
+
+    asyncio.run(scenario())
+
+
+def test_lost_connection_is_released_and_listen_restarts():
+    async def scenario():
+        pool = FakePool()
+        bus = EventBus(SimpleNamespace(pool=pool), Recorder())
+        await bus.start()
+        lost = pool.acquired[0]
+
+        lost.terminated = True
+        for callback in lost.termination_listeners:
+            callback(lost)
+        assert not bus.running
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+        assert pool.released == [lost]
+        assert bus.running and len(pool.acquired) == 2
+        assert EVENT_CHANNEL in pool.acquired[1].listeners
+        await bus.stop()
+        assert pool.released == [lost, pool.acquired[1]]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+def test_events_round_trip_through_postgres():
+    asyncpg = pytest.importorskip("asyncpg")
+
+    async def scenario():
+        pool = await asyncpg.create_pool(TEST_DATABASE_URL, min_size=2, max_size=4)
+        try:
+            handler = Recorder()
+            bus = EventBus(SimpleNamespace(pool=pool), handler)
+            await bus.start()
+            try:
+                await bus.publish("shared_items", {"campaignId": "default"})
+                await asyncio.wait_for(handler.received.wait(), timeout=5)
+            finally:
+                await bus.stop()
+            assert handler.events == [("shared_items", {"campaignId": "default"}, True)]
+        finally:
+            await pool.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,60 @@
+import asyncio
+import gzip
+from datetime import datetime, timezone
+
+from backend import message_archive
+from backend.message_archive import add_months, archived_messages, partition_name, read_archive
+from backend.serialization import dumps
+
+
+def write_archive(path, rows):
+    with gzip.open(path, "wb") as handle:
+        for row in rows:
+            handle.write(dumps(row) + b"\n")
+    return str(path)
+
+
+def make_rows(seqs, campaign_id="default"):
+    return [{"id": f"m{seq}", "seq": seq, "campaign_id": campaign_id, "content": f"linha {seq}"} for seq in seqs]
+
+
+def test_partition_helpers():
+    month = datetime(2024, 12, 1, tzinfo=timezone.utc)
+    assert add_months(month, 1) == datetime(2025, 1, 1, tzinfo=timezone.utc)
+    assert add_months(month, -12) == datetime(2023, 12, 1, tzinfo=timezone.utc)
+    assert partition_name(month) == "messages_p202412"
+
+
+def test_read_archive_filters_campaign_and_cursor(tmp_path):
+    path = write_archive(tmp_path / "a.ndjson.gz", make_rows(range(1, 11)) + make_rows(range(11, 15), "other"))
+    assert [row["seq"] for row in read_archive(path, "default", before=5)] == [1, 2, 3, 4]
+    assert [row["seq"] for row in read_archive(path, "default", after=8)] == [9, 10]
+    assert [row["seq"] for row in read_archive(path, "other")] == [11, 12, 13, 14]
+
+
+def test_read_archive_decodes_each_file_once(tmp_path, monkeypatch):
+    path = write_archive(tmp_path / "a.ndjson.gz", make_rows(range(1, 6)))
+    message_archive._archive_cache.clear()
+    opened = []
+    original_open = gzip.open
+    monkeypatch.setattr(message_archive.gzip, "open", lambda *args: opened.append(args) or original_open(*args))
+
+    read_archive(path, "default", before=4)
+    read_archive(path, "default", before=2)
+    assert len(opened) == 1
+
+
+def test_archived_messages_reads_newest_files_first(tmp_path):
+    old = write_archive(tmp_path / "old.ndjson.gz", make_rows(range(1, 6)))
+    new = write_archive(tmp_path / "new.ndjson.gz", make_rows(range(6, 11)))
+    archives = [
+        {"path": old, "min_seq": 1, "max_seq": 5},
+        {"path": new, "min_seq": 6, "max_seq": 10},
+    ]
+
+    page = asyncio.run(archived_messages(archives, "default", 3, before=9))
+    assert [row["seq"] for row in page] == [6, 7, 8]
+    page = asyncio.run(archived_messages(archives, "default", 4, before=7))
+    assert [row["seq"] for row in page] == [3, 4, 5, 6]
+    page = asyncio.run(archived_messages(archives, "default", 3, after=4))
+    assert [row["seq"] for row in page] == [5, 6, 7]
@@ -0,0 +1,75 @@
+import gzip
+from datetime import datetime, timezone
+
+import pytest
+
+from backend import serialization
+from backend.serialization import (
+    COMPRESSION_MIN_SIZE, JSONProtocol, MessagePackProtocol, decode_cursor, dumps, dumps_text,
+    encode_cursor, gzip_frame, loads, negotiate_protocol,
+)
+
+MOMENT = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+
+
+def test_dumps_serializes_datetimes_as_iso_8601():
+    assert loads(dumps({"timestamp": MOMENT})) == {"timestamp": MOMENT.isoformat()}
+    assert isinstance(dumps_text({"a": 1}), str)
+
+
+def test_dumps_rejects_unknown_types():
+    with pytest.raises(TypeError):
+        dumps({"value": object()})
+
+
+@pytest.mark.parametrize("protocol", [
+    JSONProtocol,
+    pytest.param(MessagePackProtocol, marks=pytest.mark.skipif(serialization.msgpack is None, reason="msgpack not installed")),
+])
+def test_protocol_round_trip(protocol):
+    payload = {"type": "message_created", "data": {"id": "m1", "seq": 7, "isDiceRoll": True, "timestamp": MOMENT}}
+    decoded = protocol.loads(protocol.encode(payload))
+    assert decoded == {"type": "message_created", "data": dict(payload["data"], timestamp=MOMENT.isoformat())}
+
+
+@pytest.mark.parametrize("protocol", [
+    JSONProtocol,
+    pytest.param(MessagePackProtocol, marks=pytest.mark.skipif(serialization.msgpack is None, reason="msgpack not installed")),
+])
+def test_encode_list_matches_encode(protocol):
+    entries = [{"id": "u1", "nickname": "Ana"}, {"id": "u2", "nickname": "Bia"}]
+    frame = protocol.encode_list("users", [protocol.dumps(entry) for entry in entries])
+    assert protocol.loads(frame) == protocol.loads(protocol.encode({"type": "users", "data": entries}))
+
+
+def test_negotiate_protocol_picks_first_supported():
+    assert negotiate_protocol(["soap", "json"]) == "json"
+    assert negotiate_protocol(["soap"]) is None
+    assert negotiate_protocol([]) is None
+
+
+def test_gzip_frame_leaves_small_frames_alone():
+    small = "x" * (COMPRESSION_MIN_SIZE - 1)
+    assert gzip_frame(small) is small
+
+
+def test_gzip_frame_compresses_large_frames():
+    text = dumps_text({"type": "messages", "data": ["linha"] * COMPRESSION_MIN_SIZE})
+    compressed = gzip_frame(text)
+    assert isinstance(compressed, bytes)
+    assert compressed[:2] == b"\x1f\x8b"
+    assert gzip.decompress(compressed).decode() == text
+    # mtime=0: o mesmo frame sempre gera os mesmos bytes
+    assert gzip_frame(text) == compressed
+
+
+def test_cursor_round_trip_is_url_safe():
+    cursor = encode_cursor(MOMENT, "note-1|x")
+    assert cursor.replace("-", "").replace("_", "").isalnum()
+    assert decode_cursor(cursor) == [MOMENT.isoformat(), "note-1|x"]
+
+
+@pytest.mark.parametrize("cursor", ["", "%%%", "bm90IGpzb24", encode_cursor.__name__])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
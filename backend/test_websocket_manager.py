@@ -0,0 +1,174 @@
+import asyncio
+from types import SimpleNamespace
+
+from backend import websocket_manager
+from backend.serialization import JSONProtocol
+from backend.websocket_manager import ClientConnection, ConnectionManager, Frame, ListFrame
+
+
+class FailingWebSocket:
+    """WebSocket falso cujo envio sempre falha."""
+
+    def __init__(self):
+        self.closed = False
+        self.sends = 0
+
+    async def send_text(self, data):
+        self.sends += 1
+        raise ConnectionResetError("broken pipe")
+
+    async def send_bytes(self, data):
+        self.sends += 1
+        raise ConnectionResetError("broken pipe")
+
+    async def close(self, code=1000):
+        await asyncio.sleep(0) # Um close de verdade espera pela rede
+        self.closed = True
+
+
+def make_manager():
+    # Sem __init__: o gerenciador real importa o banco de app_setup
+    manager = ConnectionManager.__new__(ConnectionManager)
+    manager.active_connections = {}
+    manager.rooms = {}
+    manager._closing = set()
+    return manager
+
+
+def test_writer_evicts_and_closes_after_send_failures():
+    async def scenario():
+        manager = make_manager()
+        websocket = FailingWebSocket()
+        connection = ClientConnection(websocket, "user-1", "default", manager)
+        manager.active_connections["user-1"] = connection
+        manager.rooms["default"] = {"user-1": connection}
+
+        for i in range(websocket_manager.MAX_SEND_FAILURES):
+            assert connection.enqueue(Frame({"type": "message_created", "data": i}))
+        await asyncio.wait_for(connection._writer, timeout=1)
+        await asyncio.wait_for(asyncio.gather(*manager._closing), timeout=1)
+
+        assert websocket.sends == websocket_manager.MAX_SEND_FAILURES
+        assert websocket.closed
+        assert not connection._writer.cancelled()
+        assert "user-1" not in manager.active_connections
+        assert "default" not in manager.rooms
+
+    asyncio.run(scenario())
+
+
+class StuckWebSocket(FailingWebSocket):
+    """Cliente travado: os envios nunca terminam e o close demora."""
+
+    async def send_text(self, data):
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000):
+        await asyncio.sleep(0.5)
+        self.closed = True
+
+
+class RecordingWebSocket(FailingWebSocket):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+
+def test_overflowing_client_does_not_hold_up_the_broadcast(monkeypatch):
+    monkeypatch.setattr(websocket_manager, "MAX_QUEUED_FRAMES", 2)
+
+    async def scenario():
+        manager = make_manager()
+        stuck = ClientConnection(StuckWebSocket(), "user-1", "default", manager)
+        healthy_socket = RecordingWebSocket()
+        healthy = ClientConnection(healthy_socket, "user-2", "default", manager)
+        for connection in (stuck, healthy):
+            manager.active_connections[connection.user_id] = connection
+            manager.rooms.setdefault("default", {})[connection.user_id] = connection
+
+        # A fila do cliente travado já está cheia: o próximo broadcast o despeja
+        for i in range(websocket_manager.MAX_QUEUED_FRAMES):
+            assert stuck.enqueue(Frame({"type": "message_created", "data": i}))
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await manager.broadcast({"type": "message_created", "data": "novo"}, "default")
+        assert loop.time() - started < 0.1
+        assert "user-1" not in manager.active_connections
+        assert not stuck.websocket.closed # O close ainda corre em segundo plano
+
+        await asyncio.sleep(0.05)
+        assert healthy_socket.sent == ['{"type":"message_created","data":"novo"}']
+        await asyncio.wait_for(asyncio.gather(*manager._closing), timeout=1)
+        assert stuck.websocket.closed
+        manager._remove(healthy)
+
+    asyncio.run(scenario())
+
+
+def test_remove_from_outside_cancels_writer():
+    async def scenario():
+        manager = make_manager()
+        connection = ClientConnection(FailingWebSocket(), "user-1", "default", manager)
+        manager.active_connections["user-1"] = connection
+        manager.rooms["default"] = {"user-1": connection}
+
+        manager._remove(connection)
+        await asyncio.sleep(0)
+        assert connection._writer.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_shared_frame_is_compressed_once():
+    entries = [{"id": f"user-{i}", "nickname": "x" * 40} for i in range(100)]
+    frame = ListFrame("users", entries, {})
+
+    compressed = frame.encode(JSONProtocol, compress=True)
+    assert isinstance(compressed, bytes) and compressed[:2] == b"\x1f\x8b"
+    assert frame.encode(JSONProtocol, compress=True) is compressed
+    assert isinstance(frame.encode(JSONProtocol), str)
+
+
+def test_players_share_one_users_view():
+    raw = [
+        {"id": "m", "isMaster": True, "characterId": None},
+        {"id": "p1", "isMaster": False, "characterId": "001"},
+        {"id": "p2", "isMaster": False, "characterId": "002"},
+    ]
+    assert ConnectionManager.users_for(raw, "m") is raw
+    player_view = ConnectionManager.users_for(raw, "p1")
+    assert all("characterId" not in user for user in player_view)
+    assert ConnectionManager.users_for(raw, "p2") == player_view
+
+
+def test_users_broadcast_matches_the_snapshot_view():
+    raw = [
+        {"id": "m", "isMaster": True, "characterId": None},
+        {"id": "p1", "isMaster": False, "characterId": "001"},
+        {"id": "npc-1", "isMaster": False, "isNpc": True, "nickname": "Goblin"},
+    ]
+
+    async def get_users(campaign_id):
+        return raw
+
+    async def scenario():
+        manager = make_manager()
+        manager.db = SimpleNamespace(get_users=get_users)
+        manager.rooms["default"] = {"m": None, "p1": None, "p2": None}
+        sent = {}
+
+        async def capture(message, user_id, frame_type=None):
+            sent[user_id] = message
+
+        manager.send_personal_message = capture
+        await manager._send_users("default")
+
+        for user_id in ("m", "p1", "p2"):
+            assert sent[user_id].entries == ConnectionManager.users_for(raw, user_id)
+        assert sent["p1"] is sent["p2"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,86 @@
+from collections import deque
+from typing import Dict, Optional
+
+# Quantidade de resultados de dados exibidos por usuário no roster
+RECENT_DICE_RESULTS = 3
+
+class UserDirectory:
+    """Cópia em memória dos usuários (papel, apelido, vida, últimos dados).
+
+    É carregada quando o banco conecta e atualizada pelos métodos de escrita
+    do Database, para que o loop do WebSocket e o login não precisem ler o
+    banco a cada frame. As entradas têm o mesmo formato de Database.get_user.
+
+    Os últimos resultados de dados de cada usuário ficam em um buffer circular
+    de tamanho fixo alimentado pelas rolagens, para que o roster nunca precise
+    ler o histórico de dice_results.
+    """
+
+    def __init__(self):
+        self._users: Dict[str, dict] = {}
+        self._dice: Dict[str, deque] = {}
+
+    def _store(self, user_data: dict):
+        user = dict(user_data)
+        self._dice[user['id']] = deque(user.pop('diceResults', ()), maxlen=RECENT_DICE_RESULTS)
+        self._users[user['id']] = user
+
+    def load(self, users):
+        """Substitui todo o conteúdo do diretório."""
+        self._users = {}
+        self._dice = {}
+        for user in users:
+            self._store(user)
+
+    def load_campaign(self, campaign_id: str, users):
+        """Substitui as entradas de uma campanha, removendo usuários que não existem mais."""
+        for user_id in [u for u, user in self._users.items() if user.get('campaignId') == campaign_id]:
+            self.remove(user_id)
+        for user in users:
+            self._store(user)
+
+    def forget_campaign(self, campaign_id: str):
+        """Descarta as entradas de uma campanha; elas são relidas do banco no próximo acesso."""
+        self.load_campaign(campaign_id, ())
+
+    def put(self, user_data: dict):
+        self._store(user_data)
+
+    def get(self, user_id: str) -> Optional[dict]:
+        """Retorna uma cópia da entrada, para que o chamador possa alterá-la livremente."""
+        user = self._users.get(user_id)
+        if not user:
+            return None
+        user_copy = user.copy()
+        user_copy['diceResults'] = self.recent_dice(user_id)
+        return user_copy
+
+    def update(self, user_id: str, **fields):
+        user = self._users.get(user_id)
+        if user:
+            user.update(fields)
+
+    def remove(self, user_id: str):
+        self._users.pop(user_id, None)
+        self._dice.pop(user_id, None)
+
+    def add_dice_result(self, user_id: str, result: int):
+        """Registra uma rolagem no buffer do usuário (o mais recente primeiro)."""
+        buffer = self._dice.get(user_id)
+        if buffer is None:
+            buffer = self._dice[user_id] = deque(maxlen=RECENT_DICE_RESULTS)
+        buffer.appendleft(result)
+
+    def recent_dice(self, user_id: str):
+        """Últimos RECENT_DICE_RESULTS resultados do usuário, do mais recente ao mais antigo."""
+        return list(self._dice.get(user_id, ()))
+
+    def find_master(self, campaign_id: str) -> Optional[dict]:
+        master = next(
+            (u for u in self._users.values() if u.get('isMaster') and u.get('campaignId') == campaign_id),
+            None
+        )
+        return self.get(master['id']) if master else None
+
+    def __contains__(self, user_id):
+        return user_id in self._users
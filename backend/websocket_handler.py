@@ -1,75 +1,126 @@
 from fastapi import WebSocket, WebSocketDisconnect
-import json
+import asyncio
+import os
 import uuid
-import random
 import logging
 
 # Import necessary components from app_setup
-from .app_setup import db, manager, datetime_serializer
+from . import dice, dice_odds
+from .app_setup import db, manager
+from .serialization import loads
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of history messages in the join snapshot; clients may ask
+# for fewer with ?history=N on the WebSocket URL
+SNAPSHOT_HISTORY_LIMIT = int(os.getenv("SNAPSHOT_HISTORY_LIMIT", "100"))
+
+async def _nothing():
+    return None
+
+async def send_snapshot(websocket: WebSocket, user: dict):
+    """Sends the whole join state as a single frame. Each part is fetched
+    concurrently on its own pool connection."""
+    user_id = user["id"]
+    campaign_id = user["campaignId"]
+
+    history_limit = SNAPSHOT_HISTORY_LIMIT
+    requested = websocket.query_params.get("history")
+    if requested is not None and requested.isdigit():
+        history_limit = min(int(requested), SNAPSHOT_HISTORY_LIMIT)
+
+    users, messages, character, shared_items, shared_abilities, npcs = await asyncio.gather(
+        db.get_users(campaign_id),
+        db.get_messages(campaign_id, limit=history_limit),
+        db.get_character(user_id),
+        db.get_shared_items(campaign_id=campaign_id),
+        db.get_shared_abilities(campaign_id=campaign_id),
+        db.get_npcs(user_id) if user.get("isMaster") else _nothing(),
+    )
+
+    snapshot = {
+        "users": manager.users_for(users, user_id),
+        "messages": messages,
+        "character": character,
+        "sharedItems": shared_items,
+        "sharedAbilities": shared_abilities,
+    }
+    if npcs is not None:
+        snapshot["npcs"] = npcs
+    await manager.send_personal_message({"type": "snapshot", "data": snapshot}, user_id, "snapshot")
+
+async def _campaign_member(target_id, campaign_id: str):
+    """Returns the target user only if they play in the given campaign: master
+    actions never reach characters of another table."""
+    target = await db.get_user(target_id)
+    if target and target.get("campaignId") == campaign_id:
+        return target
+    return None
+
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(websocket, user_id)
+    # Load the user first (refreshes the user directory entry): the campaign
+    # they belong to decides which room the connection joins
+    user = await db.fetch_user(user_id)
+    if not user:
+        # If user doesn't exist (e.g., invalid ID), close connection
+        await websocket.accept()
+        await websocket.close(code=1000)
+        return
+
+    campaign_id = user["campaignId"]
+    connection = await manager.connect(websocket, user_id, campaign_id)
+    protocol = connection.protocol
 
     try:
-        # Send initial data to the client
-        user = await db.get_user(user_id)
-        if not user:
-            # If user doesn't exist (e.g., invalid ID), close connection
-            await websocket.close(code=1000)
-            await manager.disconnect(user_id) # Ensure manager knows
-            return
-
         # Send initial state
-        users = await db.get_users()
-        await websocket.send_text(json.dumps({"type": "users", "data": users}, default=datetime_serializer))
-
-        messages = await db.get_messages()
-        await websocket.send_text(json.dumps({"type": "messages", "data": messages}, default=datetime_serializer))
-
-        character = await db.get_character(user_id)
-        if character:
-            await websocket.send_text(json.dumps({"type": "character", "data": character}, default=datetime_serializer))
-
-        shared_items = await db.get_shared_items()
-        await websocket.send_text(json.dumps({"type": "shared_items", "data": shared_items}, default=datetime_serializer))
-
-        shared_abilities = await db.get_shared_abilities()
-        await websocket.send_text(json.dumps({"type": "shared_abilities", "data": shared_abilities}, default=datetime_serializer))
-
-        if user.get("isMaster"):
-            npcs = await db.get_npcs(user_id)
-            await websocket.send_text(json.dumps({"type": "npcs", "data": npcs}, default=datetime_serializer))
+        await send_snapshot(websocket, user)
 
         # Process messages from the client
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data) # Use json.loads as per previous changes
+            # Frames de texto são sempre JSON; binários seguem o subprotocolo negociado
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            if frame.get("text") is not None:
+                message_data = loads(frame["text"])
+            else:
+                message_data = protocol.loads(frame["bytes"])
 
             # --- Message Handling Logic --- START ---
             message_type = message_data.get("type")
-            current_user = await db.get_user(user_id) # Re-fetch user in case of role change?
+            current_user = await db.get_user(user_id) # Served from the in-memory user directory
             if not current_user:
                 break # Should not happen if initial check passed, but safety first
 
             if message_type == "message":
                 message_id = str(uuid.uuid4())
                 content = message_data.get("content", "")
-                await db.create_message(message_id, user_id, current_user["nickname"], content)
-                await manager.broadcast_messages()
+                message = await db.create_message(message_id, user_id, current_user["nickname"], content)
+                await manager.broadcast_message_created(message)
 
             elif message_type == "dice_roll":
                 dice_type = message_data.get("diceType", "d20")
                 character_id = message_data.get("characterId") # ID of character rolling (could be user or NPC)
                 custom_value = message_data.get("customValue")
 
-                max_value_map = {"d4": 4, "d6": 6, "d8": 8, "d10": 10, "d12": 12, "d20": 20}
-                max_value = max_value_map.get(dice_type, 20) # Default d20
-                if dice_type == "custom" and isinstance(custom_value, int) and custom_value > 0:
-                    max_value = custom_value
+                # Expressão completa (ex.: "4d6kh3", "2d20kl1+5", "8d6!") ou, como antes, um único dado
+                expression = message_data.get("expression")
+                if not expression:
+                    if dice_type == "custom" and isinstance(custom_value, int) and custom_value > 0:
+                        expression = f"1d{custom_value}"
+                    elif isinstance(dice_type, str) and dice_type[1:].isdigit():
+                        expression = f"1{dice_type}"
+                    else:
+                        expression = "1d20" # Default d20
 
-                result = random.randint(1, max_value)
+                try:
+                    dice_roll = dice.roll(str(expression))
+                except dice.DiceError as e:
+                    await manager.send_personal_message({"type": "error", "data": {"message": str(e)}}, user_id)
+                    continue
+                result = dice_roll.total
+                if message_data.get("expression"):
+                    dice_type = dice_roll.expression.notation
 
                 roller_id = user_id
                 roller_nickname = current_user["nickname"]
@@ -77,7 +128,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                 # If the roll is for a different character (NPC or another player, initiated by master)
                 if character_id and character_id != user_id and current_user.get("isMaster"):
                     target_char = await db.get_user(character_id) # Check if it's a player
-                    if target_char:
+                    if target_char and target_char.get("campaignId") == campaign_id:
                         roller_nickname = target_char["nickname"]
                         roller_id = character_id
                     else:
@@ -89,65 +140,124 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                             # Decide how to store/attribute NPC rolls. Storing with master_id for now.
                             roller_id = user_id # Or character_id if NPCs should have own dice history
 
-                await db.add_dice_result(roller_id, result) # Add to roller's history
+                message_id = str(uuid.uuid4())
+                if len(dice_roll.terms) == 1 and len(dice_roll.terms[0].rolls) == 1:
+                    content = f"{roller_nickname} rolou {dice_type}: {result}"
+                else:
+                    content = f"{roller_nickname} rolou {dice_type}: {dice_roll.breakdown} = {result}"
+                async with db.unit_of_work():
+                    await db.add_dice_result(roller_id, result) # Add to roller's history
+                    message = await db.create_message(message_id, user_id, roller_nickname, content, True, dice_type, result)
+
+                await manager.broadcast_message_created(message)
+                await manager.broadcast_users(campaign_id) # Update dice history display
+
+            elif message_type == "dice_odds":
+                # Consulta de probabilidades: responde só a quem perguntou
+                target = message_data.get("target")
+                try:
+                    odds = await dice_odds.get_odds(str(message_data.get("expression") or "1d20"))
+                except dice.DiceError as e:
+                    await manager.send_personal_message({"type": "error", "data": {"message": str(e)}}, user_id)
+                    continue
+                await manager.send_personal_message(
+                    {"type": "dice_odds", "data": odds.as_dict(target if isinstance(target, int) else None)}, user_id
+                )
+
+            elif message_type == "batch_dice_roll" and current_user.get("isMaster"):
+                # Mesma expressão para vários personagens/NPCs (ex.: iniciativa de uma horda)
+                expression = message_data.get("expression") or "1d20"
+                character_ids = message_data.get("characterIds")
+                if not isinstance(character_ids, list) or not character_ids:
+                    continue
+
+                # Jogadores vêm só do diretório em memória (NPCs nunca estão nele, e
+                # get_user iria ao banco a cada um); os NPCs do mestre vêm de uma
+                # única consulta, feita só se algum alvo não for jogador
+                targets = []
+                npcs_by_id = None
+                for character_id in character_ids:
+                    target_char = db.users.get(character_id)
+                    if target_char and target_char.get("campaignId") == campaign_id:
+                        targets.append((character_id, target_char["nickname"]))
+                        continue
+                    if npcs_by_id is None:
+                        npcs_by_id = {npc["id"]: npc for npc in await db.get_npcs(user_id)}
+                    npc_found = npcs_by_id.get(character_id)
+                    if npc_found:
+                        # Rolagens de NPC ficam no histórico do mestre, como no dice_roll
+                        targets.append((user_id, npc_found["nickname"]))
+                if not targets:
+                    continue
 
+                try:
+                    rolls = dice.roll_many(str(expression), len(targets))
+                except dice.DiceError as e:
+                    await manager.send_personal_message({"type": "error", "data": {"message": str(e)}}, user_id)
+                    continue
+
+                dice_type = rolls[0].expression.notation
+                lines = [f"{current_user['nickname']} rolou {dice_type} para {len(targets)} personagens:"]
+                lines += [f"{nickname}: {roll.breakdown} = {roll.total}" for (_, nickname), roll in zip(targets, rolls)]
                 message_id = str(uuid.uuid4())
-                content = f"{roller_nickname} rolou {dice_type}: {result}"
-                await db.create_message(message_id, user_id, roller_nickname, content, True, dice_type, result)
+                async with db.unit_of_work():
+                    await db.add_dice_results([(roller_id, roll.total) for (roller_id, _), roll in zip(targets, rolls)])
+                    message = await db.create_message(message_id, user_id, current_user["nickname"], "\n".join(lines), True, dice_type)
 
-                await manager.broadcast_messages()
-                await manager.broadcast_users() # Update dice history display
+                # Um único evento de chat e um único broadcast de usuários para o lote inteiro
+                await manager.broadcast_message_created(message)
+                await manager.broadcast_users(campaign_id)
 
             elif message_type == "update_character" and isinstance(message_data.get("data"), dict):
                 character_data = message_data["data"]
                 logger.info(f"WebSocket: Updating character {user_id}")
-                current_user = await db.get_user(user_id) # Fetch current user data for defaults
-                if not current_user:
-                    logger.warning(f"WebSocket: User {user_id} not found during update_character.")
-                    continue # Skip if user somehow disappeared
 
                 try:
-                    if "attributes" in character_data:
-                        await db.update_character_attributes(user_id, character_data["attributes"])
-                    if "skills" in character_data:
-                        await db.update_character_skills(user_id, character_data["skills"])
-                    if "abilities" in character_data:
-                        await db.update_character_abilities(user_id, character_data["abilities"])
-                    if "inventory" in character_data:
-                        await db.update_character_inventory(user_id, character_data["inventory"])
-                    if "currency" in character_data:
-                        await db.update_character_currency(user_id, character_data["currency"])
-
-                    # --- Adicionar atualização de Vida --- START ---
-                    health_updated = False
-                    if "maxHealthPoints" in character_data:
-                        max_hp = max(1, character_data["maxHealthPoints"])
-                        await db.update_user_max_health(user_id, max_hp)
-                        health_updated = True
-                    else:
-                         # Use current max HP if not being updated
-                        max_hp = current_user.get("maxHealthPoints", 10)
-                    
-                    if "healthPoints" in character_data:
-                        hp = min(max(0, character_data["healthPoints"]), max_hp)
-                        await db.update_user_health(user_id, hp)
-                        health_updated = True
-                    elif health_updated: # If only maxHP was updated, check if current HP exceeds new max
-                        current_hp = current_user.get("healthPoints", 10)
-                        if current_hp > max_hp:
-                             await db.update_user_health(user_id, max_hp)
-                             health_updated = True # Technically updated
-                    # --- Adicionar atualização de Vida --- END ---
-
-                    updated_character = await db.get_character(user_id)
+                    # Leituras e escritas do comando em uma única conexão e transação
+                    async with db.unit_of_work():
+                        if "attributes" in character_data:
+                            await db.update_character_attributes(user_id, character_data["attributes"])
+                        if "skills" in character_data:
+                            await db.update_character_skills(user_id, character_data["skills"])
+                        if "abilities" in character_data:
+                            await db.update_character_abilities(user_id, character_data["abilities"])
+                        if "inventory" in character_data:
+                            await db.update_character_inventory(user_id, character_data["inventory"])
+                        if "currency" in character_data:
+                            await db.update_character_currency(user_id, character_data["currency"])
+
+                        # --- Adicionar atualização de Vida --- START ---
+                        health_updated = False
+                        if "maxHealthPoints" in character_data:
+                            max_hp = max(1, character_data["maxHealthPoints"])
+                            await db.update_user_max_health(user_id, max_hp)
+                            health_updated = True
+                        else:
+                             # Use current max HP if not being updated
+                            max_hp = current_user.get("maxHealthPoints", 10)
+
+                        if "healthPoints" in character_data:
+                            hp = min(max(0, character_data["healthPoints"]), max_hp)
+                            await db.update_user_health(user_id, hp)
+                            health_updated = True
+                        elif health_updated: # If only maxHP was updated, check if current HP exceeds new max
+                            current_hp = current_user.get("healthPoints", 10)
+                            if current_hp > max_hp:
+                                 await db.update_user_health(user_id, max_hp)
+                                 health_updated = True # Technically updated
+                        # --- Adicionar atualização de Vida --- END ---
+
+                        updated_character = await db.get_character(user_id)
+
+                    # Envios só depois do commit, para os clientes não lerem dados ainda não gravados
                     if updated_character:
-                        await websocket.send_text(json.dumps({"type": "character", "data": updated_character}, default=datetime_serializer))
+                        await manager.send_personal_message({"type": "character", "data": updated_character}, user_id, "character")
                     else:
                          logger.warning(f"WebSocket: Character {user_id} not found after update attempt.")
                     
                     # --- Adicionar Broadcast após atualização de vida ---        
                     if health_updated:
-                        await manager.broadcast_users()
+                        await manager.broadcast_users(campaign_id)
                     # --- Fim do Broadcast ---
                          
                 except Exception as e:
@@ -156,9 +266,9 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             elif message_type == "update_health" and current_user.get("isMaster"):
                 target_id = message_data.get("userId")
                 health_points = message_data.get("healthPoints")
-                if target_id is not None and isinstance(health_points, int):
+                if target_id is not None and isinstance(health_points, int) and await _campaign_member(target_id, campaign_id):
                     await db.update_user_health(target_id, health_points)
-                    await manager.broadcast_users()
+                    await manager.broadcast_users(campaign_id)
 
             # --- Master-only actions --- START ---
             elif current_user.get("isMaster"):
@@ -166,68 +276,67 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                     item_data = message_data["item"]
                     item_id = item_data.get("id", f"item-{uuid.uuid4()}") # Allow frontend generated ID or create new
                     await db.create_shared_item(item_id, user_id, item_data)
-                    await manager.broadcast_shared_items()
+                    await manager.broadcast_shared_items(campaign_id)
 
                 elif message_type == "update_shared_item" and message_data.get("item"):
                     item_data = message_data["item"]
                     item_id = item_data.get("id")
                     if item_id:
-                        await db.update_shared_item(item_id, item_data)
-                        await manager.broadcast_shared_items()
+                        # Só itens da campanha do mestre; o broadcast vai para a campanha do item
+                        item_campaign = await db.update_shared_item(item_id, item_data, campaign_id)
+                        if item_campaign:
+                            await manager.broadcast_shared_items(item_campaign)
 
                 elif message_type == "delete_shared_item" and message_data.get("itemId"):
                     item_id = message_data["itemId"]
-                    await db.delete_shared_item(item_id)
-                    await manager.broadcast_shared_items()
+                    item_campaign = await db.delete_shared_item(item_id, campaign_id)
+                    if item_campaign:
+                        await manager.broadcast_shared_items(item_campaign)
 
                 elif message_type == "add_shared_ability" and message_data.get("ability"):
                     ability_data = message_data["ability"]
                     ability_id = ability_data.get("id", f"ability-{uuid.uuid4()}")
                     await db.create_shared_ability(ability_id, user_id, ability_data)
-                    await manager.broadcast_shared_abilities()
+                    await manager.broadcast_shared_abilities(campaign_id)
 
                 elif message_type == "update_shared_ability" and message_data.get("ability"):
                     ability_data = message_data["ability"]
                     ability_id = ability_data.get("id")
                     if ability_id:
-                        await db.update_shared_ability(ability_id, ability_data)
-                        await manager.broadcast_shared_abilities()
+                        ability_campaign = await db.update_shared_ability(ability_id, ability_data, campaign_id)
+                        if ability_campaign:
+                            await manager.broadcast_shared_abilities(ability_campaign)
 
                 elif message_type == "delete_shared_ability" and message_data.get("abilityId"):
                     ability_id = message_data["abilityId"]
-                    await db.delete_shared_ability(ability_id)
-                    await manager.broadcast_shared_abilities()
+                    ability_campaign = await db.delete_shared_ability(ability_id, campaign_id)
+                    if ability_campaign:
+                        await manager.broadcast_shared_abilities(ability_campaign)
 
                 elif message_type == "add_item_to_character" and message_data.get("userId") and message_data.get("item"):
                     target_id = message_data["userId"]
                     item_data = message_data["item"]
+                    if not await _campaign_member(target_id, campaign_id):
+                        continue
                     await db.add_item_to_character(target_id, item_data)
-                    # Notify target client
-                    target_character = await db.get_character(target_id)
-                    if target_character:
-                        await manager.send_personal_message(
-                            json.dumps({"type": "character", "data": target_character}, default=datetime_serializer),
-                            target_id
-                        )
+                    # Notify target client (it may be connected to another worker)
+                    await manager.send_character(target_id)
 
                 elif message_type == "add_ability_to_character" and message_data.get("userId") and message_data.get("ability"):
                     target_id = message_data["userId"]
                     ability_data = message_data["ability"]
+                    if not await _campaign_member(target_id, campaign_id):
+                        continue
                     await db.add_ability_to_character(target_id, ability_data)
-                    # Notify target client
-                    target_character = await db.get_character(target_id)
-                    if target_character:
-                        await manager.send_personal_message(
-                            json.dumps({"type": "character", "data": target_character}, default=datetime_serializer),
-                            target_id
-                        )
+                    # Notify target client (it may be connected to another worker)
+                    await manager.send_character(target_id)
             # --- Master-only actions --- END ---
             # --- Message Handling Logic --- END ---
 
     except WebSocketDisconnect:
         print(f"WebSocket disconnected for user: {user_id}")
-        await manager.disconnect(user_id)
-        await manager.broadcast_users() # Notify others about the disconnection
+        await manager.disconnect(user_id, websocket)
+        await manager.broadcast_users(campaign_id) # Notify others about the disconnection
 
     except Exception as e:
         # Log the error for debugging
@@ -238,5 +347,5 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
         except Exception as close_e:
             print(f"Error closing websocket for user {user_id}: {close_e}")
         # Ensure manager knows the connection is gone
-        await manager.disconnect(user_id)
-        await manager.broadcast_users() # Notify others 
\ No newline at end of file
+        await manager.disconnect(user_id, websocket)
+        await manager.broadcast_users(campaign_id) # Notify others 
\ No newline at end of file
@@ -1,136 +1,372 @@
 from fastapi import WebSocket
-from typing import Dict
-import json
-from datetime import datetime
+from typing import Dict, Optional, Union
+from collections import deque
+import asyncio
+import logging
+from .event_bus import EventBus
+from .serialization import DEFAULT_PROTOCOL, PROTOCOLS, gzip_frame, negotiate_protocol
+
+logger = logging.getLogger(__name__)
+
+# Tempo máximo (segundos) para um envio a um único cliente
+SEND_TIMEOUT = 5.0
+# Falhas/timeouts consecutivos antes de desconectar o cliente
+MAX_SEND_FAILURES = 3
+# Frames aguardando envio por cliente antes de considerá-lo travado
+MAX_QUEUED_FRAMES = 256
+# Frames que substituem completamente o anterior do mesmo tipo: se um ainda
+# não foi enviado, o mais novo toma o lugar dele (eventos de chat/dados não)
+SNAPSHOT_FRAME_TYPES = {"users", "character", "shared_items", "shared_abilities", "npcs"}
 
 # Import db instance (assuming it will be available from app_setup)
 # We will adjust imports later if needed
 # from .app_setup import db
 
+class Frame:
+    """Payload de um frame, codificado (e comprimido) sob demanda e no máximo
+    uma vez por protocolo, não importa para quantos clientes seja enviado."""
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self._encoded = {}
+
+    def encode(self, protocol, compress: bool = False):
+        key = (protocol.name, compress)
+        data = self._encoded.get(key)
+        if data is None:
+            if compress:
+                data = gzip_frame(self.encode(protocol))
+            else:
+                data = self._encode(protocol)
+            self._encoded[key] = data
+        return data
+
+    def _encode(self, protocol):
+        return protocol.encode(self.payload)
+
+class ListFrame(Frame):
+    """Frame {"type": frame_type, "data": entries} cujas entradas são codificadas
+    uma vez por protocolo em `entry_cache`, compartilhado entre os frames de um
+    mesmo broadcast que repetem as mesmas entradas."""
+
+    def __init__(self, frame_type: str, entries: list, entry_cache: dict):
+        super().__init__({"type": frame_type, "data": entries})
+        self.frame_type = frame_type
+        self.entries = entries
+        self.entry_cache = entry_cache
+
+    def _encode(self, protocol):
+        encoded = []
+        for entry in self.entries:
+            key = (id(entry), protocol.name)
+            data = self.entry_cache.get(key)
+            if data is None:
+                data = self.entry_cache[key] = protocol.dumps(entry)
+            encoded.append(data)
+        return protocol.encode_list(self.frame_type, encoded)
+
+class ClientConnection:
+    """Fila de saída limitada de um cliente, esvaziada por uma task escritora própria."""
+
+    def __init__(self, websocket: WebSocket, user_id: str, campaign_id: str, manager: "ConnectionManager",
+                 protocol=DEFAULT_PROTOCOL, compress: bool = False):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.campaign_id = campaign_id
+        self.manager = manager
+        self.protocol = protocol
+        self.compress = compress # Frames grandes vão comprimidos com gzip
+        self._queue = deque() # entradas [frame_type, frame]; frame None = substituído
+        self._queued = 0
+        self._pending_snapshots: Dict[str, list] = {}
+        self._wakeup = asyncio.Event()
+        self._writer = asyncio.create_task(self._run())
+
+    def enqueue(self, message: Frame, frame_type: Optional[str] = None) -> bool:
+        """Agenda o envio. Retorna False se a fila estourou."""
+        if frame_type in SNAPSHOT_FRAME_TYPES:
+            previous = self._pending_snapshots.pop(frame_type, None)
+            if previous is not None:
+                previous[1] = None
+                self._queued -= 1
+        if self._queued >= MAX_QUEUED_FRAMES:
+            return False
+
+        entry = [frame_type, message]
+        self._queue.append(entry)
+        self._queued += 1
+        if frame_type in SNAPSHOT_FRAME_TYPES:
+            self._pending_snapshots[frame_type] = entry
+        self._wakeup.set()
+        return True
+
+    async def _run(self):
+        failures = 0
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._queue:
+                entry = self._queue.popleft()
+                frame_type, message = entry
+                if message is None:
+                    continue # Substituída por um snapshot mais novo
+                self._queued -= 1
+                if self._pending_snapshots.get(frame_type) is entry:
+                    del self._pending_snapshots[frame_type]
+
+                try:
+                    data = message.encode(self.protocol, self.compress)
+                except Exception as e:
+                    logger.error(f"Error encoding {frame_type} frame for {self.user_id}: {e!r}")
+                    continue
+
+                try:
+                    if isinstance(data, bytes):
+                        await asyncio.wait_for(self.websocket.send_bytes(data), timeout=SEND_TIMEOUT)
+                    else:
+                        await asyncio.wait_for(self.websocket.send_text(data), timeout=SEND_TIMEOUT)
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    logger.warning(f"Error sending personal message to {self.user_id} ({failures}/{MAX_SEND_FAILURES}): {e!r}")
+                    if failures >= MAX_SEND_FAILURES:
+                        self.manager.evict(self)
+                        return
+
+    async def close(self):
+        """Para a task escritora e fecha o socket."""
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=1011), timeout=SEND_TIMEOUT)
+        except Exception:
+            pass # The socket is most likely already dead
+
 class ConnectionManager:
     def __init__(self):
         # Import db here to avoid circular dependency if db needs manager
         from .app_setup import db
         self.db = db
-        self.active_connections: Dict[str, WebSocket] = {}
+        self.active_connections: Dict[str, ClientConnection] = {}
+        # Conexões agrupadas por campanha (mesa): broadcasts só percorrem a sala
+        self.rooms: Dict[str, Dict[str, ClientConnection]] = {}
+        # Mutações passam pelo barramento para chegar aos sockets de todos os workers
+        self.bus = EventBus(db, self._handle_event)
+        # Fechamentos de sockets despejados em andamento (referência para a task não ser coletada)
+        self._closing = set()
+
+    async def connect(self, websocket: WebSocket, user_id: str, campaign_id: str) -> ClientConnection:
+        # Formato dos frames negociado no handshake (Sec-WebSocket-Protocol); JSON por padrão
+        subprotocol = negotiate_protocol(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        previous = self.active_connections.get(user_id)
+        if previous:
+            self._remove(previous)
+        protocol = PROTOCOLS[subprotocol] if subprotocol else DEFAULT_PROTOCOL
+        # Clientes que sabem descomprimir pedem frames gzip com ?compress=gzip
+        compress = websocket.query_params.get("compress") == "gzip"
+        connection = ClientConnection(websocket, user_id, campaign_id, self, protocol, compress)
+        self.active_connections[user_id] = connection
+        self.rooms.setdefault(campaign_id, {})[user_id] = connection
+        return connection
 
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
+    def _remove(self, connection: ClientConnection):
+        if self.active_connections.get(connection.user_id) is connection:
+            del self.active_connections[connection.user_id]
+        room = self.rooms.get(connection.campaign_id)
+        if room is not None and room.get(connection.user_id) is connection:
+            del room[connection.user_id]
+            if not room:
+                del self.rooms[connection.campaign_id]
+        # A task escritora que despeja o próprio cliente não pode se cancelar:
+        # ela ainda precisa fechar o socket em close()
+        if connection._writer is not asyncio.current_task():
+            connection._writer.cancel()
 
-    async def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+    async def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None):
+        """Remove a conexão do usuário. Se `websocket` for informado, só remove
+           se ainda for a conexão ativa (o usuário pode ter reconectado)."""
+        current = self.active_connections.get(user_id)
+        if current is not None and (websocket is None or current.websocket is websocket):
+            self._remove(current)
             # Optional: Update user status or perform cleanup in DB if needed
 
-    async def send_personal_message(self, message: str, user_id: str):
-        websocket = self.active_connections.get(user_id)
-        if websocket:
-            try:
-                await websocket.send_text(message)
-            except Exception as e:
-                print(f"Error sending personal message to {user_id}: {e}")
-                # Consider disconnecting if send fails consistently
-                # await self.disconnect(user_id)
-
-    async def broadcast(self, message: str):
-        # Broadcast genérico - usar com cuidado se a mensagem contiver dados sensíveis
-        user_ids = list(self.active_connections.keys())
-        for user_id in user_ids:
-            await self.send_personal_message(message, user_id)
+    def evict(self, connection: ClientConnection):
+        """Desconecta um cliente que não está conseguindo receber mensagens.
 
-    # --- Broadcasts Específicos com Serialização e Filtragem ---
+        A remoção é imediata; o fechamento do socket (que pode levar até
+        SEND_TIMEOUT) roda em segundo plano, para não segurar o broadcast
+        que está entregando aos outros clientes da sala."""
+        logger.warning(f"Evicting unresponsive client {connection.user_id}")
+        self._remove(connection)
+        task = asyncio.create_task(connection.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def send_personal_message(self, message: Union[Frame, dict], user_id: str, frame_type: Optional[str] = None):
+        """Coloca a mensagem (um Frame ou o payload a codificar) na fila de saída
+        do cliente; a codificação e o envio são feitos pela task escritora."""
+        connection = self.active_connections.get(user_id)
+        if connection is None:
+            return
+        frame = message if isinstance(message, Frame) else Frame(message)
+        if not connection.enqueue(frame, frame_type):
+            logger.warning(f"Outbound queue full for {user_id}")
+            self.evict(connection)
+
+    async def broadcast(self, message: Union[Frame, dict], campaign_id: str, frame_type: Optional[str] = None):
+        # Broadcast genérico para a sala - usar com cuidado se a mensagem contiver dados sensíveis
+        # Cada cliente tem sua própria fila: um cliente lento não atrasa os demais.
+        # O mesmo Frame é compartilhado, então cada formato é codificado uma única vez
+        frame = message if isinstance(message, Frame) else Frame(message)
+        for user_id in list(self.rooms.get(campaign_id, {}).keys()):
+            await self.send_personal_message(frame, user_id, frame_type)
+
+    # --- Eventos entre workers ---
+    # Os métodos broadcast_* publicam no barramento; cada worker (inclusive o
+    # que publicou) recebe o evento em _handle_event e envia aos seus sockets.
 
-    async def broadcast_users(self):
-        """Envia a lista de usuários atualizada para cada cliente conectado,
-           filtrando o characterId se necessário."""
-        from .app_setup import datetime_serializer # Importar serializer
-        import logging # Importar logging
-        logger = logging.getLogger(__name__)
+    async def _handle_event(self, event: str, payload: dict, local: bool):
+        if event == "users":
+            campaign_id = payload["campaignId"]
+            if not self.rooms.get(campaign_id):
+                # Ninguém da campanha conectado aqui: em vez de reler a campanha,
+                # só invalida o diretório (as entradas voltam do banco sob demanda)
+                if not local:
+                    self.db.users.forget_campaign(campaign_id)
+                return
+            if not local:
+                # Outro worker alterou usuários: atualizar o diretório em memória
+                await self.db.refresh_campaign_users(campaign_id)
+            await self._send_users(campaign_id)
+        elif event == "message_created":
+            if not self.rooms:
+                return # Sem sockets neste worker, não vale reler a mensagem
+            message = payload.get("message") or await self.db.get_message(payload["messageId"])
+            if message:
+                await self._send_message_created(message)
+        elif event == "shared_items":
+            await self._send_shared_items(payload["campaignId"])
+        elif event == "shared_abilities":
+            await self._send_shared_abilities(payload["campaignId"])
+        elif event == "npcs":
+            await self._send_npcs(payload["masterId"])
+        elif event == "character":
+            await self._send_character(payload["userId"])
+        else:
+            logger.warning(f"Unknown event bus event: {event}")
 
+    async def broadcast_users(self, campaign_id: str):
+        await self.bus.publish("users", {"campaignId": campaign_id})
+
+    async def broadcast_message_created(self, message: dict):
+        """Envia apenas a mensagem recém-criada; o histórico completo só vai no join."""
         try:
-            raw_users = await self.db.get_users()
-            connected_user_ids = list(self.active_connections.keys()) # Copiar chaves
-            logger.debug(f"Broadcasting users update to {len(connected_user_ids)} clients.")
+            await self.bus.publish("message_created", {"message": message})
+        except ValueError:
+            # Grande demais para o NOTIFY: cada worker relê a mensagem pelo id
+            await self.bus.publish("message_created", {"messageId": message["id"]})
 
-            # Cache master status to avoid multiple DB calls per user
-            recipient_statuses = {}
-            for uid in connected_user_ids:
-                recipient_user = await self.db.get_user(uid)
-                if recipient_user:
-                    recipient_statuses[uid] = recipient_user.get("isMaster", False)
-                else:
-                    logger.warning(f"Recipient user {uid} not found in DB during broadcast_users.")
+    async def broadcast_shared_items(self, campaign_id: str):
+        await self.bus.publish("shared_items", {"campaignId": campaign_id})
 
-            for user_id, websocket in self.active_connections.items():
-                is_recipient_master = recipient_statuses.get(user_id, False)
-                users_for_client = []
+    async def broadcast_shared_abilities(self, campaign_id: str):
+        await self.bus.publish("shared_abilities", {"campaignId": campaign_id})
 
-                for user_data in raw_users:
-                    if not isinstance(user_data, dict):
-                         logger.warning(f"Skipping non-dict user_data item: {type(user_data)}")
-                         continue
-                    user_copy = user_data.copy()
+    async def broadcast_npcs(self, master_id: str):
+        """Envia a lista atualizada de NPCs especificamente para o mestre conectado."""
+        await self.bus.publish("npcs", {"masterId": master_id})
+
+    async def send_character(self, user_id: str):
+        """Envia a ficha atualizada ao usuário, em qualquer worker em que ele esteja conectado."""
+        await self.bus.publish("character", {"userId": user_id})
 
-                    # Ocultar ID de outros personagens se o destinatário não for mestre
-                    if not is_recipient_master and user_copy.get('id') != user_id:
-                        user_copy.pop('characterId', None)
+    # --- Broadcasts Específicos com Serialização e Filtragem ---
 
-                    # Garantir que createdAt seja serializável
-                    if 'createdAt' in user_copy and isinstance(user_copy['createdAt'], datetime):
-                         user_copy['createdAt'] = user_copy['createdAt'].isoformat()
-                    # Pop non-serializable fields if needed (like raw datetime)
-                    user_copy.pop('created_at', None) # Remove if already serialized or problematic
+    @staticmethod
+    def _master_ids(raw_users):
+        """Ids dos mestres na lista: só eles veem o characterId."""
+        return {u.get('id') for u in raw_users if u.get('isMaster') and not u.get('isNpc')}
 
-                    users_for_client.append(user_copy)
+    @classmethod
+    def users_for(cls, raw_users, recipient_id: str):
+        """Lista de usuários como o destinatário pode vê-la: só o mestre vê o
+           characterId. O jogador já recebe o próprio no login e no frame
+           `character`, então todos os jogadores compartilham a mesma lista."""
+        if recipient_id in cls._master_ids(raw_users):
+            return raw_users
+        users = []
+        for user_data in raw_users:
+            if 'characterId' in user_data:
+                user_data = user_data.copy()
+                user_data.pop('characterId')
+            users.append(user_data)
+        return users
 
-                message = json.dumps({"type": "users", "data": users_for_client}, default=datetime_serializer)
-                await self.send_personal_message(message, user_id)
+    async def _send_users(self, campaign_id: str):
+        """Envia a lista de usuários da campanha para cada cliente conectado nela,
+           filtrando o characterId se necessário.
+
+           Há um frame por classe de visibilidade (mestre e jogador),
+           codificado e comprimido uma vez por protocolo para toda a sala."""
+        if not self.rooms.get(campaign_id):
+            return # Nenhum socket da campanha neste worker: nada a montar
+        try:
+            raw_users = await self.db.get_users(campaign_id)
+            connected_user_ids = list(self.rooms.get(campaign_id, {}).keys()) # Copiar chaves
+            logger.debug(f"Broadcasting users update to {len(connected_user_ids)} clients.")
+
+            # Uma lista por classe de visibilidade, montada por users_for (a mesma
+            # regra do snapshot do join) na primeira vez que um destinatário dela aparece
+            entry_cache = {} # Entradas codificadas compartilhadas pelos dois frames
+            frames = {}
+            master_ids = self._master_ids(raw_users)
+
+            for user_id in connected_user_ids:
+                is_master = user_id in master_ids
+                message = frames.get(is_master)
+                if message is None:
+                    message = frames[is_master] = ListFrame("users", self.users_for(raw_users, user_id), entry_cache)
+                await self.send_personal_message(message, user_id, "users")
 
         except Exception as e:
             logger.error(f"Error during broadcast_users: {e}", exc_info=True)
             # Consider a general error broadcast or logging more details
 
-    async def broadcast_messages(self):
-        from .app_setup import datetime_serializer
-        messages = await self.db.get_messages()
-        await self.broadcast(json.dumps({"type": "messages", "data": messages}, default=datetime_serializer))
+    async def _send_message_created(self, message: dict):
+        await self.broadcast({"type": "message_created", "data": message}, message["campaignId"])
 
-    async def broadcast_shared_items(self):
-        from .app_setup import datetime_serializer
-        items = await self.db.get_shared_items()
-        await self.broadcast(json.dumps({"type": "shared_items", "data": items}, default=datetime_serializer))
-
-    async def broadcast_shared_abilities(self):
-        from .app_setup import datetime_serializer
-        abilities = await self.db.get_shared_abilities()
-        await self.broadcast(json.dumps({"type": "shared_abilities", "data": abilities}, default=datetime_serializer))
+    async def _send_shared_items(self, campaign_id: str):
+        if not self.rooms.get(campaign_id):
+            return
+        items = await self.db.get_shared_items(campaign_id=campaign_id)
+        await self.broadcast({"type": "shared_items", "data": items}, campaign_id, "shared_items")
 
-    async def broadcast_npcs(self, master_id: str):
-        """Envia a lista atualizada de NPCs especificamente para o mestre conectado."""
-        from .app_setup import datetime_serializer # Importar serializer
-        import logging
-        logger = logging.getLogger(__name__)
+    async def _send_shared_abilities(self, campaign_id: str):
+        if not self.rooms.get(campaign_id):
+            return
+        abilities = await self.db.get_shared_abilities(campaign_id=campaign_id)
+        await self.broadcast({"type": "shared_abilities", "data": abilities}, campaign_id, "shared_abilities")
 
-        websocket = self.active_connections.get(master_id)
-        if not websocket:
-            logger.warning(f"Attempted to broadcast NPCs to disconnected master: {master_id}")
+    async def _send_npcs(self, master_id: str):
+        if master_id not in self.active_connections:
+            # O mestre pode estar conectado em outro worker
             return
 
         try:
             npcs_list = await self.db.get_npcs(master_id)
-            # Ensure createdAt is serialized if present in npc data
-            serialized_npcs = []
-            for npc in npcs_list:
-                npc_copy = npc.copy()
-                if 'createdAt' in npc_copy and isinstance(npc_copy['createdAt'], datetime):
-                     npc_copy['createdAt'] = npc_copy['createdAt'].isoformat()
-                # Remove original potentially non-serializable field if necessary
-                npc_copy.pop('created_at', None)
-                serialized_npcs.append(npc_copy)
-
-            message = json.dumps({"type": "npcs", "data": serialized_npcs}, default=datetime_serializer)
-            await self.send_personal_message(message, master_id)
+            message = {"type": "npcs", "data": npcs_list}
+            await self.send_personal_message(message, master_id, "npcs")
             logger.debug(f"Sent NPC update to master {master_id}")
         except Exception as e:
-            logger.error(f"Error broadcasting NPCs to master {master_id}: {e}", exc_info=True) 
\ No newline at end of file
+            logger.error(f"Error broadcasting NPCs to master {master_id}: {e}", exc_info=True) 
+
+    async def _send_character(self, user_id: str):
+        if user_id not in self.active_connections:
+            return
+        character = await self.db.get_character(user_id)
+        if character:
+            await self.send_personal_message(
+                {"type": "character", "data": character},
+                user_id, "character"
+            )
@@ -26,7 +26,7 @@ export default function ChatContainer({ messages, currentUser, users, npcs }) {
           <span className={message.userId === users.find((u) => u.isMaster)?.id ? "text-red-500 font-bold" : ""}>
             {nickname}
           </span>
-          <span> rolou{restOfMessage}</span>
+          <span className="whitespace-pre-line"> rolou{restOfMessage}</span>
         </>
       )
     }
@@ -26,7 +26,17 @@ export function AppProvider({ children }) {
       socketRef.current.close()
     }
 
-    const socket = new WebSocket(`${WS_URL}/ws/${userId}`)
+    // Navegadores com DecompressionStream recebem os frames grandes comprimidos com gzip
+    const supportsGzip = typeof DecompressionStream !== "undefined"
+    const socket = new WebSocket(`${WS_URL}/ws/${userId}${supportsGzip ? "?compress=gzip" : ""}`)
+    // Frames comprimidos são descomprimidos de forma assíncrona: a fila mantém a ordem
+    let pendingFrames = Promise.resolve()
+
+    const readFrame = async (payload) => {
+      if (typeof payload === "string") return payload
+      const stream = payload.stream().pipeThrough(new DecompressionStream("gzip"))
+      return new Response(stream).text()
+    }
 
     socket.onopen = () => {
       console.log("WebSocket connected")
@@ -34,13 +44,29 @@ export function AppProvider({ children }) {
     }
 
     socket.onmessage = (event) => {
-      try {
-        const data = JSON.parse(event.data)
+      pendingFrames = pendingFrames.then(() => handleFrame(event.data))
+    }
 
-        if (data.type === "users") {
+    const handleFrame = async (payload) => {
+      try {
+        const data = JSON.parse(await readFrame(payload))
+
+        if (data.type === "snapshot") {
+          const snapshot = data.data
+          setUsers(snapshot.users)
+          // Mantém mensagens que chegaram antes do snapshot e não estão nele
+          const lastSeq = snapshot.messages.length ? snapshot.messages[snapshot.messages.length - 1].seq : 0
+          setMessages((prev) => [...snapshot.messages, ...prev.filter((m) => m.seq > lastSeq)])
+          if (snapshot.character) setCharacter(snapshot.character)
+          setSharedItems(snapshot.sharedItems)
+          setSharedAbilities(snapshot.sharedAbilities)
+          if (snapshot.npcs) setNpcs(snapshot.npcs)
+        } else if (data.type === "users") {
           setUsers(data.data)
         } else if (data.type === "messages") {
           setMessages(data.data)
+        } else if (data.type === "message_created") {
+          setMessages((prev) => [...prev, data.data])
         } else if (data.type === "character") {
           setCharacter(data.data)
         } else if (data.type === "shared_items") {
@@ -192,7 +218,8 @@ export function AppProvider({ children }) {
     }
   }
 
-  const rollDice = async (diceType, characterId = null, customValue) => {
+  // `expression` aceita notação completa (ex.: "4d6kh3", "2d20kl1+5", "8d6!") em um único frame
+  const rollDice = async (diceType, characterId = null, customValue, expression) => {
     if (!currentUser || !socketRef.current || socketRef.current.readyState !== WebSocket.OPEN) return
 
     try {
@@ -202,6 +229,7 @@ export function AppProvider({ children }) {
           diceType,
           characterId,
           customValue,
+          expression,
         }),
       )
     } catch (error) {
@@ -209,6 +237,23 @@ export function AppProvider({ children }) {
     }
   }
 
+  // Mestre: rola a mesma expressão para vários personagens/NPCs em um único frame
+  const rollDiceBatch = async (expression, characterIds) => {
+    if (!currentUser || !currentUser.isMaster || !socketRef.current || socketRef.current.readyState !== WebSocket.OPEN) return
+
+    try {
+      socketRef.current.send(
+        JSON.stringify({
+          type: "batch_dice_roll",
+          expression,
+          characterIds,
+        }),
+      )
+    } catch (error) {
+      console.error("Error rolling dice batch:", error)
+    }
+  }
+
   const updateCharacter = async (updatedCharacter) => {
     if (!currentUser || !socketRef.current || socketRef.current.readyState !== WebSocket.OPEN) return
 
@@ -493,6 +538,7 @@ export function AppProvider({ children }) {
     getCharacterDetails,
     sendMessage,
     rollDice,
+    rollDiceBatch,
     updateCharacter,
     updateHealth,
     addNpc,